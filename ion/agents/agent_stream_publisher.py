@@ -31,7 +31,7 @@ from interface.objects import StreamRoute
 from pyon.core.bootstrap import get_obj_registry
 from pyon.core.object import IonObjectDeserializer
 
-from ion.agents.populate_rdt import populate_rdt
+from ion.agents.populate_rdt import ParticleAccumulator
 
 class AgentStreamPublisher(object):
     """
@@ -39,6 +39,7 @@ class AgentStreamPublisher(object):
     def __init__(self, agent):
         self._agent = agent
         self._stream_defs = {}
+        self._rdt_templates = {}
         self._publishers = {}
         self._stream_greenlets = {}
         self._stream_buffers = {}
@@ -72,6 +73,7 @@ class AgentStreamPublisher(object):
                     stream_def = config['stream_definition_ref']
                     self._stream_defs[stream_name] = stream_def
                     rdt = RecordDictionaryTool(stream_definition_id=stream_def)    
+                self._rdt_templates[stream_name] = rdt
                 self._agent.aparam_streams[stream_name] = rdt.fields
                 self._agent.aparam_pubrate[stream_name] = 0
             except Exception as e:
@@ -94,7 +96,7 @@ class AgentStreamPublisher(object):
                                     stream_id=stream_id, stream_route=route)
                 self._publishers[stream_name] = publisher
                 self._stream_greenlets[stream_name] = None
-                self._stream_buffers[stream_name] = []
+                self._stream_buffers[stream_name] = ParticleAccumulator(self._rdt_templates[stream_name])
         
             except Exception as e:
                 errmsg = 'Instrument agent %s' % self._agent._proc_name
@@ -111,7 +113,7 @@ class AgentStreamPublisher(object):
         
         try:
             stream_name = sample['stream_name']
-            self._stream_buffers[stream_name].insert(0, sample)
+            self._stream_buffers[stream_name].append(sample)
             if not self._stream_greenlets[stream_name]:
                 self._publish_stream_buffer(stream_name)
 
@@ -127,7 +129,7 @@ class AgentStreamPublisher(object):
         for sample in sample_list:
             try:
                 stream_name = sample['stream_name']
-                self._stream_buffers[stream_name].insert(0, sample)
+                self._stream_buffers[stream_name].append(sample)
                 streams.add(stream_name)
             except KeyError:
                 log.warning('Instrument agent %s received sample with bad stream name %s.',
@@ -187,28 +189,19 @@ class AgentStreamPublisher(object):
         """
 
         try:
-            buf_len = len(self._stream_buffers[stream_name])
-            if buf_len == 0:
+            buf = self._stream_buffers[stream_name]
+            if len(buf) == 0:
                 return
 
-            stream_def = self._stream_defs[stream_name]
-            if isinstance(stream_def, str):
-                rdt = RecordDictionaryTool(stream_definition_id=stream_def)
-            else:
-                rdt = RecordDictionaryTool(stream_definition=stream_def)
-                
+            # Hand the accumulated columns off and start a new buffer.
+            template = self._rdt_templates[stream_name]
+            self._stream_buffers[stream_name] = ParticleAccumulator(template)
+            rdt = buf.to_rdt(template.empty_copy())
+
             publisher = self._publishers[stream_name]
-                
-            vals = []
-            for x in xrange(buf_len):
-                vals.append(self._stream_buffers[stream_name].pop())
-    
-            rdt = populate_rdt(rdt, vals)
-            
-            log.info('Outgoing granule: %s',
-                     ['%s: %s'%(k,v) for k,v in rdt.iteritems()])
-            log.info('Outgoing granule preferred timestamp: %s' % rdt['preferred_timestamp'][0])
-            log.info('Outgoing granule destined for stream: %s', stream_name)
+
+            log.debug('Outgoing granule: %s', rdt)
+            log.debug('Outgoing granule destined for stream: %s', stream_name)
             g = rdt.to_granule(data_producer_id=self._agent.resource_id, connection_id=self._connection_ID.hex,
                     connection_index=str(self._connection_index[stream_name]))
             
@@ -11,9 +11,13 @@ __license__ = 'Apache 2.0'
 
 from gevent import monkey
 monkey.patch_all()
-from gevent import spawn
-
+from gevent import spawn, Timeout
+from gevent.coros import RLock
+from gevent.event import AsyncResult
+from gevent.socket import wait_read, timeout as SocketTimeout
 
+from collections import deque
+import cPickle as pickle
 import time
 import thread
 
@@ -87,10 +91,16 @@ class DriverClient(object):
 
 class ZmqDriverClient(DriverClient):
     """
-    A class for communicating with a ZMQ-based driver process using python
-    thread for catching asynchronous driver events.
+    A class for communicating with a ZMQ-based driver process using
+    greenlets for catching command replies and asynchronous driver events.
+    The greenlets block cooperatively on socket readiness instead of polling.
+    Commands are pipelined over a DEALER socket: several may be outstanding
+    and the driver process replies to them in the order they were sent.
     """
-    
+    # Upper bound of a single wait for socket readiness. The zmq file
+    # descriptor is edge triggered, zmq.EVENTS is checked after each wakeup.
+    POLL_INTERVAL = .5
+
     def __init__(self, host, cmd_port, event_port):
         """
         Initialize members.
@@ -107,17 +117,42 @@ class ZmqDriverClient(DriverClient):
         self.zmq_context = None
         self.zmq_cmd_socket = None
         self.event_thread = None
+        self.reply_thread = None
         self.stop_event_thread = True
-        
+        self._pending = deque()
+        self._send_lock = RLock()
+
+    def _wait(self, sock, event, timeout=None):
+        """
+        Cooperatively wait until a zmq socket is ready for an event.
+        @param sock The zmq socket.
+        @param event zmq.POLLIN or zmq.POLLOUT.
+        @param timeout Seconds to wait, forever if None.
+        @retval True if the socket is ready, False on timeout.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while not sock.getsockopt(zmq.EVENTS) & event:
+            wait = self.POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return False
+            try:
+                wait_read(sock.getsockopt(zmq.FD), timeout=wait)
+            except SocketTimeout:
+                pass
+        return True
+
     def start_messaging(self, evt_callback=None):
         """
         Initialize and start messaging resources for the driver process client.
-        Initializes command socket for sending requests,
-        and starts event thread that listens for events from the driver
-        process independently of command request-reply.
+        Initializes command socket for sending requests and the greenlet
+        collecting their replies, and starts event thread that listens for
+        events from the driver process independently of command request-reply.
         """
         self.zmq_context = zmq.Context()
-        self.zmq_cmd_socket = self.zmq_context.socket(zmq.REQ)
+        # A DEALER socket, unlike REQ, allows several outstanding requests.
+        self.zmq_cmd_socket = self.zmq_context.socket(zmq.DEALER)
         self.zmq_cmd_socket.connect(self.cmd_host_string)
         log.info('Driver client cmd socket connected to %s.' %
                        self.cmd_host_string)
@@ -127,30 +162,73 @@ class ZmqDriverClient(DriverClient):
         log.info('Driver client event thread connected to %s.' %
                   self.event_host_string)
         self.evt_callback = evt_callback
-        
+        self.stop_event_thread = False
+
         def recv_evt_messages():
             """
             A looping function that monitors a ZMQ SUB socket for asynchronous
             driver events. Can be run as a thread or greenlet.
-            @param driver_client The client object that launches the thread.
             """
-            self.stop_event_thread = False
             while not self.stop_event_thread:
-                try:
-                    evt = self.zmq_evt_socket.recv_pyobj(flags=zmq.NOBLOCK)
-                    log.debug('got event: %s' % str(evt))
-                    if self.evt_callback:
-                        self.evt_callback(evt)
-                except zmq.ZMQError:
-                    time.sleep(.5)
-                except Exception, e:
-                    log.error('Driver client error reading from zmq event socket: ' + str(e))
-                    log.error('Driver client error type: ' + str(type(e)))                    
+                if not self._wait(self.zmq_evt_socket, zmq.POLLIN, self.POLL_INTERVAL):
+                    continue
+                # Drain the socket, the descriptor only signals new arrivals.
+                while not self.stop_event_thread:
+                    try:
+                        evt = self.zmq_evt_socket.recv_pyobj(flags=zmq.NOBLOCK)
+                    except zmq.ZMQError:
+                        break
+                    except Exception, e:
+                        log.error('Driver client error reading from zmq event socket: ' + str(e))
+                        log.error('Driver client error type: ' + str(type(e)))
+                        continue
+                    try:
+                        log.debug('got event: %s' % str(evt))
+                        if self.evt_callback:
+                            self.evt_callback(evt)
+                    except Exception, e:
+                        log.error('Driver client error handling event: ' + str(e))
+                        log.error('Driver client error type: ' + str(type(e)))
             log.info('Client event socket closed.')
 
         self.event_thread = spawn(recv_evt_messages)
+        self.reply_thread = spawn(self._recv_replies)
         log.info('Driver client messaging started: ' + str(self.event_thread))
-        
+
+    def _recv_replies(self):
+        """
+        A looping function that hands the replies arriving on the command
+        socket to the outstanding commands, oldest first.
+        """
+        while not self.stop_event_thread:
+            if not self._wait(self.zmq_cmd_socket, zmq.POLLIN, self.POLL_INTERVAL):
+                continue
+            while not self.stop_event_thread:
+                try:
+                    # The REP socket of the driver process prefixes an empty delimiter frame.
+                    frames = self.zmq_cmd_socket.recv_multipart(flags=zmq.NOBLOCK)
+                except zmq.ZMQError:
+                    break
+                if not self._pending:
+                    log.error('Driver client received a reply without a pending command.')
+                    continue
+                result = self._pending.popleft()
+                try:
+                    reply = pickle.loads(frames[-1])
+                except Exception, e:
+                    log.error('Driver client error reading from zmq socket: ' + str(e))
+                    log.error('Driver client error type: ' + str(type(e)))
+                    result.set_exception(SystemError('exception reading from zmq socket: ' + str(e)))
+                    continue
+
+                log.trace('Reply: %r', reply)
+                ## exception information is returned as a tuple (code, message, stacks)
+                if isinstance(reply, tuple) and len(reply)==3:
+                    log.error('Proceeding to raise exception with these args: ' + str(reply))
+                    result.set_exception(EXCEPTION_FACTORY.create_exception(*reply))
+                else:
+                    result.set(reply)
+
     def stop_messaging(self):
         """
         Close messaging resources for the driver process client. Close
@@ -158,79 +236,77 @@ class ZmqDriverClient(DriverClient):
         cause event thread to close event socket and context and terminate.
         Await event thread completion and return.
         """
-        if self.event_thread:
-            self.stop_event_thread = True
-            self.event_thread.join()
-            self.event_thread = None
+        self.stop_event_thread = True
+        for thread in (self.event_thread, self.reply_thread):
+            if thread:
+                thread.join()
+        self.event_thread = None
+        self.reply_thread = None
+        while self._pending:
+            self._pending.popleft().set_exception(SystemError('driver client messaging stopped'))
         if self.zmq_context:
             self.zmq_context.destroy(linger=1)
             self.zmq_context = None
         self.evt_callback = None
         log.info('Driver client messaging closed.')
-    
-    def cmd_dvr(self, cmd, *args, **kwargs):
+
+    def cmd_dvr_async(self, cmd, *args, **kwargs):
         """
-        Command a driver by request-reply messaging. Package command
-        message and send on blocking command socket. Block on same socket
-        to receive the reply. Return the driver reply.
+        Command a driver without waiting for the reply. Package command
+        message and send it on the command socket, waiting for the socket
+        to accept it if necessary.
         @param cmd The driver command identifier.
         @param args Positional arguments of the command.
         @param kwargs Keyword arguments of the command.
-        @retval Command result.
+        @retval AsyncResult holding the command result or exception.
         """
         # Package command dictionary.
         driver_timeout = kwargs.pop('driver_timeout', 600)
         msg = {'cmd':cmd,'args':args,'kwargs':kwargs}
 
         log.debug('Sending command %s.' % str(msg))
-        start_send = time.time()
-        while True:
+        result = AsyncResult()
+        # Replies are matched by order, so the pending queue has to follow the send order.
+        with self._send_lock:
             try:
-                # Attempt command send. Retry if necessary.
-                self.zmq_cmd_socket.send_pyobj(msg)
-                if msg == 'stop_driver_process':
-                    return 'driver stopping'
+                data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+                while True:
+                    try:
+                        # Empty delimiter frame expected by the REP socket of the driver process.
+                        self.zmq_cmd_socket.send_multipart(['', data], flags=zmq.NOBLOCK)
+                        break
+                    except zmq.ZMQError, e:
+                        if e.errno != zmq.EAGAIN:
+                            raise
+                    # Socket not ready to accept send. Wait and retry.
+                    if not self._wait(self.zmq_cmd_socket, zmq.POLLOUT, driver_timeout):
+                        raise InstDriverClientTimeoutError()
 
-                # Command sent, break out and wait for reply.
-                break    
-
-            except zmq.ZMQError:
-                # Socket not ready to accept send. Sleep and retry later.
-                time.sleep(.5)
-                delta = time.time() - start_send
-                if delta >= driver_timeout:
-                    raise InstDriverClientTimeoutError()
+            except InstDriverClientTimeoutError:
+                raise
 
             except Exception,e:
                 log.error('Driver client error writing to zmq socket: ' + str(e))
                 log.error('Driver client error type: ' + str(type(e)))
                 raise SystemError('exception writing to zmq socket: ' + str(e))
-            
-        log.trace('Awaiting reply.')
-        start_reply = time.time()
-        while True:
-            try:
-                # Attempt reply recv. Retry if necessary.
-                reply = self.zmq_cmd_socket.recv_pyobj(flags=zmq.NOBLOCK)
-                # Reply recieved, break and return.
-                break
-            except zmq.ZMQError:
-                # Socket not ready with the reply. Sleep and retry later.
-                time.sleep(.5)
-                delta = time.time() - start_reply
-                if delta >= driver_timeout:
-                    raise InstDriverClientTimeoutError()
 
-            except Exception,e:
-                log.error('Driver client error reading from zmq socket: ' + str(e))
-                log.error('Driver client error type: ' + str(type(e)))
-                raise SystemError('exception reading from zmq socket: ' + str(e))
-                
-        log.trace('Reply: %r', reply)
-
-        ## exception information is returned as a tuple (code, message, stacks)
-        if isinstance(reply, tuple) and len(reply)==3:
-            log.error('Proceeding to raise exception with these args: ' + str(reply))
-            raise EXCEPTION_FACTORY.create_exception(*reply)
-        else:
-            return reply
+            self._pending.append(result)
+        return result
+
+    def cmd_dvr(self, cmd, *args, **kwargs):
+        """
+        Command a driver by request-reply messaging. Send the command and
+        block cooperatively until its reply arrives. Return the driver reply.
+        @param cmd The driver command identifier.
+        @param args Positional arguments of the command.
+        @param kwargs Keyword arguments of the command.
+        @retval Command result.
+        """
+        driver_timeout = kwargs.get('driver_timeout', 600)
+        result = self.cmd_dvr_async(cmd, *args, **kwargs)
+
+        log.trace('Awaiting reply.')
+        try:
+            return result.get(timeout=driver_timeout)
+        except Timeout:
+            raise InstDriverClientTimeoutError()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_driver_client
+@file ion/agents/instrument/test/test_driver_client.py
+@brief Test cases for ZmqDriverClient against a stand-in driver process.
+"""
+
+__license__ = 'Apache 2.0'
+
+import subprocess
+import sys
+import time
+
+import gevent
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+from pyon.public import log
+from pyon.core.exception import InstDriverClientTimeoutError
+
+from ion.agents.instrument.driver_client import ZmqDriverClient
+
+# A driver process answering on a REP socket and publishing events on a PUB
+# socket, like the ZMQ driver processes. It prints the ports it bound.
+STAND_IN_DRIVER = '''
+import sys, time, zmq
+context = zmq.Context()
+cmd_socket = context.socket(zmq.REP)
+evt_socket = context.socket(zmq.PUB)
+cmd_port = cmd_socket.bind_to_random_port('tcp://127.0.0.1')
+evt_port = evt_socket.bind_to_random_port('tcp://127.0.0.1')
+sys.stdout.write('%d %d\\n' % (cmd_port, evt_port))
+sys.stdout.flush()
+while True:
+    msg = cmd_socket.recv_pyobj()
+    cmd, args, kwargs = msg['cmd'], msg['args'], msg['kwargs']
+    if cmd == 'process_echo':
+        cmd_socket.send_pyobj(kwargs.get('data', args))
+    elif cmd == 'sleep':
+        time.sleep(kwargs['seconds'])
+        cmd_socket.send_pyobj(kwargs['seconds'])
+    elif cmd == 'test_events':
+        for event in kwargs['events']:
+            evt_socket.send_pyobj(event)
+        cmd_socket.send_pyobj(len(kwargs['events']))
+    elif cmd == 'stop_driver_process':
+        cmd_socket.send_pyobj('driver stopping')
+        break
+context.destroy(linger=1)
+'''
+
+@attr('UNIT', group='mi')
+class TestZmqDriverClient(PyonTestCase):
+    """
+    Unit tests for the driver client using a local stand-in driver process.
+    """
+    def setUp(self):
+        self._process = subprocess.Popen([sys.executable, '-c', STAND_IN_DRIVER], stdout=subprocess.PIPE)
+        self.addCleanup(self._process.kill)
+        cmd_port, evt_port = map(int, self._process.stdout.readline().split())
+
+        self._events = []
+        self._client = ZmqDriverClient('127.0.0.1', cmd_port, evt_port)
+        self._client.start_messaging(self._events.append)
+        self.addCleanup(self._client.stop_messaging)
+
+    def test_round_trip(self):
+        count = 200
+        start = time.time()
+        for i in xrange(count):
+            self.assertEquals(self._client.cmd_dvr('process_echo', data=i), i)
+        latency = (time.time() - start) / count
+        log.info('Driver command round trip: %.6fs', latency)
+        self.assertLess(latency, 0.05)
+
+        start = time.time()
+        results = [self._client.cmd_dvr_async('process_echo', data=i) for i in xrange(count)]
+        self.assertEquals([result.get(timeout=10) for result in results], range(count))
+        log.info('Pipelined driver command round trip: %.6fs', (time.time() - start) / count)
+
+    def test_events(self):
+        self._client.cmd_dvr('process_echo', data='connected')
+        gevent.sleep(0.2) # Let the subscription propagate
+        events = ['I am event number %s!' % i for i in xrange(100)]
+        start = time.time()
+        self.assertEquals(self._client.cmd_dvr('test_events', events=events), len(events))
+        while len(self._events) < len(events) and time.time() - start < 5:
+            gevent.sleep(0.01)
+        log.info('Delivered %s events in %.6fs', len(events), time.time() - start)
+        self.assertEquals(self._events, events)
+
+    def test_timeout(self):
+        with self.assertRaises(InstDriverClientTimeoutError):
+            self._client.cmd_dvr('sleep', seconds=0.5, driver_timeout=0.1)
+        # The late reply is consumed by the timed out command
+        self.assertEquals(self._client.cmd_dvr('process_echo', data='after'), 'after')
+        self.assertEquals(self._client.cmd_dvr('stop_driver_process'), 'driver stopping')
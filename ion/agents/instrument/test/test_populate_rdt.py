@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.instrument.test.test_populate_rdt
+@file ion/agents/instrument/test/test_populate_rdt.py
+@brief Test cases for the columnar particle accumulator.
+"""
+
+__license__ = 'Apache 2.0'
+
+import base64
+import numpy
+
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+from pyon.public import log
+
+from ion.agents.populate_rdt import populate_rdt, ParticleAccumulator
+from ion.util.test.benchmark_helper import best_of
+
+
+class FakeRDT(dict):
+    """
+    Records the arrays set for the fields of a stream.
+    """
+    temporal_parameter = 'time'
+    fields = ['time', 'temp', 'pressure', 'raw', 'quality_flag', 'port_timestamp', 'driver_timestamp', 'unavailable']
+
+    def __contains__(self, key):
+        return key in self.fields and key != 'unavailable'
+
+
+def particle(i, binary=False):
+    values = [{'value_id':'temp', 'value':10. + i}, {'value_id':'unavailable', 'value':1}]
+    if i % 2:
+        values.append({'value_id':'pressure', 'value':i})
+    if binary:
+        values.append({'value_id':'raw', 'value':base64.b64encode('raw %s' % i), 'binary':True})
+    sample = {'stream_name':'parsed', 'quality_flag':'ok', 'driver_timestamp':1000. + i,
+              'pkt_format_id':'JSON_Data', 'pkt_version':1, 'values':values}
+    if i % 3:
+        sample['preferred_timestamp'] = 'port_timestamp'
+        sample['port_timestamp'] = 2000. + i
+    return sample
+
+
+@attr('UNIT', group='mi')
+class TestParticleAccumulator(PyonTestCase):
+
+    def assert_same_rdt(self, rdt, expected):
+        self.assertEquals(set(rdt), set(expected))
+        for k in expected:
+            self.assertEquals(rdt[k].tolist(), list(expected[k]))
+
+    def test_accumulator(self):
+        particles = [particle(i, binary=i > 2) for i in xrange(7)]
+        rdt = populate_rdt(FakeRDT(), particles)
+        self.assert_same_rdt(rdt, {
+            'time'             : [1000., 2001., 2002., 1003., 2004., 2005., 1006.],
+            'temp'             : [10., 11., 12., 13., 14., 15., 16.],
+            'pressure'         : [None, 1, None, 3, None, 5, None],
+            'raw'              : [None, None, None, 'raw 3', 'raw 4', 'raw 5', 'raw 6'],
+            'quality_flag'     : ['ok'] * 7,
+            'port_timestamp'   : [None, 2001., 2002., None, 2004., 2005., None],
+            'driver_timestamp' : [1000., 1001., 1002., 1003., 1004., 1005., 1006.]})
+
+        accumulator = ParticleAccumulator(FakeRDT())
+        for p in particles:
+            accumulator.append(p)
+        self.assertEquals(len(accumulator), 7)
+        self.assert_same_rdt(accumulator.to_rdt(FakeRDT()), rdt)
+
+        self.assert_same_rdt(populate_rdt(FakeRDT(), []), {'time' : []})
+
+
+@attr('UTIL', group='mi')
+class ParticleAccumulatorBenchmark(PyonTestCase):
+    particles = 100000
+
+    def test_conversion_rate(self):
+        particles = [particle(i, binary=True) for i in xrange(self.particles)]
+        fields = FakeRDT.fields
+
+        def convert():
+            accumulator = ParticleAccumulator(FakeRDT())
+            for p in particles:
+                accumulator.append(p)
+            accumulator.to_rdt(FakeRDT())
+
+        def row_by_row():
+            # Baseline: a list buffer filled with insert(0, ...) and drained with pop(),
+            # one dict per particle, and the columns gathered from the rows at the end
+            buf = []
+            for p in particles:
+                buf.insert(0, p)
+            rows = []
+            while buf:
+                p = buf.pop()
+                row = dict((k, v) for k, v in p.iteritems() if k in fields)
+                row['time'] = p.get(p.get('preferred_timestamp', 'driver_timestamp'))
+                for value_dict in p['values']:
+                    if value_dict['value_id'] in fields:
+                        value = value_dict['value']
+                        if 'binary' in value_dict:
+                            value = base64.b64decode(value)
+                        row[value_dict['value_id']] = value
+                rows.append(row)
+            rdt = FakeRDT()
+            for k in set(k for row in rows for k in row):
+                rdt[k] = numpy.array([row.get(k) for row in rows])
+
+        elapsed = best_of(convert, repeat=1, number=1)
+        baseline = best_of(row_by_row, repeat=1, number=1)
+        log.info('%s particles: accumulator %.3fs (%.0f particles/s), row by row %.3fs (%.0f particles/s), %.1fx',
+                 self.particles, elapsed, self.particles / elapsed,
+                 baseline, self.particles / baseline, baseline / elapsed)
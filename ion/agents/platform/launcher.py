@@ -67,7 +67,7 @@ class Launcher(object):
 
         if timeout_spawn:
             log.debug("launch_platform: agt_id=%r: waiting for RUNNING", agt_id)
-            self._agent_launcher.await_launch(timeout_spawn)
+            self._agent_launcher.await_launch(timeout_spawn, process_id=pid)
             log.debug("launch_platform: agt_id=%r: RUNNING", agt_id)
 
         return pid
@@ -100,7 +100,7 @@ class Launcher(object):
 
         if timeout_spawn:
             log.debug("launch_instrument: agt_id=%r: waiting for RUNNING", agt_id)
-            self._agent_launcher.await_launch(timeout_spawn)
+            self._agent_launcher.await_launch(timeout_spawn, process_id=pid)
             log.debug("launch_instrument: agt_id=%r: RUNNING", agt_id)
 
         return pid
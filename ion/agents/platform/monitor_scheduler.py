@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.platform.monitor_scheduler
+@file    ion/agents/platform/monitor_scheduler.py
+@brief   Shared scheduler for the attribute value retrievals of the
+         ResourceMonitors in a container
+"""
+
+__license__ = 'Apache 2.0'
+
+
+from pyon.public import log
+
+from pyon.util.containers import current_time_millis
+
+from gevent import Greenlet, spawn
+from gevent.event import Event
+
+import heapq
+import random
+import time
+
+
+# Deadlines are grouped in slots of this duration in secs. The monitors of a
+# platform that are due in the same slot are served by a single request.
+_TICK_SECS = 0.5
+
+# The first retrieval for a platform is delayed by a random amount up to this
+# many secs, so platforms started together do not poll in lockstep.
+_MAX_JITTER_SECS = 1.0
+
+# the scheduler shared by the monitors in this container, see get_monitor_scheduler
+_scheduler = None
+
+
+def get_monitor_scheduler():
+    """
+    Returns the MonitorScheduler shared by the ResourceMonitors in this
+    container, creating it on the first call.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = MonitorScheduler()
+    return _scheduler
+
+
+class MonitorScheduler(object):
+    """
+    Timer wheel driving the periodic attribute value retrievals of
+    ResourceMonitors.
+
+    A single greenlet sleeps until the next slot with due monitors. The due
+    monitors are re-scheduled for their next period and grouped by platform
+    (more precisely, by their get_attribute_values function). Each group is
+    served by a single get_attribute_values call with the attributes of all
+    its monitors, in a greenlet of its own. A platform whose previous
+    request is still in progress skips the period.
+    """
+
+    def __init__(self, tick_secs=_TICK_SECS, max_jitter_secs=_MAX_JITTER_SECS):
+        """
+        @param tick_secs         Duration of the slots in secs
+        @param max_jitter_secs   Maximum random delay of the first retrieval
+                                 for a platform
+        """
+        self._tick_secs = tick_secs
+        self._max_jitter_secs = max_jitter_secs
+
+        # {slot: [monitor, ...]} the monitors due at each slot, where slot
+        # is the deadline in units of _tick_secs
+        self._slots = {}
+        # heap of the slots in _slots
+        self._heap = []
+
+        # {key: set(monitor, ...)} the active monitors of each platform,
+        # see _key
+        self._monitors = {}
+        # {key: secs} the jitter of each platform
+        self._jitter = {}
+        # keys of the platforms with a request in progress
+        self._in_progress = set()
+
+        # set to re-evaluate the sleep in _run
+        self._wakeup = Event()
+        self._runnable = None
+
+        # for diagnostics and benchmarking, see stats
+        self._requests = 0
+        self._wakeups = 0
+
+    def _key(self, monitor):
+        return monitor._platform_id, monitor._get_attribute_values
+
+    def add(self, monitor):
+        """
+        Starts the retrievals for the given monitor, the first one after its
+        rate plus the jitter of its platform.
+
+        @param monitor   ResourceMonitor
+        """
+        key = self._key(monitor)
+        if key not in self._monitors:
+            self._monitors[key] = set()
+            self._jitter[key] = random.uniform(0, self._max_jitter_secs)
+        self._monitors[key].add(monitor)
+
+        self._schedule(monitor, time.time() + monitor._rate_secs + self._jitter[key])
+
+        if self._runnable is None:
+            self._runnable = Greenlet(self._run)
+            self._runnable.start()
+
+    def remove(self, monitor):
+        """
+        Stops the retrievals for the given monitor. Note that a retrieval
+        already in progress still completes.
+
+        @param monitor   ResourceMonitor
+        """
+        key = self._key(monitor)
+        monitors = self._monitors.get(key)
+        if monitors is None:
+            return
+        monitors.discard(monitor)
+        if not monitors:
+            del self._monitors[key]
+            del self._jitter[key]
+
+    def stop(self):
+        """
+        Stops the scheduler greenlet. Monitors added afterwards start it again.
+        """
+        if self._runnable is not None:
+            self._runnable.kill()
+            self._runnable = None
+
+    def stats(self):
+        """
+        @return dict with the number of get_attribute_values calls (requests),
+                of scheduler greenlet wakeups (wakeups) and of active
+                monitors (monitors)
+        """
+        return dict(requests=self._requests,
+                    wakeups=self._wakeups,
+                    monitors=sum(len(monitors) for monitors in self._monitors.itervalues()))
+
+    def _slot(self, deadline):
+        return int(round(deadline / self._tick_secs))
+
+    def _schedule(self, monitor, deadline):
+        monitor._deadline = deadline
+        slot = self._slot(deadline)
+        if slot in self._slots:
+            self._slots[slot].append(monitor)
+            return
+
+        self._slots[slot] = [monitor]
+        heapq.heappush(self._heap, slot)
+        if self._heap[0] == slot:
+            # new earliest deadline:
+            self._wakeup.set()
+
+    def _run(self):
+        """
+        The target function for the scheduler greenlet.
+        """
+        while True:
+            try:
+                self._run_once()
+            except Exception:
+                # keep the greenlet, and so the monitoring of the other
+                # platforms, going:
+                log.exception("exception in monitor scheduler")
+
+    def _run_once(self):
+        """
+        Waits for the next slot with due monitors, re-schedules them and
+        spawns the retrievals for their platforms.
+        """
+        self._wakeup.clear()
+        if self._heap:
+            timeout = self._heap[0] * self._tick_secs - time.time()
+        else:
+            timeout = None
+
+        if timeout is None or timeout > 0:
+            self._wakeup.wait(timeout)
+            self._wakeups += 1
+
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0] * self._tick_secs <= now:
+            due += self._slots.pop(heapq.heappop(self._heap))
+
+        by_key = {}
+        for monitor in due:
+            key = self._key(monitor)
+            if monitor not in self._monitors.get(key, ()):
+                # removed.
+                continue
+
+            by_key.setdefault(key, []).append(monitor)
+
+            # next deadline, skipping any missed ones:
+            try:
+                deadline = monitor._deadline + monitor._rate_secs
+                while deadline <= now:
+                    deadline += monitor._rate_secs
+                self._schedule(monitor, deadline)
+            except Exception:
+                log.exception("%r: exception re-scheduling %s", key[0], monitor)
+
+        for key, monitors in by_key.iteritems():
+            if key in self._in_progress:
+                log.debug("%r: previous request still in progress; skipping "
+                          "retrieval for %d monitors", key[0], len(monitors))
+                continue
+
+            self._in_progress.add(key)
+            spawn(self._retrieve_attribute_values, key, monitors)
+
+    def _retrieve_attribute_values(self, key, monitors):
+        """
+        Retrieves the attribute values for the given monitors of a platform
+        with a single request and passes the values to each monitor.
+        """
+        platform_id, get_attribute_values = key
+        try:
+            curr_time_millis = current_time_millis()
+            monitor_attrs = [(monitor, monitor._get_attrs_to_request(curr_time_millis))
+                             for monitor in monitors]
+            attrs = [attr for _, m_attrs in monitor_attrs for attr in m_attrs]
+
+            log.debug("%r: _retrieve_attribute_values: %d monitors, attrs=%s",
+                      platform_id, len(monitors), attrs)
+
+            self._requests += 1
+            retrieved_vals = get_attribute_values(attrs)
+
+            for monitor, m_attrs in monitor_attrs:
+                try:
+                    monitor._process_retrieved_values(m_attrs, retrieved_vals)
+                except Exception:
+                    log.exception("%r: exception processing retrieved values in %s",
+                                  platform_id, monitor)
+
+        except Exception:
+            log.exception("%r: exception in _retrieve_attribute_values", platform_id)
+
+        finally:
+            self._in_progress.discard(key)
@@ -18,7 +18,7 @@ from pyon.agent.agent import ResourceAgentEvent
 from interface.objects import AgentCommand
 from pyon.agent.agent import ResourceAgentClient
 
-from pyon.event.event import EventSubscriber
+from pyon.event.event import EventSubscriber, get_events_exchange_point
 
 from pyon.core.exception import NotFound, Inconsistent
 
@@ -58,6 +58,8 @@ import time
 from gevent import Greenlet
 from gevent import sleep
 from gevent import spawn
+from gevent import Timeout
+from gevent.pool import Pool
 from gevent.event import AsyncResult
 from gevent.coros import RLock
 
@@ -224,6 +226,10 @@ class PlatformAgent(ResourceAgent):
         # self.CFG.endpoint.receive.timeout -- see on_init
         self._timeout = None
 
+        # bounded concurrency and per-child timeout for commands to children -- see on_init
+        self._fan_out_size = None
+        self._child_timeout = None
+
         # to sync in _initialize
         self._async_children_launched = None
 
@@ -318,6 +324,11 @@ class PlatformAgent(ResourceAgent):
         self._timeout = cfg_timeout
         #######################################################################
 
+        # children are handled concurrently by at most _fan_out_size greenlets,
+        # each bounded by _child_timeout seconds if given. See _fan_out.
+        self._fan_out_size = self.CFG.get_safe('platform_config.fan_out_pool_size', 10)
+        self._child_timeout = self.CFG.get_safe('platform_config.child_timeout', None)
+
         self._plat_config = self.CFG.get("platform_config", None)
         self._plat_config_processed = False
 
@@ -1209,6 +1220,57 @@ class PlatformAgent(ResourceAgent):
 
         return retval
 
+    def _fan_out(self, child_ids, func, what):
+        """
+        Calls func(child_id) for each of the given children concurrently, on
+        a pool of at most self._fan_out_size greenlets. Each call is bounded
+        by self._child_timeout seconds if given.
+
+        @param child_ids  IDs of the children
+        @param func       called as func(child_id)
+        @param what       description of the operation, for logging
+
+        @return dict child_id -> (retval, exception), where exception is None
+                if func returned normally
+        """
+        def run(child_id):
+            timeout = Timeout(self._child_timeout)
+            timeout.start()
+            try:
+                return func(child_id), None
+
+            except Timeout as ex:
+                if ex is not timeout:
+                    raise
+                err_msg = "%r: %s on child %r timed out after %s seconds" % (
+                          self._platform_id, what, child_id, self._child_timeout)
+                log.error(err_msg)
+                return None, PlatformException(err_msg)
+
+            except Exception as ex:
+                log.exception("%r: exception in %s on child %r",
+                              self._platform_id, what, child_id)
+                return None, ex
+
+            finally:
+                timeout.cancel()
+
+        time_start = time.time()
+        pool = Pool(self._fan_out_size)
+        greenlets = [(child_id, pool.spawn(run, child_id)) for child_id in child_ids]
+        pool.join()
+
+        results = {}
+        for child_id, greenlet in greenlets:
+            if greenlet.successful():
+                results[child_id] = greenlet.value
+            else:
+                results[child_id] = (None, greenlet.exception)
+
+        log.debug("%r: _fan_out: %s on %d children elapsed_time=%s",
+                  self._platform_id, what, len(results), time.time() - time_start)
+        return results
+
     def _get_recursion_parameter(self, method_name, *args, **kwargs):
         """
         Utility to extract the 'recursion' parameter.
@@ -1246,6 +1308,27 @@ class PlatformAgent(ResourceAgent):
         self.add_endpoint(sub)
         return sub
 
+    def _bind_event_subscriber(self, sub, **kwargs):
+        """
+        Makes an EventSubscriber created with _create_event_subscriber also
+        receive the events matching the given criteria.
+
+        @param sub     subscriber
+        @param kwargs  event_type, origin, sub_type, origin_type
+        """
+        xp = self.container.ex_manager.create_xp(get_events_exchange_point())
+        sub._ev_recv_name.bind(EventSubscriber._topic(**kwargs), xp)
+
+    def _unbind_event_subscriber(self, sub, **kwargs):
+        """
+        Undoes a _bind_event_subscriber call with the same criteria.
+
+        @param sub     subscriber
+        @param kwargs  event_type, origin, sub_type, origin_type
+        """
+        xp = self.container.ex_manager.create_xp(get_events_exchange_point())
+        sub._ev_recv_name.unbind(EventSubscriber._topic(**kwargs), xp)
+
     def _destroy_event_subscriber(self, sub):
         """
         Destroys an EventSubscriber created with _create_event_subscriber.
@@ -1507,8 +1590,11 @@ class PlatformAgent(ResourceAgent):
         subplatform_ids = self._get_subplatform_ids()
         if len(subplatform_ids):
             log.debug("%r: launching subplatforms %s", self._platform_id, subplatform_ids)
-            for subplatform_id in subplatform_ids:
-                self._launch_platform_agent(subplatform_id)
+            results = self._fan_out(subplatform_ids, self._launch_platform_agent,
+                                    "_launch_platform_agent")
+            exceptions = [ex for _, ex in results.itervalues() if ex is not None]
+            if exceptions:
+                raise exceptions[0]
 
             log.debug("%r: _subplatforms_launch completed. _pa_clients=%s",
                       self._platform_id, self._pa_clients)
@@ -1542,8 +1628,11 @@ class PlatformAgent(ResourceAgent):
             return children_with_errors   # that is, none.
 
         log.debug("%r: initializing subplatforms %s", self._platform_id, valid_clients)
-        for subplatform_id in valid_clients:
-            err_msg = self._initialize_subplatform(subplatform_id)
+        results = self._fan_out(valid_clients.keys(), self._initialize_subplatform,
+                                "_initialize_subplatform")
+        for subplatform_id, (err_msg, ex) in results.iteritems():
+            if ex is not None:
+                err_msg = str(ex)
             if err_msg is not None:
                 children_with_errors[subplatform_id] = err_msg
 
@@ -1633,7 +1722,7 @@ class PlatformAgent(ResourceAgent):
             log.debug("%r: executing command on my sub-platforms: %s",
                       self._platform_id, valid_clients.keys())
 
-        for subplatform_id in valid_clients:
+        def execute_child(subplatform_id):
             if expected_state:
                 pa_client = valid_clients[subplatform_id].pa_client
                 sub_state = pa_client.get_agent_state()
@@ -1643,7 +1732,7 @@ class PlatformAgent(ResourceAgent):
                     #
                     log.trace("%r: sub-platform %r already in state: %r",
                               self._platform_id, subplatform_id, expected_state)
-                    continue
+                    return None
 
             if isinstance(command, AgentCommand):
                 cmd = command
@@ -1656,11 +1745,23 @@ class PlatformAgent(ResourceAgent):
 
             if err_msg is not None:
                 # some error happened; publish event:
-                children_with_errors[subplatform_id] = err_msg
                 dd = valid_clients[subplatform_id]
                 self._status_manager.publish_device_failed_command_event(dd.resource_id,
                                                                          cmd,
                                                                          err_msg)
+            return err_msg
+
+        results = self._fan_out(valid_clients.keys(), execute_child, command)
+        for subplatform_id, (err_msg, ex) in results.iteritems():
+            if ex is not None:
+                err_msg = "%r: exception executing command %r in subplatform %r: %s" % (
+                          self._platform_id, command, subplatform_id, ex)
+                dd = valid_clients[subplatform_id]
+                self._status_manager.publish_device_failed_command_event(dd.resource_id,
+                                                                         command,
+                                                                         err_msg)
+            if err_msg is not None:
+                children_with_errors[subplatform_id] = err_msg
         return children_with_errors
 
     def _subplatforms_reset(self):
@@ -2104,8 +2205,11 @@ class PlatformAgent(ResourceAgent):
         instrument_ids = self._get_instrument_ids()
         if len(instrument_ids):
             log.debug("%r: launching instruments %s", self._platform_id, instrument_ids)
-            for instrument_id in instrument_ids:
-                self._launch_instrument_agent(instrument_id)
+            results = self._fan_out(instrument_ids, self._launch_instrument_agent,
+                                    "_launch_instrument_agent")
+            exceptions = [ex for _, ex in results.itervalues() if ex is not None]
+            if exceptions:
+                raise exceptions[0]
 
             log.debug("%r: _instruments_launch completed.", self._platform_id)
 
@@ -2135,8 +2239,11 @@ class PlatformAgent(ResourceAgent):
             return children_with_errors   # that is, none.
 
         log.debug("%r: initializing instruments %s", self._platform_id, valid_clients)
-        for instrument_id in valid_clients:
-            err_msg = self._initialize_instrument(instrument_id)
+        results = self._fan_out(valid_clients.keys(), self._initialize_instrument,
+                                "_initialize_instrument")
+        for instrument_id, (err_msg, ex) in results.iteritems():
+            if ex is not None:
+                err_msg = str(ex)
             if err_msg is not None:
                 children_with_errors[instrument_id] = err_msg
 
@@ -2225,7 +2332,7 @@ class PlatformAgent(ResourceAgent):
             log.debug("%r: executing command on my instruments: %s",
                       self._platform_id, valid_clients.keys())
 
-        for instrument_id in valid_clients:
+        def execute_child(instrument_id):
             if expected_state:
                 ia_client = valid_clients[instrument_id].ia_client
                 sub_state = ia_client.get_agent_state()
@@ -2235,18 +2342,30 @@ class PlatformAgent(ResourceAgent):
                     #
                     log.trace("%r: instrument %r already in state: %r",
                               self._platform_id, instrument_id, expected_state)
-                    continue
+                    return None
 
             cmd = AgentCommand(command=command) if command else create_command(instrument_id)
             err_msg = execute_cmd(instrument_id, cmd)
 
             if err_msg is not None:
                 # some error happened; publish event:
-                children_with_errors[instrument_id] = err_msg
                 dd = valid_clients[instrument_id]
                 self._status_manager.publish_device_failed_command_event(dd.resource_id,
                                                                          cmd,
                                                                          err_msg)
+            return err_msg
+
+        results = self._fan_out(valid_clients.keys(), execute_child, command)
+        for instrument_id, (err_msg, ex) in results.iteritems():
+            if ex is not None:
+                err_msg = "%r: exception executing command %r in instrument %r: %s" % (
+                          self._platform_id, command, instrument_id, ex)
+                dd = valid_clients[instrument_id]
+                self._status_manager.publish_device_failed_command_event(dd.resource_id,
+                                                                         command,
+                                                                         err_msg)
+            if err_msg is not None:
+                children_with_errors[instrument_id] = err_msg
         return children_with_errors
 
     def _instruments_reset(self):
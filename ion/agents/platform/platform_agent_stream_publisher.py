@@ -161,6 +161,10 @@ class PlatformAgentStreamPublisher(object):
         pub_params = {}
         selected_timestamps = None
 
+        # aligned event (see AttributeValueDriverEvent): all the value arrays
+        # share these timestamps
+        aligned_timestamps = driver_event.timestamps
+
         for param_name, param_value in driver_event.vals_dict.iteritems():
 
             in_rdt = False
@@ -208,10 +212,14 @@ class PlatformAgentStreamPublisher(object):
             if not in_rdt:
                 continue
 
-            # separate values and timestamps:
-            vals, timestamps = zip(*param_value)
-
-            self._agent._dispatch_value_alerts(stream_name, param_name, vals)
+            if aligned_timestamps is None:
+                # separate values and timestamps:
+                vals, timestamps = zip(*param_value)
+                self._agent._dispatch_value_alerts(stream_name, param_name, vals)
+            else:
+                timestamps = aligned_timestamps
+                self._agent._dispatch_value_alerts(stream_name, param_name,
+                                                   param_value.compressed())
 
             # Use fill_value in context to replace any None values:
             param_ctx = param_dict.get_context(param_name)
@@ -220,7 +228,10 @@ class PlatformAgentStreamPublisher(object):
                 log.debug("%r: param_name=%r fill_value=%s",
                           self._platform_id, param_name, fill_value)
                 # do the replacement:
-                vals = [fill_value if val is None else val for val in vals]
+                if aligned_timestamps is None:
+                    vals = [fill_value if val is None else val for val in vals]
+                else:
+                    vals = param_value.filled(fill_value).tolist()
 
                 if log.isEnabledFor(logging.TRACE):  # pragma: no cover
                     log.trace("%r: vals array after replacing None with fill_value:\n%s",
@@ -229,6 +240,8 @@ class PlatformAgentStreamPublisher(object):
             else:
                 log.warn("%r: unexpected: parameter context not found for %r",
                          self._platform_id, param_name)
+                if aligned_timestamps is not None:
+                    vals = param_value.tolist()
 
             # Set values in rdt:
             rdt[param_name] = numpy.array(vals)
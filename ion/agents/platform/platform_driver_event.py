@@ -24,12 +24,18 @@ class DriverEvent(object):
 class AttributeValueDriverEvent(DriverEvent):
     """
     Event to notify the retrieved value for a platform attribute.
+
+    vals_dict maps each attribute to a list of (val, ts) pairs, unless
+    timestamps is given, in which case each attribute is mapped to a masked
+    array of values aligned with those timestamps (masked entries being
+    missing values).
     """
-    def __init__(self, platform_id, stream_name, vals_dict):
+    def __init__(self, platform_id, stream_name, vals_dict, timestamps=None):
         DriverEvent.__init__(self)
         self._platform_id = platform_id
         self._stream_name = stream_name
         self._vals_dict = vals_dict
+        self._timestamps = timestamps
 
     @property
     def platform_id(self):
@@ -43,6 +49,10 @@ class AttributeValueDriverEvent(DriverEvent):
     def vals_dict(self):
         return self._vals_dict
 
+    @property
+    def timestamps(self):
+        return self._timestamps
+
     def __str__(self):
         return "%s(platform_id=%r, stream_name=%r, vals_dict=%r)" % (
             self.__class__.__name__, self.platform_id, self.stream_name,
@@ -21,6 +21,7 @@ from ion.agents.platform.platform_driver_event import AttributeValueDriverEvent
 from gevent import Greenlet, sleep
 from gevent.coros import RLock
 
+import numpy
 import pprint
 
 
@@ -260,9 +261,8 @@ class PlatformResourceMonitor(object):
                 slept += incr
 
             # dispatch publication (if still active):
-            with self._lock:
-                if self._publisher_active:
-                    self._dispatch_publication()
+            if self._publisher_active:
+                self._dispatch_publication()
 
         log.debug("%r: publisher greenlet stopped. _pub_rate=%s",
                   self._platform_id, self._pub_rate)
@@ -273,88 +273,61 @@ class PlatformResourceMonitor(object):
         aggregated AttributeValueDriverEvent.
 
         Keeps all samples for each attribute, reporting all associated timestamps
-        and filling with None values for missing values at particular timestamps,
-        but an attribute is included *only* if it has at least an actual value.
+        and leaving masked entries for missing values at particular timestamps.
+        All attributes are included so the agent can properly populate rdts
+        and construct granules.
 
-        @note The platform agent will translate any None entries to
+        The event is in aligned form: driver_event.timestamps is the sorted
+        union of the collected timestamps and vals_dict maps each attribute to
+        a masked object array aligned with those timestamps.
+
+        @note The platform agent will translate any masked entries to
               corresponding fill_values.
         """
 
-        # step 1:
-        # - collect all actual values in a dict indexed by timestamp
-        # - keep track of the attributes having actual values
-        by_ts = {}  # { ts0 : { attr_n : val_n, ... }, ... }
-        attrs_with_actual_values = set()
-        for attr_id, attr_vals in self._buffers.iteritems():
-            for v, ts in attr_vals:
-                if not ts in by_ts:
-                    by_ts[ts] = {}
-
-                by_ts[ts][attr_id] = v
-
-                attrs_with_actual_values.add(attr_id)
-
-            # re-init buffer for this attribute:
-            self._buffers[attr_id] = []
+        # take the collected data and re-init the buffers, so the monitors
+        # are not blocked while the publication is prepared:
+        with self._lock:
+            buffers = self._buffers
+            self._buffers = dict((attr_id, []) for attr_id in buffers)
 
-        if not attrs_with_actual_values:
+        # step 1:
+        # - separate values and timestamps of the attributes having actual values
+        columns = {}  # { attr_id : (vals, timestamps), ... }
+        for attr_id, attr_vals in buffers.iteritems():
+            if attr_vals:
+                vals, timestamps = zip(*attr_vals)
+                columns[attr_id] = (vals, numpy.array(timestamps))
+
+        if not columns:
             # No new data collected at all; nothing to publish, just return:
             log.debug("%r: _dispatch_publication: no new data collected.", self._platform_id)
             return
 
-        """
         # step 2:
-        # - put None's for any missing attribute value per timestamp:
-        for ts in by_ts:
-            # only do this for attrs_with_actual_values:
-            # (note: these attributes do have actual values, but not necessarily
-            # at every reported timestamp in this cycle):
-            for attr_id in attrs_with_actual_values:
-                if not attr_id in by_ts[ts]:
-                    by_ts[ts][attr_id] = None
-        """
+        # - sorted union of all the timestamps:
+        timestamps = numpy.unique(numpy.concatenate(
+            [column_timestamps for _, column_timestamps in columns.itervalues()]))
 
-        # step 2:
-        # - put None's for any missing attribute value per timestamp:
-        # EH. Here I used all attributes instead of only the measured ones
-        # so the agent can properly populate rdts and construct granules.
-        for ts in by_ts:
-            # only do this for attrs_with_actual_values:
-            # (note: these attributes do have actual values, but not necessarily
-            # at every reported timestamp in this cycle):
-            for attr_id in self._buffers.keys():
-                if not attr_id in by_ts[ts]:
-                    by_ts[ts][attr_id] = None
-
-        """        
-        # step 3:
-        # - construct vals_dict for the event:
-        vals_dict = {}
-        for attr_id in attrs_with_actual_values:
-            vals_dict[attr_id] = []
-            for ts in sorted(by_ts.iterkeys()):
-                val = by_ts[ts][attr_id]
-                vals_dict[attr_id].append((val, ts))
-        """
-        
         # step 3:
-        # - construct vals_dict for the event:
-        # EH. Here I used all attributes instead of only the measured ones
-        # so the agent can properly populate rdts and construct granules.
+        # - align the values of each attribute with the timestamps; entries
+        #   without an actual value stay masked:
         vals_dict = {}
-        for attr_id in self._buffers.keys():
-            vals_dict[attr_id] = []
-            for ts in sorted(by_ts.iterkeys()):
-                val = by_ts[ts][attr_id]
-                vals_dict[attr_id].append((val, ts))
+        for attr_id in buffers:
+            column = numpy.ma.masked_all(len(timestamps), dtype=object)
+            if attr_id in columns:
+                vals, column_timestamps = columns[attr_id]
+                column[numpy.searchsorted(timestamps, column_timestamps)] = vals
+            vals_dict[attr_id] = column
 
         # finally, create and notify event:
         driver_event = AttributeValueDriverEvent(self._platform_id,
                                                  _STREAM_NAME,
-                                                 vals_dict)
+                                                 vals_dict,
+                                                 timestamps)
 
         log.debug("%r: _dispatch_publication: notifying event: %s",
-                  self._platform_id, driver_event)
+                  self._platform_id, driver_event.brief())
 
         if log.isEnabledFor(logging.TRACE):  # pragma: no cover
             log.trace("%r: vals_dict:\n%s",
@@ -13,13 +13,11 @@ __license__ = 'Apache 2.0'
 
 from pyon.public import log
 
-from pyon.util.containers import current_time_millis
-
 from ion.agents.platform.platform_driver_event import AttributeValueDriverEvent
+from ion.agents.platform.monitor_scheduler import get_monitor_scheduler
 from ion.agents.platform.util import ntp_2_ion_ts
 
 import logging
-from gevent import Greenlet, sleep
 
 import pprint
 
@@ -44,10 +42,10 @@ class ResourceMonitor(object):
     """
 
     def __init__(self, platform_id, rate_secs, attr_defns,
-                 get_attribute_values, notify_driver_event):
+                 get_attribute_values, notify_driver_event, scheduler=None):
         """
         Creates a monitor for a specific attribute in a given platform.
-        Call start to start the monitoring greenlet.
+        Call start to start the monitoring.
 
         @param platform_id Platform ID
         @param rate_secs   Monitoring rate in secs
@@ -58,6 +56,8 @@ class ResourceMonitor(object):
                                get_attribute_values(attr_ids, from_time)
         @param notify_driver_event
                            Callback to notify whenever a value is retrieved.
+        @param scheduler   MonitorScheduler doing the retrievals. By default,
+                           the one shared in this container.
         """
         log.debug("%r: ResourceMonitor entered. rate_secs=%s, attr_defns=%s",
                   platform_id, rate_secs, attr_defns)
@@ -67,6 +67,7 @@ class ResourceMonitor(object):
         self._rate_secs = rate_secs
         self._attr_defns = attr_defns
         self._notify_driver_event = notify_driver_event
+        self._scheduler = scheduler or get_monitor_scheduler()
 
         # corresponding attribute IDs to be retrieved
         self._attr_ids = []
@@ -85,6 +86,9 @@ class ResourceMonitor(object):
 
         self._active = False
 
+        # next retrieval time, set by the scheduler
+        self._deadline = None
+
         # for debugging purposes
         self._pp = pprint.PrettyPrinter()
 
@@ -98,40 +102,20 @@ class ResourceMonitor(object):
 
     def start(self):
         """
-        Starts greenlet for resource monitoring.
+        Starts the resource monitoring, that is, the periodic retrieval of
+        the attribute values by the scheduler.
         """
         log.debug("%r: starting resource monitoring %s", self._platform_id, self)
         self._active = True
-        runnable = Greenlet(self._run)
-        runnable.start()
+        self._scheduler.add(self)
 
-    def _run(self):
-        """
-        The target function for the greenlet.
+    def _get_attrs_to_request(self, curr_time_millis):
         """
-        while self._active:
-            slept = 0
-            # loop to incrementally sleep up to rate_secs while promptly
-            # reacting to request for termination
-            while self._active and slept < self._rate_secs:
-                # sleep in increments of 0.5 secs
-                incr = min(0.5, self._rate_secs - slept)
-                sleep(incr)
-                slept += incr
-
-            if self._active:
-                try:
-                    self._retrieve_attribute_values()
-                except Exception:
-                    log.exception("exception in _retrieve_attribute_values")
-
-        log.debug("%r: monitoring greenlet stopped. rate_secs=%s; attr_ids=%s",
-                  self._platform_id, self._rate_secs, self._attr_ids)
-
-    def _retrieve_attribute_values(self):
-        """
-        Retrieves the attribute values using the given function and calls
-        _values_retrieved.
+        Determines the attributes to request along with the from_time for each.
+
+        @param curr_time_millis  current time in millis in UNIX epoch
+
+        @return [(attr_id, from_time), ...]
         """
 
         # TODO: note that the "from_time" parameters for the request below
@@ -141,9 +125,7 @@ class ResourceMonitor(object):
         #
 
         # note that the "from_time" parameter in each pair (attr_id, from_time)
-        # for the _get_attribute_values call below, is in millis in UNIX epoch.
-
-        curr_time_millis = current_time_millis()
+        # for the _get_attribute_values call, is in millis in UNIX epoch.
 
         # minimum value for the from_time parameter (OOIION-1372):
         min_from_time = curr_time_millis - 1000 * _MULT_INTERVAL * self._rate_secs
@@ -170,15 +152,28 @@ class ResourceMonitor(object):
 
             attrs.append((attr_id, from_time))
 
-        log.debug("%r: _retrieve_attribute_values: attrs=%s",
-                  self._platform_id, attrs)
-
-        retrieved_vals = self._get_attribute_values(attrs)
+        return attrs
 
+    def _process_retrieved_values(self, attrs, retrieved_vals):
+        """
+        Validates the values retrieved for the given attributes and calls
+        _values_retrieved. The scheduler calls this with the response of the
+        request done for all the monitors of the platform, so retrieved_vals
+        may also contain values for attributes of other monitors.
+
+        @param attrs           [(attr_id, from_time), ...] as returned by
+                               _get_attrs_to_request
+        @param retrieved_vals  {attr_id : [(val, ts), ...], ...} as returned
+                               by get_attribute_values
+        """
         if retrieved_vals is None:
             # lost connection; nothing else to do here:
             return
 
+        attr_ids = set(attr_id for attr_id, _ in attrs)
+        retrieved_vals = dict((attr_id, vals) for attr_id, vals
+                              in retrieved_vals.iteritems() if attr_id in attr_ids)
+
         good_retrieved_vals = {}
 
         # do validation: we expect an array of tuples (val, timestamp) for
@@ -280,3 +275,4 @@ class ResourceMonitor(object):
     def stop(self):
         log.debug("%r: stopping resource monitoring %s", self._platform_id, self)
         self._active = False
+        self._scheduler.remove(self)
@@ -24,6 +24,7 @@ from interface.objects import ProcessStateEnum
 from pyon.agent.agent import ResourceAgentClient
 
 import logging
+from collections import Counter
 
 from gevent.coros import RLock
 
@@ -68,8 +69,10 @@ class StatusManager(object):
         The PlatformAgent must have been already initialized to properly
         access the handled elements.
 
-        Note that the number of subscribers and entries for other
-        related status information will increase and decrease
+        Events from the children are received by a single subscriber per
+        event type, whose queue is bound to the origins (or PIDs) of the
+        children currently known. Note that the entries for the related
+        status information, and those bindings, will increase and decrease
         as we get device_added and device_removed events.
 
         @param pa   The associated platform agent object to access the
@@ -86,13 +89,20 @@ class StatusManager(object):
         self.aparam_aggstatus        = pa.aparam_aggstatus
         self.aparam_rollup_status    = pa.aparam_rollup_status
 
-        # All EventSubscribers created: {origin: EventSubscriber, ...}
+        # The EventSubscribers for the events from the children, each bound
+        # to the origins (or PIDs) of the children: {event_type: EventSubscriber, ...}
         self._event_subscribers = {}
 
-        # {pid: origin ...} the origin (resource_id) of each PID used in
-        # ProcessLifecycleEvent subscribers
+        # {pid: origin ...} the origin (resource_id) of each PID of the
+        # children, to dispatch the ProcessLifecycleEvents
         self._rids = {}
 
+        # {status_name: Counter({status: number of children ...})} histograms
+        # of aparam_child_agg_status for the rollup status consolidation.
+        # Updated in _set_child_status and _discard_child_statuses.
+        self._child_status_counts = dict((status_name, Counter()) for status_name
+                                         in AggregateStatusType._str_map.keys())
+
         # set to False by a call to destroy
         self._active = True
 
@@ -106,6 +116,8 @@ class StatusManager(object):
                 self.aparam_aggstatus[status_name]     = DeviceStatusType.STATUS_UNKNOWN
                 self.aparam_rollup_status[status_name] = DeviceStatusType.STATUS_UNKNOWN
 
+            self._start_event_subscribers()
+
             # do status preparations for the immediate children
             for origin in pa._children_resource_ids:
                 self._prepare_new_child(origin)
@@ -120,14 +132,14 @@ class StatusManager(object):
         Stops all event subscribers and clears self._event_subscribers,
         self.aparam_rollup_status, self.aparam_child_agg_status.
         """
-        def stop_es(origin, es):
-            log.debug("%r: destroying event subscriber: origin=%r; es=%r",
-                      self._platform_id, origin, es)
+        def stop_es(event_type, es):
+            log.debug("%r: destroying event subscriber: event_type=%r; es=%r",
+                      self._platform_id, event_type, es)
             try:
                 self._agent._destroy_event_subscriber(es)
             except Exception as ex:
-                log.warn("%r: error destroying event subscriber: origin=%r; es=%r: %s",
-                         self._platform_id, origin, es, ex)
+                log.warn("%r: error destroying event subscriber: event_type=%r; es=%r: %s",
+                         self._platform_id, event_type, es, ex)
 
         with self._lock:
             self._active = False
@@ -137,12 +149,14 @@ class StatusManager(object):
 
             self._event_subscribers.clear()
             self.aparam_child_agg_status.clear()
+            for counts in self._child_status_counts.itervalues():
+                counts.clear()
             for status_name in AggregateStatusType._str_map.keys():
                 self.aparam_rollup_status[status_name] = DeviceStatusType.STATUS_UNKNOWN
 
             log.debug("%r: about to destroy %d event subscribers", self._platform_id, len(ess))
-            for origin, es in ess.iteritems():
-                stop_es(origin, es)
+            for event_type, es in ess.iteritems():
+                stop_es(event_type, es)
 
             if self._diag_sub:  # pragma: no cover
                 stop_es(None, self._diag_sub)
@@ -166,7 +180,7 @@ class StatusManager(object):
         @param i_resource_id  instrument's resource ID
         """
 
-        self._start_subscriber_process_lifecycle_event(i_resource_id)
+        self._register_child_process(i_resource_id)
 
         # do any updates from instrument's aggstatus:
         try:
@@ -178,7 +192,7 @@ class StatusManager(object):
             with self._lock:
                 for status_name, status in aggstatus.iteritems():
                     # update my image of the child's status:
-                    self.aparam_child_agg_status[i_resource_id][status_name] = status
+                    self._set_child_status(i_resource_id, status_name, status)
 
                     self._update_rollup_status(status_name)
 
@@ -213,7 +227,7 @@ class StatusManager(object):
         @param sub_resource_id  sub-platform's resource ID
         """
 
-        self._start_subscriber_process_lifecycle_event(sub_resource_id)
+        self._register_child_process(sub_resource_id)
 
         # do any updates from sub-platform's rollup_status and child_agg_status:
         try:
@@ -235,7 +249,7 @@ class StatusManager(object):
                 # update my own child_agg_status from the child's rollup_status
                 # and also my rollup_status:
                 for status_name, status in child_rollup_status.iteritems():
-                    self.aparam_child_agg_status[sub_resource_id][status_name] = status
+                    self._set_child_status(sub_resource_id, status_name, status)
                     self._update_rollup_status(status_name)
 
             log.trace("%r: my updated child status after processing sub-platform %r: %s",
@@ -358,95 +372,135 @@ class StatusManager(object):
             # update aparam_rollup_status:
             self._update_rollup_status_and_publish(status_name, alerts_list=alerts_list)
 
+    #-------------------------------------------------------------------
+    # event subscribers
+    #-------------------------------------------------------------------
+
+    def _start_event_subscribers(self):
+        """
+        Starts the subscribers to the events from the children. Each one is
+        created bound to this platform's own origin only; the bindings for
+        the children are added with _bind_child_events as they are prepared
+        (or their process registered) and removed with _unbind_child_events.
+        The callbacks still ignore the events from devices that are not
+        currently children of this platform.
+        """
+        for event_type, origin_type, callback in [
+                ("DeviceStatusEvent",          None,                self._got_device_status_event),
+                ("DeviceAggregateStatusEvent", None,                self._got_device_aggregate_status_event),
+                ("ProcessLifecycleEvent",      'DispatchedProcess', self._got_process_lifecycle_event)]:
+
+            sub = self._agent._create_event_subscriber(event_type=event_type,
+                                                       origin=self.resource_id,
+                                                       origin_type=origin_type,
+                                                       callback=callback)
+            self._event_subscribers[event_type] = sub
+
+            log.debug("%r: registered event subscriber for event_type=%r",
+                      self._platform_id, event_type)
+
+    def _bind_child_events(self, event_type, origin, origin_type=None):
+        """
+        Binds the subscriber for event_type to the given origin.
+        """
+        sub = self._event_subscribers.get(event_type)
+        if sub is None:
+            return
+        try:
+            self._agent._bind_event_subscriber(sub, event_type=event_type,
+                                               origin=origin,
+                                               origin_type=origin_type)
+        except Exception as ex:
+            log.warn("%r: could not bind event subscriber: event_type=%r; origin=%r: %s",
+                     self._platform_id, event_type, origin, ex)
+
+    def _unbind_child_events(self, event_type, origin, origin_type=None):
+        """
+        Undoes _bind_child_events.
+        """
+        sub = self._event_subscribers.get(event_type)
+        if sub is None:
+            return
+        try:
+            self._agent._unbind_event_subscriber(sub, event_type=event_type,
+                                                 origin=origin,
+                                                 origin_type=origin_type)
+        except Exception as ex:
+            log.warn("%r: could not unbind event subscriber: event_type=%r; origin=%r: %s",
+                     self._platform_id, event_type, origin, ex)
+
     #-------------------------------------------------------------------
     # supporting methods related with ProcessLifecycleEvent events
     #-------------------------------------------------------------------
 
-    def _start_subscriber_process_lifecycle_event(self, origin):
+    def _register_child_process(self, origin):
         """
-        @param origin    Child's resource_id. The associated PID retrieved via
-                         ResourceAgentClient._get_agent_process_id is used for
-                         the event subscriber itself, but we still index
-                         _event_subscribers with the given origin.
+        Captures the PID of the given child and binds the subscriber to it so
+        its ProcessLifecycleEvents are dispatched to _got_process_lifecycle_event.
+
+        @param origin    Child's resource_id. The associated PID is retrieved via
+                         ResourceAgentClient._get_agent_process_id.
         """
-        def _got_process_lifecycle_event(evt, *args, **kwargs):
-            with self._lock:
-                if not self._active:
-                    log.warn("%r: _got_process_lifecycle_event called but "
-                             "manager has been destroyed",
-                             self._platform_id)
-                    return
-
-                if evt.type_ != "ProcessLifecycleEvent":
-                    log.trace("%r: ignoring event type %r. Only handle "
-                              "ProcessLifecycleEvent directly.",
-                              self._platform_id, evt.type_)
-                    return
-
-                # evt.origin is a PID
-                pid = evt.origin
-
-                if not pid in self._rids:
-                    log.warn("%r: OOIION-1077 ignoring event from pid=%r. "
-                             "Expecting one of %s",
-                             self._platform_id, pid, self._rids.keys())
-                    return
-
-                origin = self._rids[pid]
-
-                # # Before the _rids mapping, a preliminary mechanism to check
-                # # whether the event came from the expected origin relied on
-                # # the process ID having origin as a substring:
-                #
-                # if not origin in pid:
-                #     log.warn("%r: OOIION-1077 ignoring event from origin %r. "
-                #              "Expecting an origin containing %r",
-                #              self._platform_id, pid, origin)
-                #     return
-                # # BUT this was definitely weak. Although the PID for an
-                # # initial agent process seems to satisfy this assumption,
-                # # this is not anymore the case upon a re-start of that agent.
-
-                log.debug("%r: OOIION-1077  _got_process_lifecycle_event: "
-                          "pid=%r origin=%r state=%r(%s)",
-                          self._platform_id, pid, origin,
-                          ProcessStateEnum._str_map[evt.state], evt.state)
-
-                if evt.state is ProcessStateEnum.TERMINATED:
-                    self._device_terminated_event(origin, pid)
-
-        # use associated process ID for the subscription:
         pid = ResourceAgentClient._get_agent_process_id(origin)
 
         if pid is None:
             log.warn("%r: OOIION-1077 ResourceAgentClient._get_agent_process_id"
-                     " returned None for origin=%r. Subscriber not created.",
+                     " returned None for origin=%r. Process lifecycle not tracked.",
                      self._platform_id, origin)
             return
 
-        sub = self._agent._create_event_subscriber(event_type="ProcessLifecycleEvent",
-                                                   origin_type='DispatchedProcess',
-                                                   origin=pid,
-                                                   callback=_got_process_lifecycle_event)
-
         with self._lock:
-            # but note that we use the given origin as index in _event_subscribers:
-            self._event_subscribers[origin] = sub
+            if pid not in self._rids:
+                self._bind_child_events("ProcessLifecycleEvent", pid, 'DispatchedProcess')
 
-            # and capture the pid -> origin mapping:
+            # capture the pid -> origin mapping:
             self._rids[pid] = origin
 
-        log.debug("%r: OOIION-1077 registered ProcessLifecycleEvent subscriber "
+        log.debug("%r: OOIION-1077 registered ProcessLifecycleEvent dispatch "
                   "with pid=%r (origin=%r)",
                   self._platform_id, pid, origin)
 
+    def _got_process_lifecycle_event(self, evt, *args, **kwargs):
+        """
+        Handles the ProcessLifecycleEvents from the children processes.
+        """
+        with self._lock:
+            # evt.origin is a PID
+            pid = evt.origin
+
+            if not pid in self._rids:
+                # not one of my children.
+                return
+
+            if not self._active:
+                log.warn("%r: _got_process_lifecycle_event called but "
+                         "manager has been destroyed",
+                         self._platform_id)
+                return
+
+            if evt.type_ != "ProcessLifecycleEvent":
+                log.trace("%r: ignoring event type %r. Only handle "
+                          "ProcessLifecycleEvent directly.",
+                          self._platform_id, evt.type_)
+                return
+
+            origin = self._rids[pid]
+
+            log.debug("%r: OOIION-1077  _got_process_lifecycle_event: "
+                      "pid=%r origin=%r state=%r(%s)",
+                      self._platform_id, pid, origin,
+                      ProcessStateEnum._str_map[evt.state], evt.state)
+
+            if evt.state is ProcessStateEnum.TERMINATED:
+                self._device_terminated_event(origin, pid)
+
     def _device_terminated_event(self, origin, pid):
         """
         Handles the ProcessLifecycleEvent TERMINATED event received for the
         given origin:
 
         - notifies platform to invalidate the associated child
-        - removes process lifecycle subscriber associated with the given origin
+        - removes the pid -> origin mapping and the related binding
         - set UNKNOWN for the corresponding child_agg_status
         - update rollup_status and do publication in case of change
 
@@ -467,7 +521,10 @@ class StatusManager(object):
         log.debug("%r: OOIION-1077 _device_terminated_event: origin=%r",
                   self._platform_id, origin)
 
-        self._stop_subscriber_process_lifecycle_event(origin, pid)
+        with self._lock:
+            if pid in self._rids:
+                del self._rids[pid]
+                self._unbind_child_events("ProcessLifecycleEvent", pid, 'DispatchedProcess')
 
         # set entries to UNKNOWN:
         self._initialize_child_agg_status(origin)
@@ -476,43 +533,10 @@ class StatusManager(object):
         for status_name in AggregateStatusType._str_map.keys():
             self._update_rollup_status_and_publish(status_name, origin)
 
-    def _stop_subscriber_process_lifecycle_event(self, origin, pid):
-        """
-        Removes the ProcessLifecycleEvent subscriber associated with the
-        given origin upon reception of TERMINATED event.
-        Also removes the pid -> origin mapping.
-        """
-        log.debug("%r: OOIION-1077 _stop_subscriber_process_lifecycle_event: origin=%r",
-                  self._platform_id, origin)
-
-        with self._lock:
-
-            if origin in self._event_subscribers:
-                self._terminate_event_subscriber(origin)
-
-            if pid in self._rids:
-                del self._rids[pid]
-
     #-------------------------------------------------------------------
     # supporting methods related with device_added, device_removed events
     #-------------------------------------------------------------------
 
-    def _start_subscriber_device_status_event(self, origin):
-        """
-        @param origin    the resource_id associated with child
-        """
-        event_type = "DeviceStatusEvent"
-        sub = self._agent._create_event_subscriber(event_type=event_type,
-                                                  origin=origin,
-                                                  callback=self._got_device_status_event)
-
-        with self._lock:
-            self._event_subscribers[origin] = sub
-
-        log.debug("%r: registered event subscriber for event_type=%r"
-                  " coming from origin=%r",
-                  self._platform_id, event_type, origin)
-
     def _got_device_status_event(self, evt, *args, **kwargs):
         """
         Handles "device_added" and "device_removed" DeviceStatusEvents.
@@ -521,6 +545,10 @@ class StatusManager(object):
         expected_subtypes = ("device_added", "device_removed", "device_failed_command")
 
         with self._lock:
+            if evt.origin not in self.aparam_child_agg_status:
+                # not one of my children.
+                return
+
             if not self._active:
                 log.warn("%r: _got_device_status_event called but "
                          "manager has been destroyed",
@@ -594,13 +622,45 @@ class StatusManager(object):
         @param origin               resource id of the child that has been added.
         @param statuses             initial values
         """
+        self._discard_child_statuses(origin)
         self.aparam_child_agg_status[origin] = {}
         for status_name in AggregateStatusType._str_map.keys():
             if statuses is None:
                 value = DeviceStatusType.STATUS_UNKNOWN
             else:
                 value = statuses[status_name]
-            self.aparam_child_agg_status[origin][status_name] = value
+            self._set_child_status(origin, status_name, value)
+
+    def _set_child_status(self, origin, status_name, status):
+        """
+        Sets a status of the given child, updating _child_status_counts.
+        """
+        child_statuses = self.aparam_child_agg_status[origin]
+        counts = self._child_status_counts[status_name]
+
+        old_status = child_statuses.get(status_name)
+        if old_status is not None:
+            counts[old_status] -= 1
+            if not counts[old_status]:
+                del counts[old_status]
+
+        child_statuses[status_name] = status
+        counts[status] += 1
+
+    def _discard_child_statuses(self, origin):
+        """
+        Removes the statuses of the given child, if any, updating
+        _child_status_counts.
+        """
+        child_statuses = self.aparam_child_agg_status.pop(origin, None)
+        if child_statuses is None:
+            return
+
+        for status_name, status in child_statuses.iteritems():
+            counts = self._child_status_counts[status_name]
+            counts[status] -= 1
+            if not counts[status]:
+                del counts[status]
 
     def _prepare_new_child(self, origin, update_rollup_status=True, statuses=None):
         """
@@ -613,13 +673,14 @@ class StatusManager(object):
         """
 
         with self._lock:
-            if origin not in self.aparam_child_agg_status or statuses is not None:
+            # note: being in aparam_child_agg_status is what makes the events
+            # from origin to be dispatched here:
+            if origin not in self.aparam_child_agg_status:
+                self._bind_child_events("DeviceStatusEvent", origin)
+                self._bind_child_events("DeviceAggregateStatusEvent", origin)
+                self._initialize_child_agg_status(origin, statuses)
+            elif statuses is not None:
                 self._initialize_child_agg_status(origin, statuses)
-
-            # start subscribers:
-            if origin not in self._event_subscribers:
-                self._start_subscriber_device_status_event(origin)
-                self._start_subscriber_device_aggregate_status_event(origin)
 
             if update_rollup_status:
                 for status_name in AggregateStatusType._str_map.keys():
@@ -667,18 +728,18 @@ class StatusManager(object):
         """
 
         with self._lock:
-            if origin in self._event_subscribers:
-                self._terminate_event_subscriber(origin)
-            else:
-                log.debug("%r: [TC] _remove_child: not in _event_subscribers: %r",
-                          self._platform_id, origin)
+            for pid in [pid for pid, rid in self._rids.iteritems() if rid == origin]:
+                del self._rids[pid]
+                self._unbind_child_events("ProcessLifecycleEvent", pid, 'DispatchedProcess')
 
             if not origin in self.aparam_child_agg_status:
                 log.debug("%r: [TC] _remove_child: not in aparam_child_agg_status: %r",
                           self._platform_id, origin)
                 return
 
-            del self.aparam_child_agg_status[origin]
+            self._unbind_child_events("DeviceStatusEvent", origin)
+            self._unbind_child_events("DeviceAggregateStatusEvent", origin)
+            self._discard_child_statuses(origin)
 
             log.debug("%r: [TC] _remove_child: removed from aparam_child_agg_status: %r",
                       self._platform_id, origin)
@@ -687,22 +748,6 @@ class StatusManager(object):
             for status_name in AggregateStatusType._str_map.keys():
                 self._update_rollup_status_and_publish(status_name, origin)
 
-    def _terminate_event_subscriber(self, origin):
-        """
-        Terminates event subscriber for the given origin and removes the
-        entry from _event_subscribers.
-        """
-        es = self._event_subscribers[origin]
-        try:
-            self._agent._destroy_event_subscriber(es)
-
-        except Exception as ex:
-            log.warn("%r: error destroying event subscriber: origin=%r: %s",
-                     self._platform_id, origin, ex)
-
-        finally:
-            del self._event_subscribers[origin]
-
     def device_failed_command_event(self, evt):
         """
         @todo Handles the device_failed_command event
@@ -715,24 +760,6 @@ class StatusManager(object):
     # supporting methods related with aggregate and rollup status
     #-------------------------------------------------------------------
 
-    def _start_subscriber_device_aggregate_status_event(self, origin):
-        """
-        Starts an event subscriber for aggregate status events from the given
-        child (origin).
-
-        @param origin    the resource_id associated with child
-        """
-        event_type = "DeviceAggregateStatusEvent"
-        sub = self._agent._create_event_subscriber(event_type=event_type,
-                                                  origin=origin,
-                                                  callback=self._got_device_aggregate_status_event)
-
-        with self._lock:
-            self._event_subscribers[origin] = sub
-
-        log.debug("%r: registered event subscriber for event_type=%r",
-                  self._platform_id, event_type)
-
     def _got_device_aggregate_status_event(self, evt, *args, **kwargs):
         """
         Reacts to a DeviceAggregateStatusEvent from a platform's child.
@@ -749,6 +776,10 @@ class StatusManager(object):
         """
 
         with self._lock:
+            if evt.origin not in self.aparam_child_agg_status:
+                # not one of my children.
+                return
+
             if not self._active:
                 log.warn("%r: _got_device_aggregate_status_event called but "
                          "manager has been destroyed",
@@ -765,13 +796,6 @@ class StatusManager(object):
             log.error(msg)
             raise PlatformException(msg)
 
-        if evt.origin not in self.aparam_child_agg_status:
-            # should not happen.
-            msg = "%r: got event from unrecognized origin=%s" % (
-                  self._platform_id, evt.origin)
-            log.error(msg)
-            raise PlatformException(msg)
-
         status_name = evt.status_name
         child_origin = evt.origin
         child_status = evt.status
@@ -780,6 +804,10 @@ class StatusManager(object):
         self._agent._child_running(child_origin)
 
         with self._lock:
+            if child_origin not in self.aparam_child_agg_status:
+                # removed in the meantime.
+                return
+
             old_status = self.aparam_child_agg_status[child_origin][status_name]
             if child_status == old_status:
                 #
@@ -788,7 +816,7 @@ class StatusManager(object):
                 return
 
             # update the specific status
-            self.aparam_child_agg_status[child_origin][status_name] = child_status
+            self._set_child_status(child_origin, status_name, child_status)
 
             # TODO any need to pass child's alerts_list in the next call? See OOIION-1275
             new_rollup_status = self._update_rollup_status_and_publish(status_name, child_origin)
@@ -805,12 +833,12 @@ class StatusManager(object):
         @return (new_rollup_status, old_rollup_status)
         """
         with self._lock:
-            # get all status values for the status name, that is,
-            # all from the children ...
-            all_status_values = [s[status_name] for s in self.aparam_child_agg_status.values()]
+            # get the distinct status values for the status name, that is,
+            # all from the children (the histogram keeps only those present) ...
+            all_status_values = set(self._child_status_counts[status_name])
 
             # plus status from the platform itself ...
-            all_status_values.append(self.aparam_aggstatus[status_name])
+            all_status_values.add(self.aparam_aggstatus[status_name])
 
             # ... to calculate the new rollup_status:
             new_rollup_status = _consolidate_status(all_status_values)
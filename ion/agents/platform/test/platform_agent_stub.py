@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.platform.test.platform_agent_stub
+@file    ion/agents/platform/test/platform_agent_stub.py
+@brief   Platform agent stub for the unit tests of the agent and its helpers.
+"""
+
+__license__ = 'Apache 2.0'
+
+
+from mock import Mock
+
+from ion.agents.platform.platform_agent import PlatformAgent
+
+
+def create_platform_agent(mocked=(), **attrs):
+    """
+    Creates a PlatformAgent without calling its constructor, so no container
+    or driver is needed. Only _platform_id and the given attributes are set.
+
+    @param mocked   names of the methods to be replaced by Mocks, typically
+                    those that interact with the container.
+    @param attrs    attributes to set on the agent.
+    """
+    agent = PlatformAgent.__new__(PlatformAgent)
+    agent._platform_id = 'LJ01D'
+    for name in mocked:
+        setattr(agent, name, Mock())
+    for name, value in attrs.iteritems():
+        setattr(agent, name, value)
+    return agent
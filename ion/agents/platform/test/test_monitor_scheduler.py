@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.platform.test.test_monitor_scheduler
+@file    ion/agents/platform/test/test_monitor_scheduler.py
+@brief   Unit test cases for the shared scheduling of resource monitoring
+"""
+
+__license__ = 'Apache 2.0'
+
+#
+# bin/nosetests -v ion/agents/platform/test/test_monitor_scheduler.py:Test
+# bin/nosetests -v -a UTIL ion/agents/platform/test/test_monitor_scheduler.py:MonitorSchedulerBenchmark
+
+
+from pyon.public import log
+from ion.agents.platform.rsn.simulator.logger import Logger
+Logger.set_logger(log)
+
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import IonUnitTestCase
+
+from ion.agents.platform.monitor_scheduler import MonitorScheduler
+from ion.agents.platform.monitor_scheduler import get_monitor_scheduler
+from ion.agents.platform.platform_resource_monitor import PlatformResourceMonitor
+from ion.agents.platform.resource_monitor import ResourceMonitor
+from ion.agents.platform.rsn.simulator.oms_simulator import CIOMSSimulator
+from ion.agents.platform.util import ion_ts_2_ntp
+
+from gevent import sleep
+import time
+
+
+class FakePlatform(object):
+    """
+    Records the get_attribute_values requests for a platform.
+    """
+    def __init__(self, platform_id):
+        self.platform_id = platform_id
+        self.requests = []
+        self.events = []
+
+    def get_attribute_values(self, attrs):
+        self.requests.append([attr_id for attr_id, _ in attrs])
+        ntp_ts = ion_ts_2_ntp(time.time() * 1000)
+        return dict((attr_id, [(len(self.requests), ntp_ts)]) for attr_id, _ in attrs)
+
+    def monitor(self, scheduler, rate_secs, attr_ids):
+        attr_defns = [{'attr_id': attr_id} for attr_id in attr_ids]
+        return ResourceMonitor(self.platform_id, rate_secs, attr_defns,
+                               self.get_attribute_values, self.events.append,
+                               scheduler=scheduler)
+
+
+@attr('UNIT', group='sa')
+class Test(IonUnitTestCase):
+
+    def setUp(self):
+        self.scheduler = MonitorScheduler(tick_secs=0.05, max_jitter_secs=0)
+        self.addCleanup(self.scheduler.stop)
+
+    def test_batched_requests(self):
+        p1 = FakePlatform('LJ01D')
+        p2 = FakePlatform('MJ01C')
+        monitors = [p1.monitor(self.scheduler, 0.2, ['input_voltage|0']),
+                    p1.monitor(self.scheduler, 0.4, ['MVPC_pressure_1|0', 'MVPC_temperature|0']),
+                    p2.monitor(self.scheduler, 0.2, ['input_bus_current|0'])]
+        for monitor in monitors:
+            monitor.start()
+
+        sleep(0.9)
+
+        # the 0.4 monitor of LJ01D is served by the requests of the 0.2 one:
+        self.assertEquals(4, len(p1.requests))
+        self.assertEquals(['input_voltage|0'], p1.requests[0])
+        self.assertEquals(set(['input_voltage|0', 'MVPC_pressure_1|0', 'MVPC_temperature|0']),
+                          set(p1.requests[1]))
+        self.assertEquals(4, len(p2.requests))
+
+        # each monitor only notifies its own attributes:
+        self.assertEquals(6, len(p1.events))
+        for driver_event in p1.events:
+            self.assertIn(set(driver_event.vals_dict),
+                          [set(['input_voltage|0']), set(['MVPC_pressure_1|0', 'MVPC_temperature|0'])])
+
+        # one wakeup per slot with due monitors:
+        stats = self.scheduler.stats()
+        self.assertEquals(8, stats['requests'])
+        self.assertLessEqual(stats['wakeups'], 6)
+        self.assertEquals(3, stats['monitors'])
+
+        for monitor in monitors:
+            monitor.stop()
+        self.assertEquals(0, self.scheduler.stats()['monitors'])
+        sleep(0.3)
+        self.assertEquals(4, len(p1.requests))
+        self.assertEquals(4, len(p2.requests))
+
+    def test_jitter(self):
+        scheduler = MonitorScheduler(tick_secs=0.05, max_jitter_secs=0.5)
+        self.addCleanup(scheduler.stop)
+        platforms = [FakePlatform('platform_%s' % i) for i in xrange(20)]
+        for platform in platforms:
+            platform.monitor(scheduler, 1.0, ['attr|0']).start()
+            platform.monitor(scheduler, 1.0, ['attr|1']).start()
+
+        # platforms are spread over the jitter interval, but the monitors
+        # of a platform still share the requests:
+        slots = set()
+        for key, monitors in scheduler._monitors.iteritems():
+            platform_slots = set(scheduler._slot(monitor._deadline) for monitor in monitors)
+            self.assertEquals(1, len(platform_slots))
+            slots |= platform_slots
+        self.assertGreater(len(slots), 1)
+
+        sleep(1.6)
+        for platform in platforms:
+            self.assertEquals([['attr|0', 'attr|1']], map(sorted, platform.requests))
+
+    def test_failed_request(self):
+        p1 = FakePlatform('LJ01D')
+        p1.get_attribute_values = lambda attrs: p1.requests.append(attrs) or 1/0
+        monitor = p1.monitor(self.scheduler, 0.1, ['input_voltage|0'])
+        monitor.start()
+        sleep(0.35)
+        monitor.stop()
+        # still re-scheduled after the exceptions:
+        self.assertEquals(3, len(p1.requests))
+        self.assertEquals([], p1.events)
+
+    def test_scheduler_errors(self):
+        p1 = FakePlatform('LJ01D')
+        p2 = FakePlatform('MJ01C')
+        broken = p1.monitor(self.scheduler, 0.1, ['input_voltage|0'])
+        monitor = p2.monitor(self.scheduler, 0.1, ['input_bus_current|0'])
+        broken.start()
+        monitor.start()
+        # fails the re-scheduling of the monitor:
+        broken._rate_secs = None
+        sleep(0.35)
+        self.assertEquals(3, len(p2.requests))
+
+        # an error in the scheduler greenlet itself does not stop it:
+        self.scheduler._key = lambda monitor: 1/0
+        sleep(0.15)
+        del self.scheduler._key
+        self.assertFalse(self.scheduler._runnable.dead)
+        p3 = FakePlatform('Node1D')
+        p3.monitor(self.scheduler, 0.1, ['input_voltage|0']).start()
+        sleep(0.15)
+        self.assertEquals(1, len(p3.requests))
+
+
+@attr('UTIL', group='sa')
+class MonitorSchedulerBenchmark(IonUnitTestCase):
+    """
+    Resource monitoring for all the platforms of the simulated RSN network
+    in this container, against the OMS simulator.
+    """
+    duration = 30
+
+    def test_monitoring(self):
+        oms = CIOMSSimulator()
+
+        def get_attribute_values(platform_id):
+            def get(attrs):
+                attrs_ntp = [(attr_id, ion_ts_2_ntp(from_time)) for (attr_id, from_time) in attrs]
+                return oms.get_platform_attribute_values(platform_id, attrs_ntp)[platform_id]
+            return get
+
+        events = []
+        prms = []
+        for platform_id, pnode in oms._pnodes.iteritems():
+            attrs = dict((attr.attr_id, attr.defn) for attr in pnode.attrs.itervalues())
+            if not attrs:
+                continue
+            prm = PlatformResourceMonitor(platform_id, attrs,
+                                          get_attribute_values(platform_id), events.append)
+            prms.append(prm)
+
+        scheduler = get_monitor_scheduler()
+        before = scheduler.stats()
+        for prm in prms:
+            prm.start_resource_monitoring()
+        sleep(self.duration)
+        after = scheduler.stats()
+        for prm in prms:
+            prm.destroy()
+
+        # what one greenlet per monitor, waking every 0.5 secs at most and
+        # doing a request per rate period, would have done:
+        rates = [rate for prm in prms for rate in prm._group_by_monitoring_rate()]
+        legacy_requests = sum(int(self.duration / rate) for rate in rates)
+        legacy_wakeups = sum(int(self.duration / min(0.5, rate)) for rate in rates)
+
+        log.info("%d platforms, %d monitors, %ss: requests %d (one greenlet per monitor: %d), "
+                 "wakeups %d (%d), %d granule events",
+                 len(prms), len(rates), self.duration,
+                 after['requests'] - before['requests'], legacy_requests,
+                 after['wakeups'] - before['wakeups'], legacy_wakeups, len(events))
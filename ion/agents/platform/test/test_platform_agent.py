@@ -10,16 +10,141 @@
 __author__ = 'Carlos Rueda'
 __license__ = 'Apache 2.0'
 
+#
+# bin/nosetests -v ion/agents/platform/test/test_platform_agent.py:TestPlatformAgent.test_fan_out
+# bin/nosetests -v ion/agents/platform/test/test_platform_agent.py:TestPlatformAgent.test_instruments_execute_agent
 
-import unittest
+
+from pyon.public import log
+from pyon.util.containers import DotDict
+from pyon.agent.agent import ResourceAgentState
 from nose.plugins.attrib import attr
+from mock import Mock
+import unittest
+
+from ion.agents.platform.exceptions import PlatformException
+from ion.agents.platform.test.platform_agent_stub import create_platform_agent
+
+import gevent
+import time
+
+
+def create_agent(fan_out_size=10, child_timeout=None):
+    """
+    A platform agent with just the state needed to dispatch to children.
+    """
+    return create_platform_agent(_fan_out_size=fan_out_size,
+                                 _child_timeout=child_timeout,
+                                 _status_manager=Mock(),
+                                 _ia_clients={})
 
 
 @attr('UNIT', group='sa')
 class TestPlatformAgent(unittest.TestCase):
     """
-    Class intended for *unit* tests; currently none as the current focus is
-    on the more integrated behavior, see test_platform_agent_with_oms.
+    Unit tests for the dispatch of commands to the children; see
+    test_platform_agent_with_rsn for the more integrated behavior.
     """
-    # TODO define appropriate unit tests for the platform agent class.
-    pass
+
+    def test_fan_out(self):
+        agent = create_agent(fan_out_size=3, child_timeout=0.5)
+        running = []
+        peak = [0]
+
+        def func(child_id):
+            running.append(child_id)
+            peak[0] = max(peak[0], len(running))
+            try:
+                if child_id == 'hangs':
+                    gevent.sleep(5)
+                elif child_id == 'fails':
+                    raise ValueError('bad child')
+                gevent.sleep(0.1)
+                return child_id.upper()
+            finally:
+                running.remove(child_id)
+
+        child_ids = ['c%s' % i for i in xrange(6)] + ['hangs', 'fails']
+        start = time.time()
+        results = agent._fan_out(child_ids, func, 'test')
+        elapsed = time.time() - start
+
+        self.assertEquals(set(results), set(child_ids))
+        self.assertEquals(peak[0], 3)
+        self.assertLess(elapsed, 2)
+        for i in xrange(6):
+            self.assertEquals(results['c%s' % i], ('C%s' % i, None))
+
+        retval, ex = results['hangs']
+        self.assertIsNone(retval)
+        self.assertIsInstance(ex, PlatformException)
+        self.assertIn('timed out', str(ex))
+
+        retval, ex = results['fails']
+        self.assertIsInstance(ex, ValueError)
+
+        self.assertEquals(agent._fan_out([], func, 'test'), {})
+
+    def test_instruments_execute_agent(self):
+        agent = create_agent()
+        for i in xrange(4):
+            ia_client = Mock()
+            ia_client.get_agent_state.return_value = ResourceAgentState.IDLE
+            agent._ia_clients['i%s' % i] = DotDict(ia_client=ia_client, resource_id='r%s' % i)
+        # already in the expected state:
+        agent._ia_clients['i3'].ia_client.get_agent_state.return_value = ResourceAgentState.COMMAND
+
+        def execute_instrument_agent(ia_client, cmd, instrument_id):
+            gevent.sleep(0.1)
+            if instrument_id == 'i1':
+                raise ValueError('bad instrument')
+            ia_client.get_agent_state.return_value = ResourceAgentState.COMMAND
+        agent._execute_instrument_agent = execute_instrument_agent
+
+        start = time.time()
+        children_with_errors = agent._instruments_execute_agent(
+            command='RESOURCE_AGENT_EVENT_GO_ACTIVE',
+            expected_state=ResourceAgentState.COMMAND)
+        self.assertLess(time.time() - start, 0.25)
+
+        self.assertEquals(set(children_with_errors), set(['i1']))
+        self.assertIn('bad instrument', children_with_errors['i1'])
+        publish = agent._status_manager.publish_device_failed_command_event
+        self.assertEquals(publish.call_count, 1)
+        self.assertEquals(publish.call_args[0][0], 'r1')
+        self.assertEquals(publish.call_args[0][2], children_with_errors['i1'])
+
+        # unexpected exceptions are also reported per child
+        agent._ia_clients['i2'].ia_client.get_agent_state.side_effect = ValueError('lost client')
+        children_with_errors = agent._instruments_execute_agent(
+            command='RESOURCE_AGENT_EVENT_GO_ACTIVE',
+            expected_state=ResourceAgentState.COMMAND)
+        self.assertEquals(set(children_with_errors), set(['i1', 'i2']))
+        self.assertIn('lost client', children_with_errors['i2'])
+        self.assertEquals(publish.call_count, 3)
+
+
+@attr('UTIL', group='sa')
+class PlatformAgentFanOutBenchmark(unittest.TestCase):
+    """
+    Dispatch of a command over a tree of platforms with simulated RPC latency.
+    """
+    fan_out = 6
+    depth = 3
+    latency = 0.05
+
+    def _dispatch(self, fan_out_size, level=0):
+        if level == self.depth:
+            gevent.sleep(self.latency)
+            return 0
+        agent = create_agent(fan_out_size=fan_out_size)
+        child_ids = ['c%s' % i for i in xrange(self.fan_out)]
+        results = agent._fan_out(child_ids, lambda c: self._dispatch(fan_out_size, level + 1) + 1, 'benchmark')
+        return sum(retval for retval, _ in results.itervalues())
+
+    def test_fan_out(self):
+        for fan_out_size in (1, self.fan_out):
+            start = time.time()
+            children = self._dispatch(fan_out_size)
+            log.info('fan_out_pool_size=%s: %s children in %.3fs',
+                     fan_out_size, children, time.time() - start)
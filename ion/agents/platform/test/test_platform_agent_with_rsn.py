@@ -712,7 +712,7 @@ class TestPlatformAgent(BaseIntTestPlatform):
         # the most recent ones, meaning that the retrieved values should *not*
         # be older than a small multiple of the nominal monitoring rate, even
         # after a long period in non-monitoring state.
-        # See ResourceMonitor._retrieve_attribute_values
+        # See ResourceMonitor._get_attrs_to_request
         #
 
         # start this test as in test_resource_monitoring()
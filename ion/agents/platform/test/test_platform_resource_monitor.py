@@ -21,7 +21,9 @@ from pyon.util.unit_test import IonUnitTestCase
 
 from ion.agents.platform.platform_resource_monitor import PlatformResourceMonitor
 from ion.agents.platform.util.network_util import NetworkUtil
+from ion.util.test.benchmark_helper import best_of
 
+import numpy
 import pprint
 
 
@@ -148,23 +150,112 @@ class Test(IonUnitTestCase):
         # verify the expected aligned values so they are on a common set of
         # timestamps:
 
+        self.assertEquals([9000, 9001, 9002], driver_event.timestamps.tolist())
+
         input_voltage     = vals_dict["input_voltage"]
         input_bus_current = vals_dict["input_bus_current"]
         MVPC_temperature  = vals_dict["MVPC_temperature"]
 
         self.assertEquals(
-            [(1000, 9000), (1001, 9001), (1002, 9002)],
-            input_voltage
+            [1000, 1001, 1002],
+            input_voltage.tolist()
         )
 
-        # note the None entries that must have been created
+        # note the masked (None) entries that must have been created
 
         self.assertEquals(
-            [(2000, 9000),  (None, 9001), (2002, 9002)],
-            input_bus_current
+            [2000, None, 2002],
+            input_bus_current.tolist()
         )
 
         self.assertEquals(
-            [(None, 9000),  (3000, 9001), (None, 9002)],
-            MVPC_temperature
+            [None, 3000, None],
+            MVPC_temperature.tolist()
         )
+
+        # attributes without actual values are all masked:
+        self.assertEquals(
+            [None, None, None],
+            vals_dict["MVPC_pressure_1"].tolist()
+        )
+
+        # nothing collected, nothing notified:
+        self._driver_event = None
+        prm._dispatch_publication()
+        self.assertIsNone(self._driver_event)
+
+    def test_aggregation_unordered_timestamps(self):
+        platform_id = "LJ01D"
+        attrs = self._get_attrs(platform_id)
+
+        prm = PlatformResourceMonitor(
+            platform_id, attrs,
+            self._get_attribute_values_dummy, self.evt_recv)
+
+        prm._init_buffers()
+        bufs = prm._buffers
+        # values from several monitoring cycles, timestamps not in order
+        # across attributes:
+        bufs["input_voltage"]     = [(1002, 9002.5), (1000, 9000.0)]
+        bufs["input_bus_current"] = [(2001, 9001.0), (2002, 9002.5), (2003, 9003.0)]
+
+        prm._dispatch_publication()
+        driver_event = self._driver_event
+
+        self.assertEquals([9000.0, 9001.0, 9002.5, 9003.0],
+                          driver_event.timestamps.tolist())
+        self.assertEquals([1000, None, 1002, None],
+                          driver_event.vals_dict["input_voltage"].tolist())
+        self.assertEquals([None, 2001, 2002, 2003],
+                          driver_event.vals_dict["input_bus_current"].tolist())
+        self.assertEquals([1000, 1002],
+                          driver_event.vals_dict["input_voltage"].compressed().tolist())
+
+
+@attr('UTIL', group='sa')
+class PlatformResourceMonitorBenchmark(IonUnitTestCase):
+    attributes = 300
+    samples = 60
+
+    def _buffers(self):
+        # each attribute sampled at its own rate over the cycle:
+        buffers = {}
+        for i in xrange(self.attributes):
+            step = 1 + i % 4
+            buffers['attr_%s|0' % i] = [(float(i * t), 3600000.0 + t * 0.25)
+                                        for t in xrange(0, self.samples * step, step)]
+        return buffers
+
+    def test_dispatch_publication(self):
+        buffers = self._buffers()
+        events = []
+        attrs = dict((attr_id, {'monitor_cycle_seconds': 5}) for attr_id in buffers)
+        prm = PlatformResourceMonitor('LJ01D', attrs, None, events.append)
+
+        def dispatch():
+            prm._buffers = dict((attr_id, list(vals)) for attr_id, vals in buffers.iteritems())
+            prm._dispatch_publication()
+        elapsed = best_of(dispatch, repeat=1, number=1)
+
+        def per_timestamp():
+            # Baseline: one dict per timestamp, None for every attribute missing
+            # at a timestamp, in timestamp order
+            rows = {}
+            for attr_id, attr_vals in buffers.iteritems():
+                for val, ts in attr_vals:
+                    rows.setdefault(ts, {})[attr_id] = val
+            timestamps = sorted(rows)
+            return dict((attr_id, [(rows[ts].get(attr_id), ts) for ts in timestamps])
+                        for attr_id in buffers)
+        baseline = best_of(per_timestamp, repeat=1, number=1)
+
+        # every sample ends up at its own timestamp:
+        vals_dict = events[0].vals_dict
+        timestamps = events[0].timestamps
+        for attr_id, attr_vals in buffers.iteritems():
+            present = ~numpy.ma.getmaskarray(vals_dict[attr_id])
+            self.assertEquals(attr_vals, zip(vals_dict[attr_id].compressed().tolist(),
+                                             timestamps[present].tolist()))
+
+        log.info("%s attributes, %s timestamps: columnar merge %.3fs, per-timestamp merge %.3fs, %.1fx",
+                 self.attributes, len(timestamps), elapsed, baseline, baseline / elapsed)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.platform.test.test_status_manager
+@file    ion/agents/platform/test/test_status_manager.py
+@brief   Unit test cases for the status handling of the platform agent.
+"""
+
+__license__ = 'Apache 2.0'
+
+#
+# bin/nosetests -v ion/agents/platform/test/test_status_manager.py
+
+
+from pyon.public import log
+from pyon.util.containers import DotDict
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import IonUnitTestCase
+from mock import Mock, patch
+
+from interface.objects import AggregateStatusType
+from interface.objects import DeviceStatusType
+from interface.objects import ProcessStateEnum
+
+from ion.agents.platform.status_manager import StatusManager
+from ion.agents.platform.status_manager import _consolidate_status
+from ion.agents.platform.test.platform_agent_stub import create_platform_agent
+
+import random
+import time
+
+
+def create_agent(children):
+    """
+    A platform agent with just the elements used by StatusManager.
+    """
+    pa = create_platform_agent(mocked=['_create_event_subscriber', '_destroy_event_subscriber',
+                                       '_bind_event_subscriber', '_unbind_event_subscriber',
+                                       '_child_running', '_child_terminated',
+                                       '_get_invalidated_children', 'get_agent_state'],
+                               resource_id='platform_rid',
+                               _children_resource_ids=children,
+                               _event_publisher=Mock(),
+                               aparam_child_agg_status={},
+                               aparam_aggstatus={},
+                               aparam_rollup_status={})
+    pa._create_event_subscriber.side_effect = lambda **kwargs: Mock(kwargs=kwargs)
+    return pa
+
+
+def aggregate_status_event(origin, status_name, status):
+    return DotDict(type_="DeviceAggregateStatusEvent", origin=origin,
+                   status_name=status_name, status=status)
+
+
+@attr('UNIT', group='sa')
+class TestStatusManager(IonUnitTestCase):
+
+    def setUp(self):
+        self.children = ['child_%s' % i for i in xrange(20)]
+        self.pa = create_agent(self.children)
+        self.sm = StatusManager(self.pa)
+        self.addCleanup(self.sm.destroy)
+        self.callbacks = dict((call[1]['event_type'], call[1]['callback'])
+                              for call in self.pa._create_event_subscriber.call_args_list)
+
+    def _expected_rollup_status(self, status_name):
+        statuses = [s[status_name] for s in self.pa.aparam_child_agg_status.values()]
+        statuses.append(self.pa.aparam_aggstatus[status_name])
+        return _consolidate_status(statuses)
+
+    def test_subscribers(self):
+        # same subscribers regardless of the number of children:
+        origins = [call[1].get('origin') for call in self.pa._create_event_subscriber.call_args_list
+                   if call[1]['event_type'] != "DeviceStatusEvent" or call[1].get('origin') != "command_line"]
+        self.assertEquals(['platform_rid'] * 3, origins)
+
+        # each bound to the origins of the children only:
+        bindings = [(call[1]['event_type'], call[1]['origin'])
+                    for call in self.pa._bind_event_subscriber.call_args_list]
+        self.assertEquals(sorted((event_type, origin) for origin in self.children
+                                 for event_type in ["DeviceStatusEvent", "DeviceAggregateStatusEvent"]),
+                          sorted(bindings))
+
+        self.sm._remove_child('child_5')
+        unbindings = [(call[1]['event_type'], call[1]['origin'])
+                      for call in self.pa._unbind_event_subscriber.call_args_list]
+        self.assertEquals([("DeviceStatusEvent", 'child_5'), ("DeviceAggregateStatusEvent", 'child_5')],
+                          unbindings)
+
+        # events from devices that are not my children are ignored:
+        callback = self.callbacks["DeviceAggregateStatusEvent"]
+        callback(aggregate_status_event('other_rid', AggregateStatusType.AGGREGATE_COMMS,
+                                        DeviceStatusType.STATUS_CRITICAL))
+        self.assertFalse(self.pa._child_running.called)
+        self.assertFalse(self.pa._event_publisher.publish_event.called)
+
+        callback(aggregate_status_event('child_3', AggregateStatusType.AGGREGATE_COMMS,
+                                        DeviceStatusType.STATUS_CRITICAL))
+        self.pa._child_running.assert_called_once_with('child_3')
+        self.assertEquals(DeviceStatusType.STATUS_CRITICAL,
+                          self.pa.aparam_rollup_status[AggregateStatusType.AGGREGATE_COMMS])
+        evt = self.pa._event_publisher.publish_event.call_args[1]
+        self.assertEquals('DeviceAggregateStatusEvent', evt['event_type'])
+        self.assertEquals(DeviceStatusType.STATUS_CRITICAL, evt['status'])
+
+    def test_process_lifecycle(self):
+        with patch('ion.agents.platform.status_manager.ResourceAgentClient') as rac:
+            rac._get_agent_process_id.side_effect = lambda origin: 'pid_' + origin
+            self.sm._register_child_process('child_1')
+        sub, kwargs = self.pa._bind_event_subscriber.call_args
+        self.assertEquals(dict(event_type="ProcessLifecycleEvent", origin='pid_child_1',
+                               origin_type='DispatchedProcess'), kwargs)
+
+        status_name = AggregateStatusType.AGGREGATE_POWER
+        self.sm._set_child_status('child_1', status_name, DeviceStatusType.STATUS_OK)
+
+        callback = self.callbacks["ProcessLifecycleEvent"]
+        callback(DotDict(type_="ProcessLifecycleEvent", origin='pid_other',
+                         state=ProcessStateEnum.TERMINATED))
+        self.assertFalse(self.pa._child_terminated.called)
+
+        callback(DotDict(type_="ProcessLifecycleEvent", origin='pid_child_1',
+                         state=ProcessStateEnum.TERMINATED))
+        self.pa._child_terminated.assert_called_once_with('child_1')
+        self.assertEquals(DeviceStatusType.STATUS_UNKNOWN,
+                          self.pa.aparam_child_agg_status['child_1'][status_name])
+        self.assertNotIn('pid_child_1', self.sm._rids)
+        sub, kwargs = self.pa._unbind_event_subscriber.call_args
+        self.assertEquals(dict(event_type="ProcessLifecycleEvent", origin='pid_child_1',
+                               origin_type='DispatchedProcess'), kwargs)
+
+    def test_rollup_status_counts(self):
+        random.seed(0)
+        statuses = [DeviceStatusType.STATUS_OK, DeviceStatusType.STATUS_WARNING,
+                    DeviceStatusType.STATUS_CRITICAL, DeviceStatusType.STATUS_UNKNOWN]
+        status_names = AggregateStatusType._str_map.keys()
+        callback = self.callbacks["DeviceAggregateStatusEvent"]
+
+        for i in xrange(500):
+            status_name = random.choice(status_names)
+            if i % 50 == 0:
+                self.sm.set_aggstatus(status_name, random.choice(statuses))
+            elif i % 60 == 0:
+                self.sm._remove_child(random.choice(self.pa.aparam_child_agg_status.keys()))
+            elif i % 70 == 0:
+                self.sm._prepare_new_child('child_%s' % (100 + i))
+            else:
+                origin = random.choice(self.pa.aparam_child_agg_status.keys())
+                callback(aggregate_status_event(origin, status_name, random.choice(statuses)))
+
+            for status_name in status_names:
+                self.assertEquals(self._expected_rollup_status(status_name),
+                                  self.pa.aparam_rollup_status[status_name])
+
+                counts = self.sm._child_status_counts[status_name]
+                self.assertEquals(len(self.pa.aparam_child_agg_status), sum(counts.values()))
+                self.assertNotIn(0, counts.values())
+
+
+@attr('UTIL', group='sa')
+class StatusManagerBenchmark(IonUnitTestCase):
+    children = 2000
+    events = 20000
+
+    def test_aggregate_status_events(self):
+        children = ['child_%s' % i for i in xrange(self.children)]
+        pa = create_agent(children)
+        sm = StatusManager(pa)
+        callbacks = dict((call[1]['event_type'], call[1]['callback'])
+                         for call in pa._create_event_subscriber.call_args_list)
+        callback = callbacks["DeviceAggregateStatusEvent"]
+
+        random.seed(0)
+        statuses = [DeviceStatusType.STATUS_OK, DeviceStatusType.STATUS_WARNING,
+                    DeviceStatusType.STATUS_CRITICAL, DeviceStatusType.STATUS_UNKNOWN]
+        status_names = AggregateStatusType._str_map.keys()
+        events = [aggregate_status_event(random.choice(children), random.choice(status_names),
+                                         random.choice(statuses))
+                  for i in xrange(self.events)]
+
+        start = time.time()
+        for evt in events:
+            callback(evt)
+        elapsed = time.time() - start
+        log.info("%s children: %s DeviceAggregateStatusEvents in %.3fs (%.0f events/s), "
+                 "%s event subscribers", self.children, self.events, elapsed,
+                 self.events / elapsed, pa._create_event_subscriber.call_count)
+        sm.destroy()
@@ -39,47 +39,82 @@ def populate_rdt(rdt, vals):
          u'driver_timestamp': 3578927113.75216}]
     @retval A valid, filled RDT structure
     """
-    array_size = len(vals)
-    data_arrays = {}    
-        
-    # Populate the temporal parameter.
-    data_arrays[rdt.temporal_parameter] = [None] * array_size
-        
-    found_preferred_timestamp = False
+    accumulator = ParticleAccumulator(rdt)
+    accumulator.extend(vals)
+    return accumulator.to_rdt(rdt)
 
-    for i, particle in enumerate(vals):
-        preferred_timestamp = DataParticleKey.DRIVER_TIMESTAMP
-        if DataParticleKey.PREFERRED_TIMESTAMP in particle:
-            preferred_timestamp = particle[DataParticleKey.PREFERRED_TIMESTAMP]
+
+class ParticleAccumulator(object):
+    """
+    Accumulates data particles column by column for a stream, so that particles
+    can be appended as they arrive and converted to an RDT in one step.
+    Each field holds a list of values, padded with None for the particles
+    that did not provide the field. Fields no particle provided are left unset.
+    """
+    def __init__(self, rdt):
+        """
+        @param rdt A RecordDictionaryTool for the stream, only used to look up
+        its fields and temporal parameter.
+        """
+        self.fields = frozenset(k for k in rdt.fields if k in rdt)
+        self.temporal_parameter = rdt.temporal_parameter
+        self.columns = {self.temporal_parameter : []}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _set(self, key, i, value):
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[key] = []
+        if len(column) > i:
+            column[i] = value
+        else:
+            if len(column) < i:
+                column.extend([None] * (i - len(column)))
+            column.append(value)
+
+    def append(self, particle):
+        """
+        Append the values of a data particle dictionary, see populate_rdt.
+        """
+        i = self.count
+        self.count += 1
+        fields = self.fields
+
+        preferred_timestamp = particle.get(DataParticleKey.PREFERRED_TIMESTAMP, DataParticleKey.DRIVER_TIMESTAMP)
+        self._set(self.temporal_parameter, i, particle.get(preferred_timestamp))
 
         for k,v in particle.iteritems():
             if k == DataParticleKey.VALUES:
                 for value_dict in v:
                     value_id = value_dict[DataParticleKey.VALUE_ID]
-                    value = value_dict[DataParticleKey.VALUE]
-                    if value_id in rdt:
-                        if value_id not in data_arrays:
-                            data_arrays[value_id] = [None] * array_size
+                    if value_id in fields:
+                        value = value_dict[DataParticleKey.VALUE]
                         if 'binary' in value_dict:
                             value = base64.b64decode(value)
-                        data_arrays[value_id][i] = value
-            
-            elif k in rdt:
-                if k not in data_arrays:
-                    data_arrays[k] = [None] * array_size
-                data_arrays[k][i] = v
+                        self._set(value_id, i, value)
 
-            if k == preferred_timestamp:
-                data_arrays[rdt.temporal_parameter][i] = v
-                found_preferred_timestamp = True
+            elif k in fields:
+                self._set(k, i, v)
 
-    for k,v in data_arrays.iteritems():
-        try:
-            rdt[k] = numpy.array(v)
-        except ValueError:
-            log.error("Couldn't set %s as %s", k, repr(v))
-            raise
+    def extend(self, particles):
+        for particle in particles:
+            self.append(particle)
 
-    return rdt
+    def to_rdt(self, rdt):
+        """
+        Set the accumulated columns on an empty RDT for the stream.
+        @retval The filled RDT.
+        """
+        for k,v in self.columns.iteritems():
+            if len(v) < self.count:
+                v.extend([None] * (self.count - len(v)))
+            try:
+                rdt[k] = numpy.array(v)
+            except ValueError:
+                log.error("Couldn't set %s as %s", k, repr(v))
+                raise
 
-            
+        return rdt
@@ -12,6 +12,7 @@ __author__ = 'Edward Hunter'
 __license__ = 'Apache 2.0'
 
 import socket
+import select
 import threading
 import time
 import datetime
@@ -35,6 +36,15 @@ l = lp.EthernetDeviceLogger('137.110.112.119', 4001, 8888)
 c = lp.LoggerClient('localhost', 8888, '\r\n')
 """
 
+# Maximum secs the captured traffic stays unflushed in the logfile. Also the
+# maximum time the run loop waits for traffic, so parent checks still happen
+# when the line is idle.
+LOGFILE_FLUSH_INTERVAL = 1.0
+
+# Secs to wait for a full socket send buffer to drain before the connection
+# is considered lost.
+SEND_TIMEOUT = 10.0
+
 class BaseLoggerProcess(DaemonProcess):
     """
     Base class for device loggers. Device loggers are communication
@@ -73,8 +83,10 @@ class BaseLoggerProcess(DaemonProcess):
         DaemonProcess.__init__(self, pidfname, logfname, workdir)
         self.server_port = None
         self.driver_server_sock = None
-        self.driver_sock = None
-        self.driver_addr = None
+        # {sock: (host, port)} of the connected drivers.
+        self.driver_socks = {}
+        self.last_logfile_flush = None
+        self.logfile_dirty = False
         self.delim = delim
         self.statusfname = workdir + statusfname
         self.ppid = ppid
@@ -100,7 +112,7 @@ class BaseLoggerProcess(DaemonProcess):
                 sock_name = self.driver_server_sock.getsockname()
                 self.server_port = sock_name[1]
                 file(self.portfname,'w+').write(str(self.server_port)+'\n')
-                self.driver_server_sock.listen(1)
+                self.driver_server_sock.listen(5)
                 self.driver_server_sock.setblocking(0)
                 self.statusfile.write('_init_driver_comms: Listening for driver at: %s.\n' % str(sock_name))
                 self.statusfile.flush()
@@ -122,46 +134,52 @@ class BaseLoggerProcess(DaemonProcess):
             
     def _accept_driver_comms(self):
         """
-        Accept a driver connection request from nonblocking driver server
-        socket. If nothing available, proceed. If a connection is accepted,
-        log with status file. Handles resource unavailable and unspecified
-        socket errors.
+        Accept the pending driver connection requests from nonblocking driver
+        server socket. If nothing available, proceed. Accepted connections
+        are added to the connected drivers and logged with status file.
+        Handles resource unavailable and unspecified socket errors.
         """
-        sock = None
-        addr = None
-        try:
-            sock, host_port_tuple = self.driver_server_sock.accept()
+        while True:
+            try:
+                sock, host_port_tuple = self.driver_server_sock.accept()
 
-        except socket.error as e:
-            # [Errno 35] Resource temporarily unavailable.
-            if e.errno == errno.EAGAIN:
-                # Wating for a driver connection, proceed out of function.
-                pass
-            
-            else:
-                # TBD. Report and proceed.
-                self.statusfile.write('_accept_driver_comms: raised errno %i, %s.\n' % (e.errno, str(e)))
-                self.statusfile.flush()
-            
-        if sock:        
-            self.driver_sock = sock
-            self.driver_sock.setblocking(0)            
-            self.driver_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)                            
-            self.driver_addr = host_port_tuple
-            self.statusfile.write('_accept_driver_comms: driver connected at %s:%i.\n' % self.driver_addr)
+            except socket.error as e:
+                # [Errno 35] Resource temporarily unavailable.
+                if e.errno == errno.EAGAIN:
+                    # No more pending connections, proceed out of function.
+                    pass
+
+                else:
+                    # TBD. Report and proceed.
+                    self.statusfile.write('_accept_driver_comms: raised errno %i, %s.\n' % (e.errno, str(e)))
+                    self.statusfile.flush()
+                return
+
+            sock.setblocking(0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.driver_socks[sock] = host_port_tuple
+            self.statusfile.write('_accept_driver_comms: driver connected at %s:%i, %i connected.\n'
+                                  % (host_port_tuple + (len(self.driver_socks),)))
             self.statusfile.flush()
-        
+
+    def _close_driver(self, sock):
+        """
+        Close the connection to a driver and remove it from the connected
+        drivers. Log with status file.
+        @param sock The driver socket.
+        """
+        host_port_tuple = self.driver_socks.pop(sock)
+        sock.close()
+        self.statusfile.write('_close_driver: closed driver connection at %s:%i.\n' % host_port_tuple)
+        self.statusfile.flush()
+
     def _close_driver_comms(self):
         """
         Close driver communications. Close driver and driver server sockets
         if they exist. Log with status file.
         """
-        if self.driver_sock:
-            self.driver_sock.close()
-            self.driver_sock = None
-            self.driver_addr = None
-            self.statusfile.write('_close_driver_comms: closed driver connection.\n')
-            self.statusfile.flush()
+        for sock in self.driver_socks.keys():
+            self._close_driver(sock)
 
         if self.driver_server_sock:
             self.driver_server_sock.close()
@@ -191,6 +209,14 @@ class BaseLoggerProcess(DaemonProcess):
         """
         return False
 
+    def _device_handle(self):
+        """
+        Object with a fileno() the run loop can select on for device data.
+        Overridden in hardware specific subclasses. If None, the device
+        is polled.
+        """
+        return None
+
     def _check_parent(self):
         """
         Check if the original parent is still alive, and fire the shutdown
@@ -212,109 +238,105 @@ class BaseLoggerProcess(DaemonProcess):
                     self.statusfile.flush()
                     self._cleanup()
 
-    def read_driver(self):
+    def read_driver(self, sock):
         """
-        Read data from driver, if available. Log errors to status file.
-        Handles resource unavailable, connection reset by peer, broken pipe
-        and unspecified socket errors.
+        Read data from a driver, if available. Log errors to status file and
+        close the connection if the driver disconnected. Handles resource
+        unavailable, connection reset by peer, broken pipe and unspecified
+        socket errors.
+        @param sock The driver socket.
         @retval The string of data read from the driver or None.
         """
         data = None
-        if self.driver_sock:
-            try:
-                data = self.driver_sock.recv(4096)
+        try:
+            data = sock.recv(4096)
+            if not data:
+                # The driver has disconnected, report and close socket.
+                self.statusfile.write('read_driver: driver disconnected.\n')
+                self.statusfile.flush()
+                self._close_driver(sock)
 
-            except socket.error as e:                
-                # [Errno 35] Resource temporarily unavailable.
-                if e.errno == errno.EAGAIN:
-                    # Nothing to read, proceed out of the function.
-                    pass
-                
-                # [Errno 54] Connection reset by peer.
-                elif e.errno == errno.ECONNRESET:
-                    # The client side has disconnected, report and close socket.
-                    self.statusfile.write('read_driver: raised errno %i, %s.\n'
-                                          % (e.errno, str(e)))
-                    self.statusfile.flush()
-                    self.driver_sock.close()
-                    self.driver_sock = None
-                    self.driver_addr = None
-                
-                # [Errno 32] Broken pipe.
-                elif e.errno == errno.EPIPE:
-                    # Broken pipe, report and close socket.
-                    self.statusfile.write('read_driver: raised errno %i, %s.\n'
-                                          % (e.errno, str(e)))
-                    self.statusfile.flush()
-                    self.driver_sock.close()
-                    self.driver_sock = None
-                    self.driver_addr = None
-                
-                # Unspecified socket error, report and close socket.
-                else:
-                    # TBD. Report and close socket.
-                    self.statusfile.write('read_driver: raised errno %i, %s.\n'
-                                          % (e.errno, str(e)))
-                    self.statusfile.flush()
-                    self.driver_sock.close()
-                    self.driver_sock = None
-                    self.driver_addr = None
+        except socket.error as e:
+            # [Errno 35] Resource temporarily unavailable.
+            if e.errno == errno.EAGAIN:
+                # Nothing to read, proceed out of the function.
+                pass
+
+            # [Errno 54] Connection reset by peer, [Errno 32] Broken pipe
+            # or unspecified socket error.
+            else:
+                # TBD. Report and close socket.
+                self.statusfile.write('read_driver: raised errno %i, %s.\n'
+                                      % (e.errno, str(e)))
+                self.statusfile.flush()
+                self._close_driver(sock)
 
         return data
-    
+
     def write_driver(self, data):
         """
-        Write data to driver, retrying until all has been sent. Log errors
-        to status file. Handles resource unavailable, connection reset by peer,
-        broken pipe and unspecified socket errors.
-        @param data The data string to write to the driver.
+        Write data to all connected drivers. Log errors to status file and
+        close the connection of the drivers that fail. Handles connection
+        reset by peer, broken pipe, send timeout and unspecified socket errors.
+        @param data The data string to write to the drivers.
         """
-        if self.driver_sock:
-            sent = 0
-            while len(data)>0:
-                try:
-                    sent = self.driver_sock.send(data)
-                    data = data[sent:]
+        for sock in self.driver_socks.keys():
+            try:
+                self._send(sock, data)
+
+            except socket.error as e:
+                # TBD. Report and close socket.
+                self.statusfile.write('write_driver: raised errno %i, %s.\n'
+                                      % (e.errno, str(e)))
+                self.statusfile.flush()
+                self._close_driver(sock)
+
+    def _send(self, sock, data):
+        """
+        Send data on a nonblocking socket, retrying until all has been sent.
+        When the network write buffer is full, wait up to SEND_TIMEOUT
+        for the socket to become writable.
+        @param sock The socket to send on.
+        @param data The data string to send.
+        @throws socket.error On socket errors, or with errno ETIMEDOUT if the
+        socket did not become writable in time.
+        """
+        while len(data)>0:
+            try:
+                sent = sock.send(data)
+                data = data[sent:]
+
+            except socket.error as e:
+                # [Errno 35] Resource temporarily unavailable.
+                if e.errno != errno.EAGAIN:
+                    raise
+
+                # Occurs when the network write buffer is full.
+                # Wait for the socket to drain and retry.
+                if not select.select([], [sock], [], SEND_TIMEOUT)[1]:
+                    raise socket.error(errno.ETIMEDOUT, 'send timed out')
+
+    def _write_logfile(self, data):
+        """
+        Append data to the logfile. The data is written as is, so binary
+        traffic is captured exactly. The logfile is flushed by the run loop
+        at most every LOGFILE_FLUSH_INTERVAL rather than on each write.
+        @param data The data string to log.
+        """
+        self.logfile.write(data)
+        self.logfile_dirty = True
+
+    def _flush_logfile(self):
+        """
+        Flush the logfile if it has unflushed data and LOGFILE_FLUSH_INTERVAL
+        has elapsed since the last flush.
+        """
+        cur_time = time.time()
+        if self.logfile_dirty and cur_time - self.last_logfile_flush >= LOGFILE_FLUSH_INTERVAL:
+            self.logfile.flush()
+            self.logfile_dirty = False
+            self.last_logfile_flush = cur_time
 
-                except socket.error as e:                
-                    # [Errno 35] Resource temporarily unavailable.
-                    if e.errno == errno.EAGAIN:
-                        # Occurs when the network write buffer is full.
-                        # Sleep a short period of time and retry.
-                        time.sleep(.1)
-                    
-                    # [Errno 54] Connection reset by peer.
-                    elif e.errno == errno.ECONNRESET:
-                        # The client side has disconnected, report and close socket.
-                        self.statusfile.write('read_driver: raised errno %i, %s.\n'
-                                              % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.driver_sock.close()
-                        self.driver_sock = None
-                        self.driver_addr = None
-                        break
-                    
-                    # [Errno 32] Broken pipe.
-                    elif e.errno == errno.EPIPE:
-                        # Broken pipe, report and close socket.
-                        self.statusfile.write('read_driver: raised errno %i, %s.\n'
-                                              % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.driver_sock.close()
-                        self.driver_sock = None
-                        self.driver_addr = None
-                        break
-                    
-                    # Unspecified socket error, report and close socket.
-                    else:
-                        # TBD. Report and close socket.
-                        self.statusfile.write('read_driver: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.driver_sock.close()
-                        self.driver_sock = None
-                        self.driver_addr = None
-                        break
-                    
     def read_device(self):
         """
         Read from device, if available. Overridden by hardware
@@ -368,8 +390,10 @@ class BaseLoggerProcess(DaemonProcess):
         """
         Logger run loop. Create and initialize status file, initialize
         device and driver comms and loop while device connected. Loop
-        accepts driver connections, reads driver, writes to device and
-        sniffer, reads device, writes to driver and sniffer and repeats.
+        waits until the device, the connected drivers or the driver server
+        socket are readable, then accepts driver connections, reads drivers,
+        writes to device and logfile, reads device, writes to all drivers
+        and logfile and repeats. The logfile is flushed periodically.
         Logger is stopped by calling DaemonProcess.stop() resulting in
         SIGTERM signal sent to the logger, or if the device hardware connection
         is lost, whereby the run loop and logger process will terminate.
@@ -393,24 +417,48 @@ class BaseLoggerProcess(DaemonProcess):
             self._cleanup()
             return
         
-        #last_time = time.time()
+        self.last_logfile_flush = time.time()
         while self._device_connected():
-            self._accept_driver_comms()
-            driver_data = self.read_driver()
-            if driver_data:
-                self.write_device(driver_data)
-                self.logfile.write(self.delim[0]+repr(driver_data)+self.delim[1])
-                self.logfile.write('\n')
-                self.logfile.flush()
-            device_data = self.read_device()
-            if device_data:
-                self.write_driver(device_data)
-                self.logfile.write(repr(device_data))
-                self.logfile.write('\n')
-                self.logfile.flush()
+            device_handle = self._device_handle()
+            rlist = [self.driver_server_sock] + self.driver_socks.keys()
+            if device_handle:
+                rlist.append(device_handle)
+                timeout = LOGFILE_FLUSH_INTERVAL
+            else:
+                # No handle to wait on, poll the device.
+                timeout = .1
+
+            try:
+                readable = select.select(rlist, [], [], timeout)[0]
+
+            except select.error as e:
+                # [Errno 4] Interrupted system call.
+                if e.args[0] != errno.EINTR:
+                    raise
+                readable = []
+
+            if self.driver_server_sock in readable:
+                self._accept_driver_comms()
+
+            for sock in readable:
+                if sock in self.driver_socks:
+                    driver_data = self.read_driver(sock)
+                    if driver_data:
+                        self.write_device(driver_data)
+                        self._write_logfile(self.delim[0]+driver_data+self.delim[1])
+
+            if not device_handle or device_handle in readable:
+                device_data = self.read_device()
+                if device_data:
+                    self.write_driver(device_data)
+                    self._write_logfile(device_data)
+
+            self._flush_logfile()
             self._check_parent()
-            if not driver_data and not device_data:
-                time.sleep(.1)
+
+        # Device connection lost. Cleanup here as the process ends with
+        # os._exit, skipping the atexit handlers.
+        self._cleanup()
 
 class EthernetDeviceLogger(BaseLoggerProcess):
     """
@@ -523,6 +571,12 @@ class EthernetDeviceLogger(BaseLoggerProcess):
         @retval True on success, False otherwise.
         """
         return self.device_sock != None
+
+    def _device_handle(self):
+        """
+        The device socket, for the run loop to wait on device data.
+        """
+        return self.device_sock
                             
     def read_device(self):
         """
@@ -536,6 +590,13 @@ class EthernetDeviceLogger(BaseLoggerProcess):
         if self.device_sock:
             try:
                 data = self.device_sock.recv(4096)
+                if not data:
+                    # The device has closed the connection, report and
+                    # close socket (end logger).
+                    self.statusfile.write('read_device: device disconnected.\n')
+                    self.statusfile.flush()
+                    self.device_sock.close()
+                    self.device_sock = None
 
             except socket.error as e:                
                 # [Errno 35] Resource temporarily unavailable.
@@ -575,49 +636,19 @@ class EthernetDeviceLogger(BaseLoggerProcess):
         Write to an ethernet device, retrying until all sent. Log errors (except
         resource temporarily unavailable, if they occur.) Handles resource
         temporarily unavailable, connection reset by peer, broken pipe,
-        and unspecified socket errors.
+        send timeout and unspecified socket errors.
         @param data The data string to write to the device.
         """
         if self.device_sock:
-            sent = 0
-            while len(data)>0:
-                try:
-                    sent = self.device_sock.send(data)
-                    data = data[sent:]                    
-                
-                except socket.error as e:                
-                    # [Errno 35] Resource temporarily unavailable.
-                    if e.errno == errno.EAGAIN:
-                        # Occurs when the network write buffer is full.
-                        # Sleep a short period of time and retry.
-                        time.sleep(.1)
-                    
-                    # [Errno 54] Connection reset by peer.
-                    elif e.errno == errno.ECONNRESET:
-                        # TBD. Report and close socket (end logger). 
-                        self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.device_sock.close()
-                        self.device_sock = None
-                        break
-                    
-                    # [Errno 32] Broken pipe.
-                    elif e.errno == errno.EPIPE:
-                        # TBD. Report and close socket (end logger). 
-                        self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush() 
-                        self.device_sock.close()
-                        self.device_sock = None
-                        break
-                    
-                    # Unspecified socket error, report and close socket.
-                    else:
-                        # TBD. Report and close socket (end logger).
-                        self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
-                        self.statusfile.flush()
-                        self.device_sock.close()
-                        self.device_sock = None
-                        break
+            try:
+                self._send(self.device_sock, data)
+
+            except socket.error as e:
+                # TBD. Report and close socket (end logger).
+                self.statusfile.write('write_device: raised errno %i, %s.\n' % (e.errno, str(e)))
+                self.statusfile.flush()
+                self.device_sock.close()
+                self.device_sock = None
 
                     
 class SerialDeviceLogger(BaseLoggerProcess):
@@ -742,13 +773,18 @@ class Listener(threading.Thread):
         
     def run(self):
         """
-        Listener thread processing loop. Read incomming data when
-        available and report it to the logger.
+        Listener thread processing loop. Wait for incomming data, checking
+        periodically if done, and report it to the logger.
         """
         mi_logger.info('Logger client listener started.')
         while not self._done:
             try:
+                if not select.select([self.sock], [], [], .1)[0]:
+                    continue
                 data = self.sock.recv(4069)
+                if not data:
+                    # The logger has closed the connection.
+                    break
                 if self.callback:
                     self.callback(data)
                 else:
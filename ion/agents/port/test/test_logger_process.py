@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""
+@package ion.agents.port.test.test_logger_process
+@file ion/agents/port/test/test_logger_process.py
+@brief Test cases for the device logger process run loop.
+"""
+
+__license__ = 'Apache 2.0'
+
+# bin/nosetests -s -v ion/agents/port/test/test_logger_process.py:TestEthernetDeviceLogger
+# bin/nosetests -s -v -a UTIL ion/agents/port/test/test_logger_process.py:EthernetDeviceLoggerBenchmark
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from nose.plugins.attrib import attr
+
+from pyon.public import log
+
+from ion.agents.port.logger_process import EthernetDeviceLogger
+
+
+class EchoDevice(object):
+    """
+    A TCP device echoing back everything it receives, standing in for the
+    instrument simulators.
+    """
+    def __init__(self):
+        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock.bind(('localhost', 0))
+        self.server_sock.listen(1)
+        self.port = self.server_sock.getsockname()[1]
+        self.sock = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        self.sock, _ = self.server_sock.accept()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                break
+            self.sock.sendall(data)
+
+    def close(self):
+        if self.sock:
+            self.sock.shutdown(socket.SHUT_RDWR)
+            self.sock.close()
+            self.sock = None
+        self.server_sock.close()
+
+
+class LoggerTestCase(unittest.TestCase):
+    """
+    Launches an EthernetDeviceLogger daemon for an EchoDevice.
+    """
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp() + '/'
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.device = EchoDevice()
+        self.addCleanup(self.device.close)
+
+        self.logger = EthernetDeviceLogger('localhost', self.device.port,
+            'logger.pid.txt', 'logger.log.txt', 'logger.status.txt',
+            'logger.port.txt', self.workdir, ['<<', '>>'], os.getpid())
+        self.logger.start()
+        self.addCleanup(self.logger.stop)
+        self.port = self._wait_for(self.logger.get_port)
+        self._wait_for(lambda: self.device.sock)
+
+    def _wait_for(self, func, timeout=10):
+        expire_time = time.time() + timeout
+        while True:
+            retval = func()
+            if retval or time.time() > expire_time:
+                return retval
+            time.sleep(.05)
+
+    def _connect(self):
+        sock = socket.create_connection(('localhost', self.port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(10)
+        self.addCleanup(sock.close)
+        return sock
+
+    def _recv(self, sock, size):
+        data = ''
+        while len(data) < size:
+            chunk = sock.recv(65536)
+            self.assertTrue(chunk)
+            data += chunk
+        return data
+
+
+@attr('UNIT', group='mi')
+class TestEthernetDeviceLogger(LoggerTestCase):
+
+    def test_multiple_drivers(self):
+        drivers = [self._connect() for i in xrange(3)]
+        binary = ''.join(chr(i) for i in xrange(256))
+
+        for i, driver in enumerate(drivers):
+            msg = 'driver %i\r\n%s' % (i, binary)
+            driver.sendall(msg)
+            # device echo goes to every driver:
+            for other in drivers:
+                self.assertEquals(self._recv(other, len(msg)), msg)
+
+        # a driver leaving does not affect the others:
+        drivers[0].close()
+        drivers[1].sendall('ts\r\n')
+        self.assertEquals(self._recv(drivers[1], 4), 'ts\r\n')
+        self.assertEquals(self._recv(drivers[2], 4), 'ts\r\n')
+
+        # traffic is captured unaltered within LOGFILE_FLUSH_INTERVAL:
+        time.sleep(1.5)
+        with open(self.logger.logfname, 'rb') as f:
+            captured = f.read()
+        for i in xrange(3):
+            msg = 'driver %i\r\n%s' % (i, binary)
+            self.assertIn('<<%s>>%s' % (msg, msg), captured)
+        self.assertTrue(captured.endswith('<<ts\r\n>>ts\r\n'))
+
+    def test_device_disconnect(self):
+        driver = self._connect()
+        self.device.close()
+        # logger ends when the device goes away:
+        self.assertTrue(self._wait_for(lambda: not self.logger.get_pid()))
+        self.assertEquals(driver.recv(1), '')
+
+
+@attr('UTIL', group='mi')
+class EthernetDeviceLoggerBenchmark(LoggerTestCase):
+    """
+    Round trip latency and throughput through the logger.
+    """
+    round_trips = 200
+    drivers = 3
+    volume = 20 * 1024 * 1024
+
+    def test_round_trip(self):
+        drivers = [self._connect() for i in xrange(self.drivers)]
+
+        latencies = []
+        for i in xrange(self.round_trips):
+            msg = 'ts %04i\r\n' % i
+            start = time.time()
+            drivers[0].sendall(msg)
+            self._recv(drivers[0], len(msg))
+            latencies.append(time.time() - start)
+            for driver in drivers[1:]:
+                self._recv(driver, len(msg))
+        latencies.sort()
+        log.info('%i drivers: round trip median %.3f ms, 95%% %.3f ms, max %.3f ms',
+                 self.drivers, 1000 * latencies[len(latencies) / 2],
+                 1000 * latencies[int(len(latencies) * .95)], 1000 * latencies[-1])
+
+    def test_throughput(self):
+        drivers = [self._connect() for i in xrange(self.drivers)]
+
+        def drain(driver):
+            received = 0
+            while received < self.volume:
+                received += len(driver.recv(65536))
+        threads = [threading.Thread(target=drain, args=(driver,)) for driver in drivers]
+
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        chunk = 'x' * 4096
+        for i in xrange(self.volume / len(chunk)):
+            drivers[0].sendall(chunk)
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        log.info('%i drivers: %i bytes in %.3f s, %.1f MB/s', self.drivers,
+                 self.volume, elapsed, self.volume / elapsed / 1e6)
@@ -7,6 +7,7 @@
 '''
 from ion.services.dm.utility.granule.record_dictionary import RecordDictionaryTool
 from ion.services.dm.utility.granule_utils import time_series_domain
+from ion.services.dm.utility.time_index import TimeIndex
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
 from pyon.core.exception import CorruptionError, NotFound
 from pyon.ion.event import handle_stream_exception, EventPublisher
@@ -16,9 +17,10 @@ from ion.services.dm.inventory.dataset_management_service import DatasetManageme
 from interface.objects import Granule
 from ion.core.process.transform import TransformStreamListener, TransformStreamProcess
 from ion.util.time_utils import TimeUtils
-from ion.util.stored_values import StoredValueManager
+from ion.util.stored_values import StoredValueManager, StoredValueCache
 from interface.services.dm.iingestion_worker import BaseIngestionWorker
 from pyon.ion.stream import StreamSubscriber
+from pyon.net.channel import ChannelClosedError
 from gevent.coros import RLock
 
 
@@ -34,7 +36,6 @@ import gevent
 import time
 import uuid
 import numpy as np
-from gevent.queue import Queue
 
 numpy_walk = DatasetManagementService.numpy_walk
 
@@ -58,6 +59,25 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
 
         self._bad_coverages = {}
 
+        #--------------------------------------------------------------------------------
+        # Batching (group commit)
+        # - Pending record dictionaries per stream
+        # - Time the oldest pending record dictionary was received
+        # - Messages of the pending record dictionaries, acked once persisted
+        #--------------------------------------------------------------------------------
+        self._batches = {}
+        self._batch_started = {}
+        self._batch_msgs = {}
+        self._routing_msg = None
+        self._batch_lock = RLock()
+        # Serializes the batch writes, held without _batch_lock so the listener keeps batching
+        self._persist_lock = RLock()
+        self._listening = False
+        self._receiving = False
+        self.batch_size = 1
+        self.batch_timeout = 1.
+        self.batch_flusher = None
+
         self.time_stats = Accumulator(format='%3f')
         # unique ID to identify this worker in log msgs
         self._id = uuid.uuid1()
@@ -90,26 +110,36 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
         self.stored_value_manager = StoredValueManager(self.container)
 
         self.lookup_docs = self.CFG.get_safe('process.lookup_docs',[])
+        self.stored_values = StoredValueCache(self.stored_value_manager, self.lookup_docs)
         self.input_product = self.CFG.get_safe('process.input_product','')
         self.qc_enabled = self.CFG.get_safe('process.qc_enabled', True)
         self.ignore_gaps = self.CFG.get_safe('service.ingestion.ignore_gaps', True)
         if not self.ignore_gaps:
             log.warning("Gap handling is not supported in release 2")
         self.ignore_gaps = True
-        self.new_lookups = Queue()
         self.lookup_monitor = EventSubscriber(event_type=OT.ExternalReferencesUpdatedEvent, callback=self._add_lookups, auto_delete=True)
         self.add_endpoint(self.lookup_monitor)
         self.qc_publisher = EventPublisher(event_type=OT.ParameterQCEvent)
         self.connection_id = ''
         self.connection_index = None
+
+        # Granules are buffered per stream and persisted in a single coverage write
+        # once batch_size granules arrived or batch_timeout (ms) elapsed.
+        self.batch_size = self.CFG.get_safe('process.batch_size', 1)
+        self.batch_timeout = self.CFG.get_safe('process.batch_timeout', 1000) / 1000.
+        if self.batching:
+            self.batch_flusher = self._process.thread_manager.spawn(self._flush_stale_batches, thread_name='%s-batch-flusher' % self.id)
         
         self.start_listener()
 
     def on_quit(self): #pragma no cover
-        self.event_publisher.close()
-        self.qc_publisher.close()
+        if self.batch_flusher:
+            self.batch_flusher.kill()
+            self.batch_flusher = None
         if self.subscriber_thread:
             self.stop_listener()
+        self.event_publisher.close()
+        self.qc_publisher.close()
         for stream, coverage in self._coverages.iteritems():
             try:
                 coverage.close(timeout=5)
@@ -123,13 +153,25 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
     def start_listener(self):
         # We use a lock here to prevent possible race conditions from starting multiple listeners and coverage clobbering
         with self.thread_lock:
-            self.subscriber_thread = self._process.thread_manager.spawn(self.subscriber.listen, thread_name='%s-subscriber' % self.id)
+            listen = self.listen_batched if self.batching else self.subscriber.listen
+            self.subscriber_thread = self._process.thread_manager.spawn(listen, thread_name='%s-subscriber' % self.id)
 
     def stop_listener(self):
         # Avoid race conditions with coverage operations (Don't start a listener at the same time as closing one)
         with self.thread_lock:
+            if self.batching:
+                # Pending batches are persisted and acked while the channel is still open
+                self.stop_listen_batched()
+                self.flush_batches()
             self.subscriber.close()
             self.subscriber_thread.join(timeout=10)
+            if self._batches:
+                # Never acked, the broker redelivers them
+                log.warning('Discarding %s unpersisted batches', len(self._batches))
+                with self._batch_lock:
+                    self._batches.clear()
+                    self._batch_started.clear()
+                    self._batch_msgs.clear()
             for stream, coverage in self._coverages.iteritems():
                 try:
                     coverage.close(timeout=5)
@@ -151,7 +193,8 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
     def _add_lookups(self, event, *args, **kwargs):
         if event.origin == self.input_product:
             if isinstance(event.reference_keys, list):
-                self.new_lookups.put(event.reference_keys)
+                self.stored_values.add_keys(event.reference_keys)
+                self.lookup_docs = self.stored_values.doc_keys
 
     def _new_dataset(self, stream_id):
         '''
@@ -163,7 +206,7 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
             return datasets[0]
         return None
 
-    def initialize_metadata(self, dataset_id, rdt):
+    def initialize_metadata(self, dataset_id, rdt, start_index=0):
         '''
         Initializes a metadata document in the object store. The document
         contains information about the bounds and extents of the dataset as
@@ -186,11 +229,12 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
             rough_size += len(rdt) * 4
 
         doc = {'bounds':bounds, 'extents':extents, 'last_values':last_values, 'size': rough_size}
+        self.update_time_index(doc, rdt, start_index)
         doc = numpy_walk(doc)
         object_store.create_doc(doc, object_id=key)
         return 
 
-    def update_metadata(self, dataset_id, rdt):
+    def update_metadata(self, dataset_id, rdt, start_index=None):
         '''
         Updates the metada document with the latest information available
         '''
@@ -200,7 +244,10 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
         try:
             doc = object_store.read_doc(key)
         except NotFound:
-            return self.initialize_metadata(dataset_id, rdt)
+            return self.initialize_metadata(dataset_id, rdt, start_index or 0)
+        if start_index is None:
+            start_index = doc['extents'].get(rdt.temporal_parameter, 0)
+        time_bounds = doc['bounds'].get(rdt.temporal_parameter)
         # These are the fields we're interested in
         bounds = doc['bounds']
         extents = doc['extents']
@@ -224,10 +271,31 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
 
             rough_size += len(rdt) * 4
             doc['size'] = rough_size
+        self.update_time_index(doc, rdt, start_index, time_bounds)
         # Sanitize it
         doc = numpy_walk(doc)
         object_store.update_doc(doc)
 
+    def update_time_index(self, doc, rdt, start_index, time_bounds=None):
+        '''
+        Extends the dataset's time index with the times of the appended records.
+        Datasets ingested before the index existed are seeded with a single block
+        spanning the existing records, or left unindexed if their bounds are unknown.
+        '''
+        tname = rdt.temporal_parameter
+        times = rdt[tname]
+        if times is None or np.asanyarray(times).dtype.kind not in 'biuf':
+            return
+        if 'time_index' in doc:
+            time_index = TimeIndex(doc['time_index'])
+        elif start_index and time_bounds:
+            time_index = TimeIndex.new(tname, rdt.context(tname).uom)
+            time_index.add_block(0, start_index, *time_bounds)
+        else:
+            time_index = TimeIndex.new(tname, rdt.context(tname).uom, start_index)
+        time_index.append(start_index, times)
+        doc['time_index'] = time_index.doc
+
     
     def get_dataset(self,stream_id):
         '''
@@ -355,7 +423,170 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
             log.debug('Empty granule for stream %s', stream_id)
             return
 
-        self.persist_or_timeout(stream_id, rdt)
+        if self.batching:
+            self.add_to_batch(stream_id, rdt)
+        else:
+            self.persist_or_timeout(stream_id, rdt)
+
+    @property
+    def batching(self):
+        return self.batch_size > 1
+
+    def listen_batched(self):
+        '''
+        Subscriber loop used when batching. Unlike Subscriber.listen, which acks
+        each message once its callback returns, the message of a batched record
+        dictionary is acked only after its batch is persisted (see flush_batch).
+        Messages that don't end up in a batch are acked right away, or rejected
+        for redelivery if handling them failed.
+        '''
+        self.subscriber.initialize()
+        self._listening = True
+        while self._listening:
+            self._receiving = True
+            try:
+                msg = self.subscriber.get_one_msg()
+            except ChannelClosedError:
+                break
+            finally:
+                self._receiving = False
+            self._routing_msg = msg
+            try:
+                msg.route()
+            except Exception:
+                log.exception('Failed to handle message, rejecting it')
+                if self._routing_msg is not None:
+                    self._routing_msg = None
+                    self.reject_msgs([msg])
+                continue
+            if self._routing_msg is not None:
+                self._routing_msg = None
+                self.ack_msgs([msg])
+
+    def stop_listen_batched(self):
+        '''
+        Stops listen_batched from consuming more messages without closing the channel.
+        A message being handled is finished first.
+        '''
+        self._listening = False
+        if self._receiving:
+            self.subscriber_thread.kill()
+        else:
+            self.subscriber_thread.join(timeout=10)
+
+    def ack_msgs(self, msgs):
+        for msg in msgs:
+            try:
+                msg.ack()
+            except Exception:
+                log.exception('Failed to ack message')
+
+    def reject_msgs(self, msgs, requeue=True):
+        for msg in msgs:
+            try:
+                msg.reject(requeue=requeue)
+            except Exception:
+                log.exception('Failed to reject message')
+
+    def add_to_batch(self, stream_id, rdt):
+        '''
+        Buffers the record dictionary for the stream and persists the batch
+        once it holds batch_size record dictionaries. A record dictionary that
+        can't be joined with the pending ones (different stream definition or
+        a change in a sparse constant value) flushes the pending batch first.
+        '''
+        batch = self._batches.get(stream_id)
+        if batch and not self.batch_compatible(batch[-1], rdt):
+            self.flush_batch(stream_id)
+        with self._batch_lock:
+            batch = self._batches.get(stream_id)
+            if not batch:
+                batch = self._batches[stream_id] = []
+                self._batch_started[stream_id] = time.time()
+                self._batch_msgs[stream_id] = []
+            batch.append(rdt)
+            if self._routing_msg is not None:
+                # Acked by flush_batch once the batch is persisted
+                self._batch_msgs[stream_id].append(self._routing_msg)
+                self._routing_msg = None
+            full = len(batch) >= self.batch_size
+        if full:
+            self.flush_batch(stream_id)
+
+    def batch_compatible(self, previous, rdt):
+        '''
+        Determines if rdt can be appended to a batch ending with previous.
+        Sparse constant values are set once per coverage write, so a batch
+        can't span a change in any of them.
+        '''
+        if previous._stream_def != rdt._stream_def or set(previous.fields) != set(rdt.fields):
+            return False
+        for field in rdt.fields:
+            if not isinstance(rdt.context(field).param_type, SparseConstantType):
+                continue
+            last_value, values = previous[field], rdt[field]
+            if last_value is None or values is None:
+                if last_value is not None or values is not None:
+                    return False
+                continue
+            last_value = np.atleast_1d(last_value)[-1]
+            try:
+                if not all(np.atleast_1d(last_value == value).all() for value in np.atleast_1d(values)):
+                    return False
+            except ValueError: # Shape mismatch
+                return False
+        return True
+
+    def flush_batch(self, stream_id):
+        '''
+        Persists the pending record dictionaries for a stream as one record dictionary
+        and acks their messages. persist_or_timeout only gives up after MAX_RETRY_TIME,
+        the messages are then rejected and the error raised.
+        '''
+        with self._persist_lock:
+            with self._batch_lock:
+                batch = self._batches.pop(stream_id, None)
+                self._batch_started.pop(stream_id, None)
+                msgs = self._batch_msgs.pop(stream_id, [])
+            try:
+                if batch:
+                    rdt = RecordDictionaryTool.concatenate(batch)
+                    if rdt is not None:
+                        log.debug('Persisting batch of %s granules (%s records) for stream %s', len(batch), len(rdt), stream_id)
+                        self.persist_or_timeout(stream_id, rdt)
+            except Exception:
+                log.error('Failed to persist batch of %s granules for stream %s, rejecting them', len(batch), stream_id)
+                self.reject_msgs(msgs, requeue=False)
+                raise
+            self.ack_msgs(msgs)
+
+    def flush_batches(self):
+        for stream_id in list(self._batches):
+            try:
+                self.flush_batch(stream_id)
+            except Exception:
+                log.exception('Failed to persist batch for stream %s', stream_id)
+
+    def _flush_stale_batches(self):
+        '''
+        Flushes any batch whose oldest record dictionary is older than batch_timeout
+        '''
+        while True:
+            now = time.time()
+            deadline = now + self.batch_timeout
+            stale = []
+            with self._batch_lock:
+                for stream_id, started in self._batch_started.items():
+                    if (now - started) >= self.batch_timeout:
+                        stale.append(stream_id)
+                    else:
+                        deadline = min(deadline, started + self.batch_timeout)
+            for stream_id in stale:
+                try:
+                    self.flush_batch(stream_id)
+                except Exception:
+                    log.exception('Failed to persist batch for stream %s', stream_id)
+            gevent.sleep(max(deadline - time.time(), 0.01))
 
     def persist_or_timeout(self, stream_id, rdt):
         """ retry writing coverage multiple times and eventually time out """
@@ -397,18 +628,7 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
                 raise CorruptionError(e.message)
     
     def get_stored_values(self, lookup_value):
-        if not self.new_lookups.empty():
-            new_values = self.new_lookups.get()
-            self.lookup_docs = new_values + self.lookup_docs
-        lookup_value_document_keys = self.lookup_docs
-        for key in lookup_value_document_keys:
-            try:
-                document = self.stored_value_manager.read_value(key)
-                if lookup_value in document:
-                    return document[lookup_value] 
-            except NotFound:
-                log.warning('Specified lookup document does not exist')
-        return None
+        return self.stored_values.lookup(lookup_value)
 
 
     def fill_lookup_values(self, rdt):
@@ -561,7 +781,7 @@ class ScienceGranuleIngestionWorker(TransformStreamListener, BaseIngestionWorker
 
         self.update_connection_index(rdt.connection_id, rdt.connection_index)
 
-        self.update_metadata(dataset_id, rdt)
+        self.update_metadata(dataset_id, rdt, start_index)
         self.dataset_changed(dataset_id,coverage.num_timesteps,(start_index,start_index+elements))
 
     def _add_timing_stats(self, timer):
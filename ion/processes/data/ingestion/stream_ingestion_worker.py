@@ -36,6 +36,8 @@ class StreamIngestionWorker(TransformStreamListener):
     def on_start(self): #pragma no cover
         super(StreamIngestionWorker,self).on_start()
         self.event_publisher = EventPublisher(OT.DatasetModified)
+        # retrieve_stream calls retrieve_oob directly, without the retriever's DatasetModified subscriber
+        DataRetrieverService.set_cache_max_age(CFG.get_safe('service.data_retriever.cache_max_age', 10))
 
     def recv_packet(self, msg, stream_route, stream_id):
         validate_is_instance(msg, Granule, 'Incoming packet must be of type granule')
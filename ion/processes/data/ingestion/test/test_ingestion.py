@@ -7,7 +7,9 @@
 
 from pyon.util.unit_test import PyonTestCase
 from ion.processes.data.ingestion.science_granule_ingestion_worker import ScienceGranuleIngestionWorker
+from ion.services.dm.utility.granule import RecordDictionaryTool
 from nose.plugins.attrib import attr
+from mock import Mock, patch
 
 
 @attr('UNIT',group='dm')
@@ -39,5 +41,60 @@ class IngestionTest(PyonTestCase):
         self.assertFalse(ingestion.has_gap('',''))
         self.assertFalse(ingestion.has_gap('',''))
 
+    @patch.object(RecordDictionaryTool, 'concatenate', side_effect=lambda rdts: list(rdts))
+    def test_ingestion_batching(self, concatenate):
+        ingestion = ScienceGranuleIngestionWorker()
+        ingestion.batch_size = 3
+        ingestion.persist_or_timeout = Mock()
+        ingestion.batch_compatible = Mock(return_value=True)
+        self.assertTrue(ingestion.batching)
+
+        ingestion.add_to_batch('s1', 'r1')
+        ingestion.add_to_batch('s1', 'r2')
+        ingestion.add_to_batch('s2', 'r3')
+        self.assertFalse(ingestion.persist_or_timeout.called)
+
+        ingestion.add_to_batch('s1', 'r4')
+        ingestion.persist_or_timeout.assert_called_once_with('s1', ['r1', 'r2', 'r4'])
+
+        # An incompatible record dictionary flushes the pending batch first
+        ingestion.batch_compatible.return_value = False
+        ingestion.add_to_batch('s2', 'r5')
+        ingestion.persist_or_timeout.assert_called_with('s2', ['r3'])
+
+        ingestion.flush_batches()
+        ingestion.persist_or_timeout.assert_called_with('s2', ['r5'])
+        self.assertEquals(ingestion._batches, {})
+
+    @patch.object(RecordDictionaryTool, 'concatenate', side_effect=lambda rdts: list(rdts))
+    def test_ingestion_batching_acks(self, concatenate):
+        ingestion = ScienceGranuleIngestionWorker()
+        ingestion.batch_size = 2
+        ingestion.persist_or_timeout = Mock(side_effect=IOError('coverage'))
+        ingestion.batch_compatible = Mock(return_value=True)
+
+        msgs = [Mock(), Mock()]
+        for rdt, msg in zip(['r1', 'r2'], msgs):
+            ingestion._routing_msg = msg
+            try:
+                ingestion.add_to_batch('s1', rdt)
+            except IOError:
+                pass
+            self.assertIsNone(ingestion._routing_msg)
+
+        # A write that gave up rejects the batch instead of keeping it around
+        self.assertEquals(ingestion._batches, {})
+        self.assertFalse(any(msg.ack.called for msg in msgs))
+        for msg in msgs:
+            msg.reject.assert_called_once_with(requeue=False)
 
+        ingestion.persist_or_timeout.side_effect = None
+        msgs = [Mock(), Mock()]
+        for rdt, msg in zip(['r3', 'r4'], msgs):
+            ingestion._routing_msg = msg
+            ingestion.add_to_batch('s1', rdt)
+        ingestion.persist_or_timeout.assert_called_with('s1', ['r3', 'r4'])
+        self.assertTrue(all(msg.ack.called for msg in msgs))
+        self.assertEquals(ingestion._batches, {})
+        self.assertEquals(ingestion._batch_msgs, {})
 
@@ -44,6 +44,7 @@ class ReplayProcess(BaseReplayProcess):
         start_time: 0         # Start time (index value) to be replayed
         end_time:   0         # End time (index value) to be replayed
         parameters: []        # List of parameters to form in the granule
+        aggregate:  None      # Reduce each stride_time bin with min, max or mean
       
 
     '''
@@ -57,6 +58,12 @@ class ReplayProcess(BaseReplayProcess):
     parameters      = None
     stream_id       = ''
     stream_def_id   = ''
+    aggregate       = None
+
+    # Reductions available to aggregated (decimated) retrievals
+    AGGREGATES = {'min'  : np.minimum,
+                  'max'  : np.maximum,
+                  'mean' : np.add}
 
 
     def __init__(self, *args, **kwargs):
@@ -83,6 +90,7 @@ class ReplayProcess(BaseReplayProcess):
         self.parameters      = self.CFG.get_safe('process.query.parameters',None)
         self.publish_limit   = self.CFG.get_safe('process.query.publish_limit', 10)
         self.tdoa            = self.CFG.get_safe('process.query.tdoa',None)
+        self.aggregate       = self.CFG.get_safe('process.query.aggregate',None)
         self.stream_id       = self.CFG.get_safe('process.publish_streams.output', '')
         self.stream_def      = pubsub.read_stream_definition(stream_id=self.stream_id)
         self.stream_def_id   = self.stream_def._id
@@ -105,6 +113,40 @@ class ReplayProcess(BaseReplayProcess):
         idx = TimeUtils.get_relative_time(coverage, corrected_time)
         return idx
 
+    @classmethod
+    def get_time_idx_mult(cls, coverage, timevals, time_index=None):
+        '''
+        Vectorized get_time_idx, resolves every timestamp with a single
+        read of the coverage's time axis. With the dataset's time index only
+        the part of the axis spanned by the timestamps is read.
+        '''
+        tname = coverage.temporal_parameter_name
+        uom = coverage.get_parameter_context(tname).uom
+        if 'iso' in uom:
+            return None
+        timevals = np.atleast_1d(timevals)
+        if not timevals.size:
+            return np.zeros(0, dtype='int64')
+        corrected_times = TimeUtils.ts_to_units_mult(uom, timevals)
+        first, time_values = cls._read_time_window(coverage, np.min(timevals), np.max(timevals), time_index)
+        return first + TimeUtils.find_nearest_mult(time_values, corrected_times)
+
+    @classmethod
+    def _read_time_window(cls, coverage, start_time, end_time, time_index=None):
+        '''
+        Reads the coverage's time axis between the start and end unix timestamps,
+        plus one record on each side for nearest matches. Without an up to date time
+        index the whole axis is read.
+        Returns the index of the first record read and the time values.
+        '''
+        slice_ = slice(None)
+        if time_index is not None and time_index.num_records == coverage.num_timesteps:
+            window = time_index.index_range(start_time, end_time)
+            if window is not None:
+                slice_ = slice(max(window.start - 1, 0), window.stop + 1)
+        time_values = np.atleast_1d(coverage.get_parameter_values(coverage.temporal_parameter_name, tdoa=slice_))
+        return slice_.start or 0, time_values
+
     @classmethod
     def convert_time(cls, coverage, timeval):
         tname = coverage.temporal_parameter_name
@@ -114,13 +156,15 @@ class ReplayProcess(BaseReplayProcess):
         return corrected_time
 
     @classmethod
-    def _cov2granule(cls, coverage, start_time=None, end_time=None, stride_time=None, stream_def_id=None, parameters=None, tdoa=None):
+    def _cov2granule(cls, coverage, start_time=None, end_time=None, stride_time=None, stream_def_id=None, parameters=None, tdoa=None, time_index=None):
 
         if tdoa is None:
+            # The dataset's time index converts times without reading the coverage's temporal context
+            convert_time = time_index.to_units if time_index is not None else lambda t: cls.convert_time(coverage, t)
             if start_time is not None:
-                start_time = cls.convert_time(coverage, start_time)
+                start_time = convert_time(start_time)
             if end_time is not None:
-                end_time = cls.convert_time(coverage, end_time)
+                end_time = convert_time(end_time)
             slice_ = slice(start_time, end_time, stride_time)
         
         if stream_def_id:
@@ -146,7 +190,7 @@ class ReplayProcess(BaseReplayProcess):
 
 
     @classmethod
-    def _coverage_to_granule(cls, coverage, start_time=None, end_time=None, stride_time=None, fuzzy_stride=True, parameters=None, stream_def_id=None, tdoa=None):
+    def _coverage_to_granule(cls, coverage, start_time=None, end_time=None, stride_time=None, fuzzy_stride=True, parameters=None, stream_def_id=None, tdoa=None, aggregate=None, time_index=None):
         slice_ = slice(None) # Defaults to all values
 
 
@@ -158,24 +202,23 @@ class ReplayProcess(BaseReplayProcess):
         if stride_time is not None:
             validate_is_instance(stride_time, Number, 'stride_time must be a number for striding.')
 
+        if aggregate is not None:
+            return cls._aggregate_to_granule(coverage, start_time, end_time, stride_time, aggregate, parameters=parameters, stream_def_id=stream_def_id, time_index=time_index)
+
         if tdoa is not None and isinstance(tdoa,slice):
             slice_ = tdoa
         
-        elif stride_time is not None and not fuzzy_stride: # SLOW 
-            ugly_range = np.arange(start_time, end_time, stride_time)
-            idx_values = [cls.get_time_idx(coverage,i) for i in ugly_range]
-            idx_values = list(set(idx_values)) # Removing duplicates - also mixes the order of the list!!!
-            idx_values.sort()
-            slice_ = [idx_values]
+        elif stride_time is not None and not fuzzy_stride:
+            if start_time is None or end_time is None:
+                raise BadRequest('start_time and end_time are required for exact striding')
+            idx_values = cls.get_time_idx_mult(coverage, np.arange(start_time, end_time, stride_time), time_index=time_index)
+            if idx_values is None:
+                raise BadRequest('Exact striding is not supported for ISO time units')
+            slice_ = [np.unique(idx_values).tolist()] # Sorted and without duplicates
 
 
         elif not (start_time is None and end_time is None):
-            if start_time is not None:
-                start_time = cls.get_time_idx(coverage,start_time)
-            if end_time is not None:
-                end_time = cls.get_time_idx(coverage,end_time)
-
-            slice_ = slice(start_time,end_time,stride_time)
+            slice_ = cls._time_slice(coverage, start_time, end_time, stride_time)
             log.info('Slice: %s', slice_)
 
         if stream_def_id:
@@ -188,7 +231,7 @@ class ReplayProcess(BaseReplayProcess):
         else:
             fields = rdt.fields
 
-        if slice_.start == slice_.stop and slice_.start is not None:
+        if isinstance(slice_, slice) and slice_.start == slice_.stop and slice_.start is not None:
             log.warning('Requested empty set of data.  %s', slice_)
             return rdt
         
@@ -202,6 +245,97 @@ class ReplayProcess(BaseReplayProcess):
             cls.map_cov_rdt(coverage,rdt,field, slice_)
         return rdt
 
+    @classmethod
+    def _aggregate_to_granule(cls, coverage, start_time, end_time, stride_time, aggregate, parameters=None, stream_def_id=None, time_index=None):
+        '''
+        Decimates the time range into bins of stride_time and reduces the records in each bin
+        with the aggregate (min, max or mean), ignoring fill values and NaNs. Non-numeric fields
+        and the temporal parameter take the first record of each bin, empty bins are dropped.
+        The coverage's time axis is expected to be monotonically increasing, as ingestion
+        appends it.
+        '''
+        if aggregate not in cls.AGGREGATES:
+            raise BadRequest('Unsupported aggregate: %s' % aggregate)
+        if start_time is None or end_time is None or not stride_time:
+            raise BadRequest('start_time, end_time and stride_time are required for aggregation')
+
+        if stream_def_id:
+            rdt = RecordDictionaryTool(stream_definition_id=stream_def_id)
+        else:
+            rdt = RecordDictionaryTool(param_dictionary=coverage.parameter_dictionary)
+
+        tname = coverage.temporal_parameter_name
+        uom = coverage.get_parameter_context(tname).uom
+        if 'iso' in uom:
+            raise BadRequest('Aggregation is not supported for ISO time units')
+        first, time_values = cls._read_time_window(coverage, start_time, end_time, time_index)
+        edges = TimeUtils.ts_to_units_mult(uom, np.arange(start_time, end_time, stride_time))
+        stop = np.searchsorted(time_values, TimeUtils.ts_to_units(uom, end_time))
+        starts = np.unique(np.searchsorted(time_values, edges))
+        starts = starts[starts < stop]
+        if not starts.size:
+            log.warning('Requested empty set of data.')
+            return rdt
+
+        offsets = starts - starts[0]
+        rdt[tname] = time_values[starts]
+        slice_ = slice(first + int(starts[0]), first + int(stop))
+        fields = rdt.fields if parameters is None else list(set(parameters).intersection(rdt.fields))
+        for field in fields:
+            if field == tname:
+                continue
+            try:
+                values = coverage.get_parameter_values(field, tdoa=slice_)
+            except ParameterFunctionException:
+                continue
+            if values is None:
+                continue
+            values = np.atleast_1d(values)
+            if values.dtype.kind not in 'biuf':
+                rdt[field] = values[offsets]
+            else:
+                fill_value = coverage.get_parameter_context(field).fill_value
+                rdt[field] = cls._reduce_bins(values, offsets, aggregate, fill_value)
+        return rdt
+
+    @classmethod
+    def _reduce_bins(cls, values, offsets, aggregate, fill_value=None):
+        '''
+        Reduces the bins of values starting at offsets with the aggregate. Fill values
+        and NaNs are masked out, bins without any valid value get the fill value.
+        '''
+        valid = ~np.ma.getmaskarray(np.ma.masked_invalid(values))
+        if fill_value is not None:
+            try:
+                valid &= values != fill_value
+            except (TypeError, ValueError):
+                pass
+        counts = np.add.reduceat(valid.astype('int64'), offsets, axis=0)
+
+        if aggregate == 'mean':
+            sums = np.add.reduceat(np.where(valid, values, 0).astype('float64'), offsets, axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                reduced = sums / counts
+        else:
+            # Masked values are replaced by the identity of the reduction
+            if values.dtype.kind == 'f':
+                identity = np.inf if aggregate == 'min' else -np.inf
+            elif values.dtype.kind == 'b':
+                identity = aggregate == 'min'
+            else:
+                info = np.iinfo(values.dtype)
+                identity = info.max if aggregate == 'min' else info.min
+            masked = np.where(valid, values, identity).astype(values.dtype)
+            reduced = cls.AGGREGATES[aggregate].reduceat(masked, offsets, axis=0)
+
+        empty = counts == 0
+        if empty.any():
+            if fill_value is None:
+                reduced = reduced.astype('float64')
+                fill_value = np.nan
+            reduced[empty] = fill_value
+        return reduced
+
     @classmethod
     def map_cov_rdt(cls, coverage, rdt, field, slice_):
         log.trace( 'Slice is %s' , slice_)
@@ -235,7 +369,7 @@ class ReplayProcess(BaseReplayProcess):
                 log.info('Reading from an empty coverage')
                 rdt = RecordDictionaryTool(param_dictionary=coverage.parameter_dictionary)
             else: 
-                rdt = self._coverage_to_granule(coverage=coverage,start_time=self.start_time, end_time=self.end_time, stride_time=self.stride_time, parameters=self.parameters,tdoa=self.tdoa)
+                rdt = self._coverage_to_granule(coverage=coverage,start_time=self.start_time, end_time=self.end_time, stride_time=self.stride_time, parameters=self.parameters,tdoa=self.tdoa, aggregate=self.aggregate)
         except:
             log.exception('Problems reading from the coverage')
             raise BadRequest('Problems reading from the coverage')
@@ -290,21 +424,43 @@ class ReplayProcess(BaseReplayProcess):
         
         return rdt.to_granule()
 
-    def _replay(self):
-        coverage = DatasetManagementService._get_coverage(self.dataset_id,mode='r')
-        rdt = self._coverage_to_granule(coverage=coverage, start_time=self.start_time, end_time=self.end_time, stride_time=self.stride_time, parameters=self.parameters, stream_def_id=self.stream_def_id)
-        elements = len(rdt)
-        
-        for i in xrange(elements / self.publish_limit):
-            outgoing = RecordDictionaryTool(stream_definition_id=self.stream_def_id)
-            fields = self.parameters or outgoing.fields
-            for field in fields:
-                v = rdt[field]
-                if v is not None:
-                    outgoing[field] = v[(i*self.publish_limit) : ((i+1)*self.publish_limit)]
-            yield outgoing
-        coverage.close(timeout=5)
-        return 
-
+    @classmethod
+    def _time_slice(cls, coverage, start_time=None, end_time=None, stride_time=None):
+        '''
+        Resolves a time range into a slice of indices along the coverage's temporal axis
+        '''
+        if start_time is None and end_time is None:
+            return slice(None)
+        if start_time is not None:
+            start_time = cls.get_time_idx(coverage,start_time)
+        if end_time is not None:
+            end_time = cls.get_time_idx(coverage,end_time)
+        return slice(start_time,end_time,stride_time)
 
+    @classmethod
+    def _chunk_slices(cls, slice_, num_timesteps, limit):
+        '''
+        Splits a slice over num_timesteps indices into consecutive slices
+        that select at most limit indices each, including the remainder.
+        '''
+        start, stop, step = slice_.indices(num_timesteps)
+        limit = max(int(limit or 1), 1)
+        for chunk_start in xrange(start, stop, step * limit):
+            yield slice(chunk_start, min(chunk_start + step * limit, stop), step)
 
+    def _replay(self):
+        '''
+        Reads the requested range from the coverage one chunk of publish_limit
+        records at a time, so only a single chunk is held in memory.
+        '''
+        coverage = DatasetManagementService._get_coverage(self.dataset_id,mode='r')
+        try:
+            if coverage.num_timesteps == 0:
+                return
+            slice_ = self._time_slice(coverage, self.start_time, self.end_time, self.stride_time)
+            for chunk in self._chunk_slices(slice_, coverage.num_timesteps, self.publish_limit):
+                rdt = self._coverage_to_granule(coverage=coverage, tdoa=chunk, parameters=self.parameters, stream_def_id=self.stream_def_id)
+                if len(rdt):
+                    yield rdt
+        finally:
+            coverage.close(timeout=5)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+@file ion/processes/data/replay/test/test_replay_process.py
+@brief Unit tests for the replay process
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.processes.data.replay.replay_process import ReplayProcess
+from ion.services.dm.utility.time_index import TimeIndex
+from coverage_model import ParameterDictionary, ParameterContext, QuantityType
+from nose.plugins.attrib import attr
+from mock import Mock
+
+import numpy as np
+
+
+@attr('UNIT',group='dm')
+class ReplayProcessUnitTest(PyonTestCase):
+    def test_chunk_slices(self):
+        chunks = list(ReplayProcess._chunk_slices(slice(None), 25, 10))
+        self.assertEquals(chunks, [slice(0,10,1), slice(10,20,1), slice(20,25,1)])
+
+        # Strided and bounded ranges keep the remainder
+        chunks = list(ReplayProcess._chunk_slices(slice(3,20,2), 25, 4))
+        self.assertEquals(chunks, [slice(3,11,2), slice(11,19,2), slice(19,20,2)])
+        indices = [i for chunk in chunks for i in range(*chunk.indices(25))]
+        self.assertEquals(indices, range(3,20,2))
+
+        self.assertEquals(list(ReplayProcess._chunk_slices(slice(None), 0, 10)), [])
+
+    def create_coverage(self, times, temps):
+        pdict = ParameterDictionary()
+        t_ctxt = ParameterContext('time', param_type=QuantityType(value_encoding=np.dtype('float64')))
+        t_ctxt.uom = 'seconds since 1900-01-01'
+        pdict.add_context(t_ctxt, is_temporal=True)
+        pdict.add_context(ParameterContext('temp', param_type=QuantityType(value_encoding=np.dtype('float32')), fill_value=-9999))
+
+        values = {'time':np.asanyarray(times) + 2208988800, 'temp':np.asanyarray(temps)}
+        coverage = Mock()
+        coverage.temporal_parameter_name = 'time'
+        coverage.parameter_dictionary = pdict
+        coverage.num_timesteps = len(times)
+        coverage.get_parameter_context.side_effect = pdict.get_context
+        coverage.get_parameter_values.side_effect = lambda name, tdoa=None: values[name] if tdoa is None else values[name][tdoa]
+        return coverage
+
+    def test_time_idx_mult(self):
+        coverage = self.create_coverage(np.arange(0, 100, 2.), np.arange(50))
+        timevals = np.array([0, 3.1, 10, 41, 1000])
+        idx = ReplayProcess.get_time_idx_mult(coverage, timevals)
+        np.testing.assert_array_equal(idx, [0, 2, 5, 20, 49])
+
+    def test_time_idx_mult_time_index(self):
+        times = np.arange(0, 100, 2.)
+        coverage = self.create_coverage(times, np.arange(50))
+        time_index = TimeIndex.new('time', 'seconds since 1900-01-01')
+        for start in xrange(0, 50, 10):
+            time_index.append(start, times[start:start+10] + 2208988800)
+
+        # Only the blocks spanned by the timestamps are read
+        idx = ReplayProcess.get_time_idx_mult(coverage, np.array([40.9, 46.2, 50]), time_index=time_index)
+        np.testing.assert_array_equal(idx, [20, 23, 25])
+        self.assertEquals(coverage.get_parameter_values.call_args[1]['tdoa'], slice(19, 31))
+
+        # An index behind the coverage is not used
+        coverage.num_timesteps = 60
+        ReplayProcess.get_time_idx_mult(coverage, np.array([40.9, 46.2, 50]), time_index=time_index)
+        self.assertEquals(coverage.get_parameter_values.call_args[1]['tdoa'], slice(None))
+
+    def test_aggregate(self):
+        coverage = self.create_coverage(np.arange(20.), np.arange(20.))
+
+        rdt = ReplayProcess._coverage_to_granule(coverage, start_time=2, end_time=12, stride_time=5, aggregate='mean')
+        np.testing.assert_array_equal(rdt['time'], [2 + 2208988800, 7 + 2208988800])
+        np.testing.assert_array_almost_equal(rdt['temp'], [4, 9])
+
+        rdt = ReplayProcess._coverage_to_granule(coverage, start_time=2, end_time=12, stride_time=5, aggregate='max')
+        np.testing.assert_array_almost_equal(rdt['temp'], [6, 11])
+
+        rdt = ReplayProcess._coverage_to_granule(coverage, start_time=2, end_time=12, stride_time=5, aggregate='min')
+        np.testing.assert_array_almost_equal(rdt['temp'], [2, 7])
+
+    def test_aggregate_masks_fill_values(self):
+        temps = np.arange(20.)
+        temps[[2, 3]] = -9999
+        temps[4] = np.nan
+        temps[7:12] = -9999
+        coverage = self.create_coverage(np.arange(20.), temps)
+
+        rdt = ReplayProcess._coverage_to_granule(coverage, start_time=2, end_time=17, stride_time=5, aggregate='mean')
+        np.testing.assert_array_almost_equal(rdt['temp'], [5.5, -9999, 14])
+
+        rdt = ReplayProcess._coverage_to_granule(coverage, start_time=2, end_time=17, stride_time=5, aggregate='min')
+        np.testing.assert_array_almost_equal(rdt['temp'], [5, -9999, 12])
+
+        rdt = ReplayProcess._coverage_to_granule(coverage, start_time=2, end_time=17, stride_time=5, aggregate='max')
+        np.testing.assert_array_almost_equal(rdt['temp'], [6, -9999, 16])
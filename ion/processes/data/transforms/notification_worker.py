@@ -12,8 +12,8 @@ from pyon.util.async import spawn
 from pyon.core.exception import BadRequest, NotFound
 from ion.core.process.transform import TransformEventListener
 from pyon.event.event import EventSubscriber
-from ion.services.dm.utility.uns_utility_methods import send_email, calculate_reverse_user_info
-from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, check_user_notification_interest
+from ion.services.dm.utility.uns_utility_methods import SubscriptionIndex, load_user_info, users_affected_by, update_user_info
+from ion.services.dm.utility.email_delivery import EmailDelivery
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
 
 import gevent, time
@@ -25,6 +25,7 @@ class NotificationWorker(TransformEventListener):
     """
     def on_init(self):
         self.user_info = {}
+        self.subscription_index = SubscriptionIndex()
         self.resource_registry = ResourceRegistryServiceClient()
         self.q = gevent.queue.Queue()
 
@@ -39,16 +40,22 @@ class NotificationWorker(TransformEventListener):
     def on_start(self):
         super(NotificationWorker,self).on_start()
 
-        self.reverse_user_info = None
         self.user_info = None
 
         #------------------------------------------------------------------------------------
-        # Start by loading the user info and reverse user info dictionaries
+        # Emails are sent by a pool of SMTP connections, off the event callback
+        #------------------------------------------------------------------------------------
+
+        self.delivery = EmailDelivery(rr_client=self.resource_registry)
+        self.delivery.start()
+
+        #------------------------------------------------------------------------------------
+        # Start by loading the user info dictionary and the subscription index
         #------------------------------------------------------------------------------------
 
         try:
             self.user_info = self.load_user_info()
-            self.reverse_user_info =  calculate_reverse_user_info(self.user_info)
+            self.subscription_index = SubscriptionIndex(self.user_info)
 
             log.debug("On start up, notification workers loaded the following user_info dictionary: %s" % self.user_info)
             log.debug("The calculated reverse user info: %s" % self.reverse_user_info )
@@ -69,11 +76,10 @@ class NotificationWorker(TransformEventListener):
             '''
 
             try:
-                self.user_info = self.load_user_info()
+                self.reload_user_info(event_msg)
             except NotFound:
                 log.warning("ElasticSearch has not yet loaded the user_index.")
 
-            self.reverse_user_info =  calculate_reverse_user_info(self.user_info)
             self.test_hook(self.user_info, self.reverse_user_info)
 
             #log.debug("After a reload, the user_info: %s" % self.user_info)
@@ -108,8 +114,8 @@ class NotificationWorker(TransformEventListener):
         #------------------------------------------------------------------------------------
 
         user_ids = []
-        if self.reverse_user_info:
-            user_ids = check_user_notification_interest(event = msg, reverse_user_info = self.reverse_user_info)
+        if self.subscription_index:
+            user_ids = self.subscription_index.match(msg)
 
             #log.debug('process_event  user_ids: %s', user_ids)
 
@@ -121,12 +127,11 @@ class NotificationWorker(TransformEventListener):
 
         for user_id in user_ids:
             msg_recipient = self.user_info[user_id]['user_contact'].email
-            self.smtp_client = setting_up_smtp_client()
-            send_email(event=msg,
-                       msg_recipient=msg_recipient,
-                       smtp_client=self.smtp_client,
-                       rr_client=self.resource_registry)
-            self.smtp_client.quit()
+            self.delivery.deliver(msg, msg_recipient)
+
+    def on_quit(self):
+        self.delivery.stop()
+        super(NotificationWorker, self).on_quit()
 
     def get_user_notifications(self, user_info_id=''):
         """
@@ -149,39 +154,28 @@ class NotificationWorker(TransformEventListener):
 
         return notifications
 
-    def load_user_info(self):
-        '''
-        Method to load the user info dictionary used by the notification workers and the UNS
+    @property
+    def reverse_user_info(self):
+        return self.subscription_index.reverse_user_info()
 
-        @retval user_info dict
+    def reload_user_info(self, event_msg):
         '''
+        Reloads the users affected by a ReloadUserInfoEvent or a UserInfo ResourceModifiedEvent and
+        updates their subscriptions in the index, everything is reloaded if they can not be determined
+        '''
+        user_ids = users_affected_by(event_msg, self.user_info, self.resource_registry)
 
-        users, _ = self.resource_registry.find_resources(restype= RT.UserInfo)
-
-        user_info = {}
-
-        if not users:
-            return {}
-
-        for user in users:
-            notifications_disabled = False
-            notifications_daily_digest = False
-
-            notifications = self.get_user_notifications(user_info_id=user)
-
-            for variable in user.variables:
-                if type(variable) is dict and variable.has_key('name'):
-
-                    if variable['name'] == 'notifications_daily_digest':
-                        notifications_daily_digest = variable['value']
-
-                    if variable['name'] == 'notifications_disabled':
-                        notifications_disabled = variable['value']
-                else:
-                    log.warning('Invalid variables attribute on UserInfo instance. UserInfo: %s', user)
+        if user_ids is None:
+            self.user_info = self.load_user_info()
+            self.subscription_index = SubscriptionIndex(self.user_info)
+            return
 
-            user_info[user._id] = { 'user_contact' : user.contact, 'notifications' : notifications,
-                                    'notifications_daily_digest' : notifications_daily_digest, 'notifications_disabled' : notifications_disabled}
+        self.subscription_index.update(update_user_info(self.user_info, user_ids, self.resource_registry))
 
+    def load_user_info(self):
+        '''
+        Method to load the user info dictionary used by the notification workers and the UNS
 
-        return user_info
+        @retval user_info dict
+        '''
+        return load_user_info(self.resource_registry)
@@ -5,10 +5,16 @@
 @date Tue May  7 15:34:54 EDT 2013
 '''
 
-from pyon.core.exception import BadRequest
+from pyon.core.exception import BadRequest, NotFound
 from pyon.ion.process import ImmediateProcess, SimpleProcess
 from interface.services.dm.idata_retriever_service import DataRetrieverServiceProcessClient
 from ion.services.dm.utility.granule import RecordDictionaryTool
+from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
+from ion.util.stored_values import StoredValueManager
+from ion.util.time_utils import TimeUtils
+from gevent.pool import Pool
+from gevent.coros import Semaphore
+import gevent
 import time
 from pyon.ion.event import EventPublisher
 from pyon.public import OT, RT,PRED
@@ -31,10 +37,17 @@ class QCPostProcessing(SimpleProcess):
         - end_time: Unix timestamp, defaults to current time
         - qc_params: a list of qc functions to evaluate, currently supported functions are: ['glblrng_qc',
           'spketst_qc', 'stuckvl_qc'], defaults to all
+        - incremental: Only evaluate data newer than the last processed timestamp of each dataset, defaults to False
+        - pool_size: Number of datasets processed concurrently, defaults to 4
+
+    In incremental mode the QC and temporal columns are read directly from the coverage and the last
+    processed timestamp is kept per dataset in the object store (see high_water_key). The first run over
+    a dataset evaluates the usual run_interval window.
 
     '''
 
     qc_suffixes = ['glblrng_qc', 'spketst_qc', 'stuckvl_qc']
+    high_water_prefix = 'qc_post_processing_'
     def on_start(self):
         SimpleProcess.on_start(self)
         self.data_retriever = DataRetrieverServiceProcessClient(process=self)
@@ -45,17 +58,51 @@ class QCPostProcessing(SimpleProcess):
         self.add_endpoint(self.event_subscriber)
         self.resource_registry = self.container.resource_registry
         self.run_interval = self.CFG.get_safe('service.qc_processing.run_interval', 24)
+        self.incremental  = self.CFG.get_safe('process.incremental', False)
+        self.pool_size    = self.CFG.get_safe('process.pool_size', 4)
+        self.stored_value_manager = StoredValueManager(self.container)
+        self.qc_publisher = EventPublisher(event_type=OT.ParameterQCEvent)
+        self.run_lock = Semaphore()
+        self.run_greenlet = None
+
+    def on_quit(self):
+        if self.run_greenlet is not None:
+            self.run_greenlet.kill()
+        self.qc_publisher.close()
+        SimpleProcess.on_quit(self)
     
     def _event_callback(self, *args, **kwargs):
         log.info('QC Post Processing Triggered')
-        dataset_ids, _ = self.resource_registry.find_resources(restype=RT.Dataset, id_only=True)
-        for dataset_id in dataset_ids:
-            log.info('QC Post Processing for dataset %s', dataset_id)
-            try:
+        # Runs outside of the subscriber so that events arriving during a run can be skipped
+        if not self.run_lock.acquire(blocking=False):
+            log.warning('QC Post Processing is still running from the previous interval, skipping')
+            return
+        self.run_greenlet = gevent.spawn(self._process_datasets)
+
+    def _process_datasets(self):
+        try:
+            dataset_ids, _ = self.resource_registry.find_resources(restype=RT.Dataset, id_only=True)
+            pool = Pool(size=self.pool_size)
+            for dataset_id in dataset_ids:
+                pool.spawn(self._process_dataset, dataset_id)
+            pool.join()
+        except Exception:
+            log.exception('QC Post Processing failed')
+        finally:
+            self.run_lock.release()
+
+    def _process_dataset(self, dataset_id):
+        log.info('QC Post Processing for dataset %s', dataset_id)
+        try:
+            if self.incremental:
+                self.process_incremental(dataset_id)
+            else:
                 self.process(dataset_id)
-            except BadRequest as e:
-                if 'Problems reading from the coverage' in e.message:
-                    log.error('Failed to read from dataset')
+        except BadRequest as e:
+            if 'Problems reading from the coverage' in e.message:
+                log.error('Failed to read from dataset')
+        except Exception:
+            log.exception('QC Post Processing failed for dataset %s', dataset_id)
 
     def process(self, dataset_id, start_time=0, end_time=0):
         if not dataset_id:
@@ -66,7 +113,6 @@ class QCPostProcessing(SimpleProcess):
         
         qc_params  = [i for i in self.qc_params if i in self.qc_suffixes] or self.qc_suffixes
         
-        self.qc_publisher = EventPublisher(event_type=OT.ParameterQCEvent)
         log.debug('Iterating over the data blocks')
 
         for st,et in self.chop(int(start_time),int(end_time)):
@@ -97,6 +143,74 @@ class QCPostProcessing(SimpleProcess):
 
 
 
+    def process_incremental(self, dataset_id, end_time=0):
+        '''
+        Evaluates the QC flags of every record newer than the dataset's high water mark
+        and advances the mark to the latest record evaluated.
+        '''
+        if not dataset_id:
+            raise BadRequest('No dataset id specified.')
+        now = time.time()
+        high_water = self.read_high_water(dataset_id)
+        start_time = high_water or (now - (3600*(self.run_interval+1)))
+        end_time   = end_time or None
+
+        qc_params  = [i for i in self.qc_params if i in self.qc_suffixes] or self.qc_suffixes
+
+        coverage = None
+        try:
+            coverage = DatasetManagementService._get_coverage(dataset_id, mode='r')
+            if not coverage.num_timesteps:
+                return
+            qc_fields = [i for i in coverage.list_parameters() if any([i.endswith(j) for j in qc_params])]
+            if not qc_fields:
+                return
+            tname = coverage.temporal_parameter_name
+            uom = coverage.get_parameter_context(tname).uom
+            lower = TimeUtils.ts_to_units(uom, start_time)
+            upper = TimeUtils.ts_to_units(uom, end_time) if end_time is not None else None
+            log.debug('Reading %s from %s', qc_fields, dataset_id)
+            vdict = coverage.get_value_dictionary([tname] + qc_fields, temporal_slice=slice(lower, upper))
+            if not vdict:
+                return
+            times = np.atleast_1d(vdict[tname])
+            # The mark itself was evaluated on the previous run
+            new_records = (times > lower) if high_water else (times >= lower)
+            if not new_records.any():
+                return
+            for field in qc_fields:
+                val = vdict.get(field)
+                if val is None:
+                    continue
+                alerts = new_records & (np.atleast_1d(val) == 0)
+                if alerts.any():
+                    log.debug('Found QC Alerts')
+                    self.flag_qc_parameter(dataset_id, field, times[alerts].tolist(), {})
+            last_time = TimeUtils.units_to_ts(uom, np.max(times[new_records]))
+        except BadRequest:
+            raise
+        except Exception:
+            log.exception('Problems reading from the coverage')
+            raise BadRequest('Problems reading from the coverage')
+        finally:
+            if coverage is not None:
+                coverage.close(timeout=5)
+        self.write_high_water(dataset_id, last_time)
+
+    @classmethod
+    def high_water_key(cls, dataset_id):
+        return cls.high_water_prefix + dataset_id
+
+    def read_high_water(self, dataset_id):
+        try:
+            doc = self.stored_value_manager.read_value(self.high_water_key(dataset_id))
+        except NotFound:
+            return None
+        return doc.get('last_time')
+
+    def write_high_water(self, dataset_id, last_time):
+        self.stored_value_manager.stored_value_cas(self.high_water_key(dataset_id), {'last_time':float(last_time)})
+
     def flag_qc_parameter(self, dataset_id, parameter, temporal_values, configuration):
         log.info('Flagging QC for %s', parameter)
         data_product_ids, _ = self.resource_registry.find_subjects(object=dataset_id, subject_type=RT.DataProduct, predicate=PRED.hasDataset, id_only=True)
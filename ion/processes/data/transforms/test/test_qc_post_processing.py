@@ -219,3 +219,48 @@ class TestQCPostProcessing(DMTestCase):
             raise AssertionError('QC Events not raised')
             
 
+
+    def test_incremental_qc_processing(self):
+        interval_key = uuid4().hex
+        data_product_id, dataset_id, stream_def_id = self.make_data_product()
+        ph = ParameterHelper(self.dataset_management, self.addCleanup)
+        monitor = DatasetMonitor(dataset_id)
+        self.addCleanup(monitor.stop)
+        for rdt in self.populate_vectors(stream_def_id, 1, lambda x : [41] + [39] * (x-1)):
+            ph.publish_rdt_to_data_product(data_product_id, rdt)
+        self.assertTrue(monitor.event.wait(10))
+        monitor.event.clear()
+
+        async_queue = Queue()
+        def cb(event, *args, **kwargs):
+            if not event.qc_parameter.endswith('glblrng_qc'):
+                return
+            async_queue.put(event.temporal_values)
+        es = EventSubscriber(event_type=OT.ParameterQCEvent, origin=data_product_id, callback=cb, auto_delete=True)
+        es.start()
+        self.addCleanup(es.stop)
+
+        config = DotDict()
+        config.process.interval_key = interval_key
+        config.process.qc_params = ['glblrng_qc']
+        config.process.incremental = True
+        self.sync_launch(config)
+
+        ep = EventPublisher(event_type='TimerEvent')
+        ep.publish_event(origin=interval_key)
+        self.assertEquals(len(async_queue.get(timeout=60)), 1)
+
+        # Nothing new was ingested, the flagged record is not evaluated again
+        ep.publish_event(origin=interval_key)
+        with self.assertRaises(Empty):
+            async_queue.get(timeout=10)
+
+        rdt = RecordDictionaryTool(stream_definition_id=stream_def_id)
+        ntp_now = time.time() + 2208988800
+        rdt['time'] = np.arange(ntp_now, ntp_now + 10)
+        rdt['temp'] = [39] * 8 + [41] * 2
+        ph.publish_rdt_to_data_product(data_product_id, rdt)
+        self.assertTrue(monitor.event.wait(10))
+
+        ep.publish_event(origin=interval_key)
+        self.assertEquals(len(async_queue.get(timeout=60)), 2)
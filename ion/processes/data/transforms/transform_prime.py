@@ -13,13 +13,11 @@ from coverage_model import get_value_class
 from coverage_model.parameter_types import ParameterFunctionType
 from pyon.util.memoize import memoize_lru
 from pyon.util.log import log
-from pyon.core.exception import NotFound
 from pyon.ion.event import EventSubscriber
-from ion.util.stored_values import StoredValueManager
+from ion.util.stored_values import StoredValueManager, StoredValueCache
 from pyon.public import OT
 
 from gevent.event import Event
-from gevent.queue import Queue
 class TransformPrime(TransformDataProcess):
     binding=['output']
     '''
@@ -40,7 +38,7 @@ class TransformPrime(TransformDataProcess):
         self.input_data_product_ids = self.CFG.get_safe('process.input_products', [])
         self.output_data_product_ids = self.CFG.get_safe('process.output_products', [])
         self.lookup_docs = self.CFG.get_safe('process.lookup_docs',[])
-        self.new_lookups = Queue()
+        self.lookup_cache = StoredValueCache(self.stored_values, self.lookup_docs)
         self.lookup_monitor = EventSubscriber(event_type=OT.ExternalReferencesUpdatedEvent,callback=self._add_lookups, auto_delete=True)
         self.lookup_monitor.start()
 
@@ -51,7 +49,8 @@ class TransformPrime(TransformDataProcess):
     def _add_lookups(self, event, *args, **kwargs):
         if event.origin in self.input_data_product_ids + self.output_data_product_ids:
             if isinstance(event.reference_keys, list):
-                self.new_lookups.put(event.reference_keys)
+                self.lookup_cache.add_keys(event.reference_keys)
+                self.lookup_docs = self.lookup_cache.doc_keys
 
 
     @memoize_lru(100)
@@ -137,20 +136,7 @@ class TransformPrime(TransformDataProcess):
 
 
     def _get_lookup_value(self, lookup_value):
-        if not self.new_lookups.empty():
-            new_values = self.new_lookups.get()
-            self.lookup_docs = new_values + self.lookup_docs
-
-        lookup_value_document_keys = self.lookup_docs
-        for key in lookup_value_document_keys:
-            try:
-                document = self.stored_values.read_value(key)
-                if lookup_value in document:
-                    return document[lookup_value]
-            except NotFound:
-                log.warning('Specified lookup document does not exist')
-
-        return None
+        return self.lookup_cache.lookup(lookup_value)
 
     def _execute_transform(self, msg, streams):
         stream_in_id,stream_out_id = streams
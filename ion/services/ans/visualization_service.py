@@ -50,6 +50,8 @@ class VisualizationService(BaseVisualizationService):
     def on_init(self):
         self.create_workflow_timeout = get_safe(self.CFG, 'create_workflow_timeout', 60)
         self.terminate_workflow_timeout = get_safe(self.CFG, 'terminate_workflow_timeout', 60)
+        # retrieve_oob is called directly, without the retriever's DatasetModified subscriber
+        DataRetrieverService.set_cache_max_age(get_safe(self.CFG, 'service.data_retriever.cache_max_age', 10))
 #        self.monitor_timeout = get_safe(self.CFG, 'user_queue_monitor_timeout', 300)
 #        self.monitor_queue_size = get_safe(self.CFG, 'user_queue_monitor_size', 100)
 #
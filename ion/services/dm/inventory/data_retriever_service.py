@@ -8,10 +8,14 @@ from ion.core.function.transform_function import TransformFunction
 from ion.processes.data.replay.replay_process import ReplayProcess
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.utility.granule import RecordDictionaryTool
+from ion.services.dm.utility.coverage_cache import CoverageCache
+from ion.services.dm.utility.time_index import TimeIndex
 
-from pyon.core.exception import BadRequest 
+from coverage_model import ParameterDictionary
+
+from pyon.core.exception import BadRequest, NotFound
 from pyon.container.cc import Container
-from pyon.public import PRED, RT
+from pyon.public import PRED, RT, CFG
 from pyon.util.arg_check import validate_is_instance, validate_true
 from pyon.util.containers import for_name
 from pyon.util.log import log
@@ -21,16 +25,26 @@ from interface.objects import Replay
 from interface.services.dm.idata_retriever_service import BaseDataRetrieverService
 
 import collections
-import time
-import gevent
 
 class DataRetrieverService(BaseDataRetrieverService):
     REPLAY_PROCESS = 'replay_process'
 
-    _refresh_interval = 10
-    _cache_limit      = 5
-    _retrieve_cache   = collections.OrderedDict()
-    _cache_lock       = gevent.coros.RLock()
+    #--------------------------------------------------------------------------------
+    # Coverage Cache
+    # - Read-mode coverages bounded by count, estimated bytes and file handles
+    # - Invalidated by the DatasetModified events published by ingestion
+    # - Processes that call retrieve_oob without running the DatasetModified
+    #   subscriber reopen them after a max age, see set_cache_max_age
+    #--------------------------------------------------------------------------------
+    _retrieve_cache = CoverageCache(lambda dataset_id: DatasetManagementService._get_nonview_coverage(dataset_id, mode='r'),
+                                    max_entries=CFG.get_safe('service.data_retriever.cache_limit', 5),
+                                    max_bytes=CFG.get_safe('service.data_retriever.cache_bytes', None),
+                                    max_handles=CFG.get_safe('service.data_retriever.cache_handles', None),
+                                    policy=CFG.get_safe('service.data_retriever.cache_policy', CoverageCache.LRU))
+
+    # Time indexes maintained by ingestion, also invalidated by DatasetModified
+    _time_indexes = collections.OrderedDict()
+    _time_index_limit = CFG.get_safe('service.data_retriever.time_index_limit', 100)
 
     def on_start(self):
         self.event_subscriber = EventSubscriber(event_type='DatasetModified', callback=lambda event,m : self._eject_cache(event.origin), auto_delete=True)
@@ -38,11 +52,49 @@ class DataRetrieverService(BaseDataRetrieverService):
 
     @classmethod
     def _eject_cache(cls, dataset_id):
-        with cls._cache_lock:
+        cls._retrieve_cache.invalidate(dataset_id)
+        cls._time_indexes.pop(dataset_id, None)
+
+    @classmethod
+    def set_cache_max_age(cls, max_age):
+        '''
+        Reopens the cached coverages older than max_age seconds, None for no limit.
+        For the processes that call retrieve_oob without the DatasetModified subscriber
+        of on_start, which otherwise keep reading stale coverages.
+        '''
+        cls._retrieve_cache.max_age = max_age
+
+    @classmethod
+    def _get_time_index(cls, dataset_id, refresh=False):
+        '''
+        Memoization (LRU) of the dataset's time index, None if the dataset has none.
+        The index is only kept up to date by DatasetModified events, callers that
+        rely on it being current re-read it with refresh.
+        '''
+        try:
+            if refresh:
+                raise KeyError(dataset_id)
+            time_index = cls._time_indexes.pop(dataset_id)
+        except KeyError:
+            cls._time_indexes.pop(dataset_id, None)
             try:
-                cls._retrieve_cache.pop(dataset_id)
-            except KeyError:
-                pass
+                doc = Container.instance.object_store.read_doc(dataset_id)
+            except NotFound:
+                return None
+            if 'time_index' not in doc:
+                return None
+            time_index = TimeIndex(doc['time_index'])
+            if len(cls._time_indexes) >= cls._time_index_limit:
+                cls._time_indexes.popitem(0)
+        cls._time_indexes[dataset_id] = time_index
+        return time_index
+
+    @classmethod
+    def get_cache_stats(cls):
+        '''
+        Returns the hit, miss, eviction and invalidation counters of the coverage cache
+        '''
+        return cls._retrieve_cache.stats()
     
     def define_replay(self, dataset_id='', query=None, delivery_format='', stream_id=''):
         ''' Define the stream that will contain the data from data store by streaming to an exchange name.
@@ -124,35 +176,47 @@ class DataRetrieverService(BaseDataRetrieverService):
         '''
         Memoized coverage instantiation and management
         '''
-        # Cached get
-        retval = None
-        with cls._cache_lock:
-            try:
-                retval, age = cls._retrieve_cache.pop(dataset_id)
-                if (time.time() - age) > cls._refresh_interval:
-                    raise KeyError(dataset_id)
-            except KeyError: # Cache miss
-                #@TODO: Add in LRU logic (maybe some mem checking too!)
-                if len(cls._retrieve_cache) > cls._cache_limit:
-                    cls._retrieve_cache.popitem(0)
-                retval = DatasetManagementService._get_nonview_coverage(dataset_id, mode='r') 
-            age = time.time()
-            cls._retrieve_cache[dataset_id] = (retval, age)
-        return retval
+        return cls._retrieve_cache.get(dataset_id)
+
+    @classmethod
+    def _empty_rdt(cls, dataset_id, delivery_format=''):
+        '''
+        An empty record dictionary for the dataset, built without opening its coverage
+        '''
+        if delivery_format:
+            return RecordDictionaryTool(stream_definition_id=delivery_format)
+        dataset = Container.instance.resource_registry.read(dataset_id)
+        return RecordDictionaryTool(param_dictionary=ParameterDictionary.load(dataset.parameter_dictionary))
 
     @classmethod
     def retrieve_oob(cls, dataset_id='', query=None, delivery_format=''):
         query = query or {}
-        coverage = None
+        start_time, end_time = query.get('start_time', None), query.get('end_time', None)
         try:
-            coverage = cls._get_coverage(dataset_id)
-            if coverage is None:
-                raise BadRequest('no such coverage')
-            if coverage.num_timesteps == 0:
-                log.info('Reading from an empty coverage')
-                rdt = RecordDictionaryTool(param_dictionary=coverage.parameter_dictionary)
-            else:
-                rdt = ReplayProcess._cov2granule(coverage=coverage, start_time=query.get('start_time', None), end_time=query.get('end_time',None), stride_time=query.get('stride_time',None), parameters=query.get('parameters',None), stream_def_id=delivery_format, tdoa=query.get('tdoa',None))
+            time_index = None
+            if query.get('tdoa',None) is None and not (start_time is None and end_time is None):
+                time_index = cls._get_time_index(dataset_id)
+                if time_index is not None and time_index.index_range(start_time, end_time) is None:
+                    # The cached index may predate the latest ingestion, only trust a miss on a fresh one
+                    time_index = cls._get_time_index(dataset_id, refresh=True)
+                    if time_index is not None and time_index.index_range(start_time, end_time) is None:
+                        log.info('Requested time window is outside of the dataset')
+                        return cls._empty_rdt(dataset_id, delivery_format).to_granule()
+            with cls._retrieve_cache.checkout(dataset_id) as coverage:
+                if coverage is None:
+                    raise BadRequest('no such coverage')
+                if time_index is not None and time_index.num_records != coverage.num_timesteps:
+                    time_index = cls._get_time_index(dataset_id, refresh=True)
+                    if time_index is not None and time_index.num_records != coverage.num_timesteps:
+                        log.debug('Time index of dataset %s is out of date, not using it', dataset_id)
+                        time_index = None
+                if coverage.num_timesteps == 0:
+                    log.info('Reading from an empty coverage')
+                    rdt = RecordDictionaryTool(param_dictionary=coverage.parameter_dictionary)
+                elif query.get('aggregate', None):
+                    rdt = ReplayProcess._coverage_to_granule(coverage=coverage, start_time=query.get('start_time', None), end_time=query.get('end_time',None), stride_time=query.get('stride_time',None), parameters=query.get('parameters',None), stream_def_id=delivery_format, aggregate=query['aggregate'], time_index=time_index)
+                else:
+                    rdt = ReplayProcess._cov2granule(coverage=coverage, start_time=query.get('start_time', None), end_time=query.get('end_time',None), stride_time=query.get('stride_time',None), parameters=query.get('parameters',None), stream_def_id=delivery_format, tdoa=query.get('tdoa',None), time_index=time_index)
         except:
             cls._eject_cache(dataset_id)
             data_products, _ = Container.instance.resource_registry.find_subjects(object=dataset_id, predicate=PRED.hasDataset, subject_type=RT.DataProduct)
@@ -166,7 +230,7 @@ class DataRetrieverService(BaseDataRetrieverService):
         '''
         Retrieves a dataset.
         @param dataset_id      Dataset identifier
-        @param query           Query parameters (start_time, end_time, stride_time, parameters, tdoa)
+        @param query           Query parameters (start_time, end_time, stride_time, parameters, tdoa, aggregate)
         @param delivery_format The stream definition identifier for the outgoing granule (stream_defintinition_id)
         @param module          Module to chain a transform into
         @param cls             Class of the transform
@@ -14,6 +14,7 @@ from pyon.util.file_sys import FileSystem, FS
 from pyon.util.log import log
 
 from ion.services.dm.utility.granule_utils import SimplexCoverage, ParameterDictionary, GridDomain, ParameterContext
+from ion.services.dm.utility.time_index import TimeIndex
 from ion.util.time_utils import TimeUtils
 
 from interface.objects import ParameterContext as ParameterContextResource, ParameterDictionary as ParameterDictionaryResource, ParameterFunction as ParameterFunctionResource
@@ -337,10 +338,22 @@ class DatasetManagementService(BaseDatasetManagementService):
         dataset = self.read_dataset(dataset_id)
         if not dataset:
             return {}
+        # Datasets with a time index carry the temporal parameter and units in their metadata document
+        try:
+            doc = self.container.object_store.read_doc(dataset_id)
+        except NotFound:
+            return {}
+        if 'time_index' in doc:
+            time_index = TimeIndex(doc['time_index'])
+            bounds = doc['bounds'].get(time_index.parameter)
+            if not bounds:
+                return {}
+            return [time_index.to_ts(i) for i in bounds]
+
         pdict = ParameterDictionary.load(dataset.parameter_dictionary)
         temporal_parameter = pdict.temporal_parameter_name
         units = pdict.get_temporal_context().uom
-        bounds = self.dataset_bounds(dataset_id)
+        bounds = doc['bounds']
         if not bounds:
             return {}
         bounds = bounds[temporal_parameter or 'time']
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/presentation/association_graph.py
+@description Breadth-first traversal of the resource association graph
+'''
+
+import time
+
+
+class AssociationGraph(object):
+    '''
+    Breadth-first traversal engine over the resource registry's associations.
+
+    Visited resources are kept in a set and each level issues a single
+    find_objects_mult (or find_subjects_mult for reverse traversals) for the
+    resources first reached on the previous level, so a traversal costs one
+    round-trip per level of the graph.
+
+    With a positive ttl the edges of every expanded resource are kept as an
+    adjacency snapshot for ttl seconds and only unknown or expired resources are
+    sent to the resource registry.
+    '''
+    def __init__(self, resource_registry, ttl=0):
+        self.resource_registry = resource_registry
+        self.ttl = ttl
+        self._adjacency = {True:{}, False:{}}
+
+    def clear(self):
+        self._adjacency = {True:{}, False:{}}
+
+    def edges(self, resource_ids, reverse=False):
+        '''
+        Returns {resource_id: [(neighbor_id, predicate, neighbor_type), ...]} for resource_ids
+        '''
+        retval = {}
+        now = time.time()
+        snapshot = self._adjacency[reverse]
+        missing = []
+        for resource_id in resource_ids:
+            if self.ttl > 0 and resource_id in snapshot and snapshot[resource_id][0] > now:
+                retval[resource_id] = snapshot[resource_id][1]
+            else:
+                missing.append(resource_id)
+                retval[resource_id] = []
+
+        if missing:
+            if reverse:
+                neighbors, assocs = self.resource_registry.find_subjects_mult(objects=missing, id_only=True)
+            else:
+                neighbors, assocs = self.resource_registry.find_objects_mult(subjects=missing, id_only=True)
+            for neighbor, assoc in zip(neighbors, assocs):
+                if reverse:
+                    retval[assoc.o].append((neighbor, assoc.p, assoc.st))
+                else:
+                    retval[assoc.s].append((neighbor, assoc.p, assoc.ot))
+            if self.ttl > 0:
+                expires = now + self.ttl
+                for resource_id in missing:
+                    snapshot[resource_id] = (expires, retval[resource_id])
+        return retval
+
+    def traverse(self, resource_id, reverse=False, depth=None, predicates=None, types=None):
+        '''
+        Returns the resources reachable from resource_id in breadth-first order
+
+        @param reverse     Follow associations from object to subject
+        @param depth       Maximum number of associations followed, unlimited if None
+        @param predicates  Only follow associations with these predicates
+        @param types       Only visit resources of these types
+        '''
+        predicates = set(predicates) if predicates else None
+        types = set(types) if types else None
+
+        visited = set()
+        resources = []
+        frontier = [resource_id]
+        level = 0
+        while frontier and (depth is None or level < depth):
+            gathered = []
+            edges = self.edges(frontier, reverse)
+            for node in frontier:
+                for neighbor, predicate, neighbor_type in edges[node]:
+                    if neighbor in visited:
+                        continue
+                    if predicates is not None and predicate not in predicates:
+                        continue
+                    if types is not None and neighbor_type not in types:
+                        continue
+                    visited.add(neighbor)
+                    resources.append(neighbor)
+                    gathered.append(neighbor)
+            frontier = gathered
+            level += 1
+        return resources
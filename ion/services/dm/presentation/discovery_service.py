@@ -17,9 +17,9 @@ from pyon.core.bootstrap import get_obj_registry, get_sys_name
 from pyon.core.object import IonObjectDeserializer
 from ion.services.dm.inventory.index_management_service import IndexManagementService
 from ion.processes.bootstrap.index_bootstrap import STD_INDEXES
-from collections import deque
 from ion.services.dm.utility.query_language import QueryLanguage
 from ion.services.dm.presentation.ds_discovery import DatastoreDiscovery
+from ion.services.dm.presentation.association_graph import AssociationGraph
 
 import dateutil.parser
 import calendar
@@ -202,28 +202,7 @@ class DiscoveryService(BaseDiscoveryService):
         @param resource_id    str
         @retval resources    list
         """
-        
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids, list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_objects_mult(subjects=resource_ids,id_only=True)[0]
-            
-        visited_resources = deque(edges([resource_id]))
-        traversal_queue = deque()
-        done = False
-        t = None
-        while not done:
-            t = traversal_queue or deque(visited_resources)
-            traversal_queue = deque()
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    traversal_queue.append(e)
-            if not len(traversal_queue): done = True
-
-
-
-        return list(visited_resources)
+        return self.association_graph.traverse(resource_id)
 
     def reverse_traverse(self, resource_id=''):
         """Breadth-first traversal of the association graph for a specified resource.
@@ -231,89 +210,26 @@ class DiscoveryService(BaseDiscoveryService):
         @param resource_id    str
         @retval resources    list
         """
-        
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids,list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_subjects_mult(objects=resource_ids,id_only=True)[0]
-            
-        visited_resources = deque(edges([resource_id]))
-        traversal_queue = deque()
-        done = False
-        t = None
-        while not done:
-            t = traversal_queue or deque(visited_resources)
-            traversal_queue = deque()
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    traversal_queue.append(e)
-            if not len(traversal_queue): done = True
-
-
-
-        return list(visited_resources)
-    
+        return self.association_graph.traverse(resource_id, reverse=True)
 
     def iterative_traverse(self, resource_id='', limit=-1):
         '''
         Iterative breadth first traversal of the resource associations
         '''
-        #--------------------------------------------------------------------------------
-        # Retrieve edges for this resource
-        #--------------------------------------------------------------------------------
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids, list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_objects_mult(subjects=resource_ids,id_only=True)[0]
-            
-        gathered = deque()
-        visited_resources = deque(edges([resource_id]))
-        while limit>0:
-            t = gathered or deque(visited_resources)
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    gathered.append(e)
-            if not len(gathered): break
-
-            t = deque(gathered)
-            gathered = deque()
-            limit -= 1
-
-        return list(visited_resources)
+        return self.association_graph.traverse(resource_id, depth=max(limit, 0) + 1)
 
     def iterative_reverse_traverse(self, resource_id='', limit=-1):
         '''
         Iterative breadth first traversal of the resource associations
         '''
-        #--------------------------------------------------------------------------------
-        # Retrieve edges for this resource
-        #--------------------------------------------------------------------------------
-        def edges(resource_ids=[]):
-            if not isinstance(resource_ids, list):
-                resource_ids = list(resource_ids)
-            return self.clients.resource_registry.find_subjects_mult(objects=resource_ids,id_only=True)[0]
-            
-        gathered = deque()
-        visited_resources = deque(edges([resource_id]))
-        while limit>0:
-            t = gathered or deque(visited_resources)
-            for e in edges(t):
-                if not e in visited_resources:
-                    visited_resources.append(e)
-                    gathered.append(e)
-            if not len(gathered): break
-
-            t = deque(gathered)
-            gathered = deque()
-            limit -= 1
-
-        return list(visited_resources)
-
-
-            
-
+        return self.association_graph.traverse(resource_id, reverse=True, depth=max(limit, 0) + 1)
+
+    @property
+    def association_graph(self):
+        if getattr(self, '_association_graph', None) is None:
+            ttl = CFG.get_safe('service.discovery.adjacency_ttl', 0)
+            self._association_graph = AssociationGraph(self.clients.resource_registry, ttl=ttl)
+        return self._association_graph
 
     def intersect(self, left=[], right=[]):
         """The intersection between two sets of resources.
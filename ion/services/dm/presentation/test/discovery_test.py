@@ -150,21 +150,47 @@ class DiscoveryUnitTest(PyonTestCase):
         pass
         
 
-    @skip('Needs to be adjusted for new traversal')
-    def test_traverse(self):
-        edge_list = ['B','C','D']
+    def graph_edges(self, graph):
         callers = []
-        def pop_edge(*args, **kwargs):
-            callers.append(args[0])
-            if len(edge_list):
-                val = edge_list.pop(0)
-                return [val], 'blah'
-            return [], 'blah'
-        self.rr_find_obj.side_effect = pop_edge
+        def find_objects_mult(subjects=[], id_only=False):
+            callers.append(list(subjects))
+            objects, assocs = [], []
+            for s in subjects:
+                for o, p, ot in graph.get(s, []):
+                    objects.append(o)
+                    assocs.append(DotDict(s=s, p=p, o=o, ot=ot))
+            return objects, assocs
+        self.rr_find_assocs_mult.side_effect = find_objects_mult
+        return callers
+
+    def test_traverse(self):
+        # A -> B -> C -> A, A -> D
+        graph = {'A' : [('B', PRED.hasTransform, RT.Transform), ('D', PRED.hasDataset, RT.Dataset)],
+                 'B' : [('C', PRED.hasProcessDefinition, RT.ProcessDefinition)],
+                 'C' : [('A', PRED.hasTransform, RT.DataProcess)]}
+        callers = self.graph_edges(graph)
 
         retval = self.discovery.traverse('A')
-        retval.sort()
-        self.assertTrue(retval == ['B','C','D'], '%s' % retval)
+        self.assertEquals(retval, ['B','D','C','A'])
+        # One call per level, only the new frontier is sent
+        self.assertEquals(callers, [['A'], ['B','D'], ['C'], ['A']])
+
+        self.assertEquals(self.discovery.iterative_traverse('A'), ['B','D'])
+        self.assertEquals(self.discovery.iterative_traverse('A', 1), ['B','D','C'])
+
+        graph_engine = self.discovery.association_graph
+        self.assertEquals(graph_engine.traverse('A', predicates=[PRED.hasTransform, PRED.hasProcessDefinition]), ['B','C','A'])
+        self.assertEquals(graph_engine.traverse('A', types=[RT.Dataset]), ['D'])
+
+    def test_traverse_snapshot(self):
+        graph = {'A' : [('B', PRED.hasTransform, RT.Transform)],
+                 'B' : [('C', PRED.hasProcessDefinition, RT.ProcessDefinition)]}
+        callers = self.graph_edges(graph)
+        self.discovery.association_graph.ttl = 60
+
+        self.assertEquals(self.discovery.traverse('A'), ['B','C'])
+        self.assertEquals(self.discovery.traverse('A'), ['B','C'])
+        self.assertEquals(len(callers), 3)
 
     def test_intersect(self):
         test_vals = [0,1,2,3]
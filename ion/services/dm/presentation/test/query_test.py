@@ -196,3 +196,17 @@ class QueryLanguageUnitTest(PyonTestCase):
         test_string = "search 'geospatial_bounds' vertical from 0.5 to 10.2 from 'index'"
         retval = self.parser.parse(test_string)
         self.assertEquals(retval, {'and':[], 'or':[], 'query':{'field':'geospatial_bounds', 'vertical_bounds':{'from':0.5, 'to':10.2}, 'index':'index'}})
+
+    def test_parse_cache(self):
+        test_string = "search 'description' is 'cached' from 'index' limit 5"
+        retval = self.parser.parse(test_string)
+        retval['query']['value'] = 'modified'
+
+        other = QueryLanguage()
+        self.assertTrue(other.grammar() is self.parser.grammar())
+        self.assertEquals(other.parse(test_string), {'and':[], 'or':[], 'limit':5, 'query':{'field':'description', 'value':'cached', 'index':'index'}})
+
+        QueryLanguage.clear_cache()
+        with self.assertRaises(BadRequest):
+            other.parse("search 'description' is")
+        self.assertFalse(QueryLanguage._cache)
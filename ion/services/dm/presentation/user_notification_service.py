@@ -14,7 +14,8 @@ from pyon.event.event import EventPublisher, EventSubscriber
 from pyon.core.governance import ORG_MEMBER_ROLE, ORG_MANAGER_ROLE, INSTRUMENT_OPERATOR, DATA_OPERATOR, OBSERVATORY_OPERATOR, GovernanceHeaderValues, has_org_role
 
 from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, convert_events_to_email_message, get_event_computed_attributes
-from ion.services.dm.utility.uns_utility_methods import calculate_reverse_user_info
+from ion.services.dm.utility.uns_utility_methods import calculate_reverse_user_info, load_user_info, users_affected_by, update_user_info
+from ion.services.dm.utility.uns_utility_methods import EventIndex
 
 from interface.services.dm.idiscovery_service import DiscoveryServiceClient
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
@@ -23,6 +24,9 @@ from interface.objects import ComputedValueAvailability, ComputedListValue
 from interface.objects import ProcessDefinition, TemporalBounds
 from interface.services.dm.iuser_notification_service import BaseUserNotificationService
 
+from gevent.pool import Pool
+from gevent.queue import Queue
+
 CFG_ELASTIC_SEARCH = CFG.get_safe('system.elasticsearch', False)
 
 
@@ -104,7 +108,12 @@ class UserNotificationService(BaseUserNotificationService):
             log.debug("(UNS instance received a ReloadNotificationEvent. The relevant notification_id is %s" % notification_id)
 
             try:
-                self.user_info = self.load_user_info()
+                # The user info is loaded in full on the first reload
+                user_ids = users_affected_by(event_msg, self.user_info, self.clients.resource_registry) if self.user_info else None
+                if user_ids is None:
+                    self.user_info = self.load_user_info()
+                else:
+                    update_user_info(self.user_info, user_ids, self.clients.resource_registry)
             except NotFound:
                 log.warning("ElasticSearch has not yet loaded the user_index.")
 
@@ -606,71 +615,68 @@ class UserNotificationService(BaseUserNotificationService):
         if end_time <= start_time:
             return
 
-        for user_id, value in self.user_info.iteritems():
-
-            notifications = self.get_user_notifications(user_info_id=user_id)
-            notifications_disabled = value['notifications_disabled']
-            notifications_daily_digest = value['notifications_daily_digest']
-
-
-            # Ignore users who do NOT want batch notifications or who have disabled the delivery switch
-            # However, if notification preferences have not been set for the user, use the default mechanism and do not bother
-            if notifications_disabled or not notifications_daily_digest:
-                    continue
+        # Ignore users who do NOT want batch notifications or who have disabled the delivery switch
+        # However, if notification preferences have not been set for the user, use the default mechanism and do not bother
+        user_ids = [user_id for user_id, value in self.user_info.iteritems()
+                    if not value['notifications_disabled'] and value['notifications_daily_digest']]
+        if not user_ids:
+            self.smtp_client.quit()
+            return
 
-            events_for_message = []
+        # The active notifications of each user, as kept up to date by reload_user_info
+        notifications = dict((user_id, self.user_info[user_id]['notifications']) for user_id in user_ids)
 
+        #------------------------------------------------------------------------------------
+        # Fetch the events of the window once and index them
+        #------------------------------------------------------------------------------------
+        if CFG_ELASTIC_SEARCH:
             search_time = "SEARCH 'ts_created' VALUES FROM %s TO %s FROM 'events_index'" % (start_time, end_time)
+            ret_vals = self.discovery.parse(search_time)
+            events = self.datastore.read_mult(ret_vals) if ret_vals else []
+        else:
+            event_tuples = self.container.event_repository.find_events(start_ts=start_time, end_ts=end_time)
+            events = [item[2] for item in event_tuples]
+        event_index = EventIndex(events)
+        log.debug('process_batch indexed %s events for %s users', len(events), len(notifications))
 
-            for notification in notifications:
-                # If the notification request has expired, then do not use it in the search
-                if notification.temporal_bounds.end_datetime:
-                    continue
-
-                if CFG_ELASTIC_SEARCH:
-                    if notification.origin:
-                        search_origin = 'search "origin" is "%s" from "events_index"' % notification.origin
-                    else:
-                        search_origin = 'search "origin" is "*" from "events_index"'
-
-                    if notification.origin_type:
-                        search_origin_type= 'search "origin_type" is "%s" from "events_index"' % notification.origin_type
-                    else:
-                        search_origin_type= 'search "origin_type" is "*" from "events_index"'
-
-                    if notification.event_type:
-                        search_event_type = 'search "type_" is "%s" from "events_index"' % notification.event_type
-                    else:
-                        search_event_type = 'search "type_" is "*" from "events_index"'
-
-                    search_string = search_time + ' and ' + search_origin + ' and ' + search_origin_type + ' and ' + search_event_type
-
-                    # get the list of ids corresponding to the events
-                    log.debug('process_batch  search_string: %s', search_string)
-                    ret_vals = self.discovery.parse(search_string)
-
-                    events_for_message.extend(self.datastore.read_mult(ret_vals))
-
-                else:
-                    # Adding a branch
-                    event_tuples = self.container.event_repository.find_events(
-                        origin=notification.origin,
-                        event_type=notification.event_type,
-                        start_ts=start_time,
-                        end_ts=end_time)
-                    events = [item[2] for item in event_tuples]
-
-                    events_for_message.extend(events)
+        #------------------------------------------------------------------------------------
+        # Build and send the digests concurrently, each greenlet borrows an SMTP client
+        #------------------------------------------------------------------------------------
+        pool_size = CFG.get_safe('service.user_notification.digest_pool_size', 10)
+        smtp_clients = Queue()
+        smtp_clients.put(self.smtp_client)
+        created = [self.smtp_client]
 
+        def digest(user_id):
+            events_for_message = event_index.events_for(notifications[user_id])
             log.debug("Found following events of interest to user, %s: %s", user_id, events_for_message)
+            if not events_for_message:
+                return
+            smtp_client = None
+            try:
+                if smtp_clients.empty() and len(created) < pool_size:
+                    smtp_client = setting_up_smtp_client()
+                    created.append(smtp_client)
+                else:
+                    smtp_client = smtp_clients.get()
 
-            # send a notification email to each user using a _send_email() method
-            if events_for_message:
+                # send a notification email to each user using a _send_email() method
                 self.format_and_send_email(events_for_message = events_for_message,
                                             user_id = user_id,
-                                            smtp_client=self.smtp_client)
+                                            smtp_client=smtp_client)
+            except Exception:
+                log.exception('Failed to send the digest to user %s', user_id)
+            finally:
+                if smtp_client is not None:
+                    smtp_clients.put(smtp_client)
 
-        self.smtp_client.quit()
+        pool = Pool(size=pool_size)
+        for user_id in notifications:
+            pool.spawn(digest, user_id)
+        pool.join()
+
+        for smtp_client in created:
+            smtp_client.quit()
 
 
     def format_and_send_email(self, events_for_message=None, user_id=None, smtp_client=None):
@@ -807,38 +813,7 @@ class UserNotificationService(BaseUserNotificationService):
 
         @retval user_info dict
         """
-        users, _ = self.clients.resource_registry.find_resources(restype=RT.UserInfo)
-
-        user_info = {}
-
-        if not users:
-            return {}
-
-        for user in users:
-            notifications = []
-            notifications_disabled = False
-            notifications_daily_digest = False
-
-            #retrieve all the active notifications assoc to this user
-            notifications = self.get_user_notifications(user_info_id=user)
-            log.debug('load_user_info notifications:   %s', notifications)
-
-            for variable in user.variables:
-                if type(variable) is dict and variable.has_key('name'):
-
-                    if variable['name'] == 'notifications_daily_digest':
-                        notifications_daily_digest = variable['value']
-
-                    if variable['name'] == 'notifications_disabled':
-                        notifications_disabled = variable['value']
-
-                else:
-                    log.warning('Invalid variables attribute on UserInfo instance. UserInfo: %s', user)
-
-            user_info[user._id] = { 'user_contact' : user.contact, 'notifications' : notifications,
-                                    'notifications_daily_digest' : notifications_daily_digest, 'notifications_disabled' : notifications_disabled}
-
-        return user_info
+        return load_user_info(self.clients.resource_registry)
 
 
     ##
@@ -612,10 +612,17 @@ class TestDMEnd2End(IonIntegrationTestCase):
         rdt = RecordDictionaryTool.load_from_granule(granule)
         self.assertTrue((rdt['time'] == np.arange(40)).all())
 
+        # Windows past the cached time index are still served once more data arrives
+        granule = DataRetrieverService.retrieve_oob(dataset_id, query={'start_time':0, 'end_time':39})
+        self.publish_hifi(stream_id, route, 4)
+        self.wait_until_we_have_enough_granules(dataset_id, 50)
+        granule = DataRetrieverService.retrieve_oob(dataset_id, query={'start_time':40, 'end_time':49})
+        rdt = RecordDictionaryTool.load_from_granule(granule)
+        self.assertTrue((rdt['time'] == np.arange(40, 50)).all())
+
     @attr('LOCOINT')
     @unittest.skipIf(os.getenv('CEI_LAUNCH_TEST', False), 'Host requires file-system access to coverage files, CEI mode does not support.')
     def test_retrieve_cache(self):
-        DataRetrieverService._refresh_interval = 1
         datasets = [self.make_simple_dataset() for i in xrange(10)]
         for stream_id, route, stream_def_id, dataset_id in datasets:
             coverage = DatasetManagementService._get_simplex_coverage(dataset_id, mode='a')
@@ -623,24 +630,24 @@ class TestDMEnd2End(IonIntegrationTestCase):
             coverage.set_parameter_values('time', np.arange(10))
             coverage.set_parameter_values('temp', np.arange(10))
 
-        # Verify cache hit and refresh
+        # Verify cache miss then hit
         dataset_ids = [i[3] for i in datasets]
         self.assertTrue(dataset_ids[0] not in DataRetrieverService._retrieve_cache)
-        DataRetrieverService._get_coverage(dataset_ids[0]) # Hit the chache
-        cov, age = DataRetrieverService._retrieve_cache[dataset_ids[0]]
-        # Verify that it was hit and it's now in there
+        stats = DataRetrieverService.get_cache_stats()
+        cov = DataRetrieverService._get_coverage(dataset_ids[0]) # Miss the cache
+        # Verify that it was loaded and it's now in there
         self.assertTrue(dataset_ids[0] in DataRetrieverService._retrieve_cache)
+        self.assertEquals(DataRetrieverService.get_cache_stats()['misses'], stats['misses'] + 1)
 
-        gevent.sleep(DataRetrieverService._refresh_interval + 0.2)
-
-        DataRetrieverService._get_coverage(dataset_ids[0]) # Hit the chache
-        cov, age2 = DataRetrieverService._retrieve_cache[dataset_ids[0]]
-        self.assertTrue(age2 != age)
+        cov2 = DataRetrieverService._get_coverage(dataset_ids[0]) # Hit the cache
+        self.assertTrue(cov is cov2)
+        self.assertEquals(DataRetrieverService.get_cache_stats()['hits'], stats['hits'] + 1)
 
         for dataset_id in dataset_ids:
             DataRetrieverService._get_coverage(dataset_id)
         
         self.assertTrue(dataset_ids[0] not in DataRetrieverService._retrieve_cache)
+        self.assertTrue(DataRetrieverService.get_cache_stats()['evictions'] > stats['evictions'])
 
         stream_id, route, stream_def, dataset_id = datasets[0]
         self.start_ingestion(stream_id, dataset_id)
@@ -648,7 +655,6 @@ class TestDMEnd2End(IonIntegrationTestCase):
         
         self.assertTrue(dataset_id in DataRetrieverService._retrieve_cache)
 
-        DataRetrieverService._refresh_interval = 100
         self.publish_hifi(stream_id,route,1)
         self.wait_until_we_have_enough_granules(dataset_id, data_size=20)
             
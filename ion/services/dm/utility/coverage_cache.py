@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/coverage_cache.py
+@description Bounded cache of read-mode coverages
+'''
+
+from pyon.util.log import log
+
+from contextlib import contextmanager
+from gevent.coros import RLock
+
+import collections
+import numpy as np
+import time
+
+class CoverageCacheEntry(object):
+    __slots__ = ['dataset_id', 'coverage', 'size', 'handles', 'hits', 'pins', 'evicted', 'opened']
+
+    def __init__(self, dataset_id, coverage, size, handles):
+        self.dataset_id = dataset_id
+        self.coverage   = coverage
+        self.size       = size
+        self.handles    = handles
+        self.hits       = 0
+        self.pins       = 0
+        self.evicted    = False
+        self.opened     = time.time()
+
+
+class CoverageCache(object):
+    '''
+    A cache of coverages opened in read mode, bounded by the number of coverages, an estimate of
+    the memory they hold and an estimate of the number of file handles they keep open.
+
+    Entries are evicted least recently used first ('lru') or least frequently used first
+    ('lfu', ties broken by recency). Coverages are never closed while they are checked out, an
+    entry evicted during a checkout is closed when the last checkout is released.
+
+    Callers invalidate a dataset when it changes. As a fallback for callers that don't see the
+    changes, an entry older than max_age is reopened on its next access.
+    '''
+    LRU = 'lru'
+    LFU = 'lfu'
+
+    def __init__(self, opener, max_entries=5, max_bytes=None, max_handles=None, policy=LRU, max_age=None):
+        '''
+        @param opener      Callable taking a dataset_id and returning a coverage
+        @param max_entries Maximum number of coverages held open
+        @param max_bytes   Maximum estimated memory held by the coverages, None for no limit
+        @param max_handles Maximum estimated file handles held by the coverages, None for no limit
+        @param policy      Eviction policy, 'lru' or 'lfu'
+        @param max_age     Seconds after which a coverage is reopened, None for no limit
+        '''
+        if policy not in (self.LRU, self.LFU):
+            raise ValueError('Unknown eviction policy: %s' % policy)
+        self.opener      = opener
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.max_handles = max_handles
+        self.policy      = policy
+        self.max_age     = max_age
+
+        self._entries = collections.OrderedDict()
+        self._lock    = RLock()
+        self._bytes   = 0
+        self._handles = 0
+
+        self.hits          = 0
+        self.misses        = 0
+        self.evictions     = 0
+        self.invalidations = 0
+        self.expirations   = 0
+
+    def __contains__(self, dataset_id):
+        return dataset_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @contextmanager
+    def checkout(self, dataset_id):
+        '''
+        Context manager yielding the coverage for the dataset, the coverage
+        is not closed by the cache until the context exits.
+        '''
+        entry = self._acquire(dataset_id)
+        try:
+            yield entry.coverage if entry is not None else None
+        finally:
+            if entry is not None:
+                self._release(entry)
+
+    def get(self, dataset_id):
+        '''
+        Returns the coverage for the dataset without pinning it, the coverage
+        may be closed by a later eviction.
+        '''
+        entry = self._acquire(dataset_id)
+        if entry is None:
+            return None
+        self._release(entry)
+        return entry.coverage
+
+    def invalidate(self, dataset_id):
+        '''
+        Drops the dataset's coverage, the next access reopens it.
+        '''
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return False
+            self.invalidations += 1
+            self._evict(entry)
+            return True
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                self._evict(entry)
+
+    def stats(self):
+        return {'hits'          : self.hits,
+                'misses'        : self.misses,
+                'evictions'     : self.evictions,
+                'invalidations' : self.invalidations,
+                'expirations'   : self.expirations,
+                'entries'       : len(self._entries),
+                'bytes'         : self._bytes,
+                'handles'       : self._handles}
+
+    def _acquire(self, dataset_id):
+        with self._lock:
+            entry = self._entries.pop(dataset_id, None)
+            if entry is not None and self.max_age is not None and (time.time() - entry.opened) > self.max_age:
+                self.expirations += 1
+                self._evict(entry)
+                entry = None
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                coverage = self.opener(dataset_id)
+                if coverage is None:
+                    return None
+                entry = CoverageCacheEntry(dataset_id, coverage, self.estimate_size(coverage), self.estimate_handles(coverage))
+                self._bytes += entry.size
+                self._handles += entry.handles
+            entry.hits += 1
+            entry.pins += 1
+            self._entries[dataset_id] = entry # Most recently used at the end
+            self._enforce_budget(keep=entry)
+            return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry.pins -= 1
+            if entry.evicted and entry.pins <= 0:
+                self._close(entry)
+
+    def _over_budget(self):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+        if self.max_handles is not None and self._handles > self.max_handles:
+            return True
+        return False
+
+    def _enforce_budget(self, keep=None):
+        while self._over_budget():
+            victim = self._victim(keep)
+            if victim is None:
+                break
+            self.evictions += 1
+            self._evict(victim)
+
+    def _victim(self, keep=None):
+        candidates = [e for e in self._entries.itervalues() if e is not keep]
+        if not candidates:
+            return None
+        if self.policy == self.LFU:
+            # min() returns the first (least recent) of equally used entries
+            return min(candidates, key=lambda e: e.hits)
+        return candidates[0]
+
+    def _evict(self, entry):
+        self._entries.pop(entry.dataset_id, None)
+        self._bytes -= entry.size
+        self._handles -= entry.handles
+        entry.evicted = True
+        if entry.pins <= 0:
+            self._close(entry)
+
+    def _close(self, entry):
+        if entry.coverage is None:
+            return
+        try:
+            entry.coverage.close(timeout=5)
+        except:
+            log.exception('Problems closing the coverage for dataset %s', entry.dataset_id)
+        entry.coverage = None
+
+    @classmethod
+    def estimate_size(cls, coverage):
+        '''
+        Rough estimate of the bytes a coverage can hold in memory: one value of
+        each parameter's encoding per timestep.
+        '''
+        size = 0
+        for name in coverage.list_parameters():
+            try:
+                itemsize = np.dtype(coverage.get_parameter_context(name).param_type.value_encoding).itemsize
+            except (AttributeError, TypeError):
+                itemsize = 8
+            size += itemsize * coverage.num_timesteps
+        return size
+
+    @classmethod
+    def estimate_handles(cls, coverage):
+        '''
+        Rough estimate of the file handles a coverage keeps open: the master
+        file and one file per parameter.
+        '''
+        return len(coverage.list_parameters()) + 1
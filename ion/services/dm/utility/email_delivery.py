@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/email_delivery.py
+@description Pooled, asynchronous delivery of notification emails
+'''
+
+from pyon.public import CFG
+from pyon.util.log import log
+from ion.services.dm.utility.uns_utility_methods import setting_up_smtp_client, send_events_email
+
+from gevent.queue import Queue, Full
+import gevent
+import time
+
+
+class EmailDelivery(object):
+    '''
+    Delivers notification emails off the event callback.
+
+    deliver() queues an event for a recipient and returns immediately. Events for
+    a recipient arriving within coalesce_window seconds of the first one are sent
+    as a single message. Queued recipients are served by pool_size sender greenlets,
+    each holding a persistent SMTP connection that is only re-established when a
+    send fails.
+
+    At most queue_size recipients wait for delivery. When the queue is full deliver()
+    waits up to put_timeout seconds (backpressure) and then drops the events; the
+    counters returned by stats() record what was queued, coalesced, sent, dropped
+    and failed.
+
+    The SMTP clients come from client_factory, setting_up_smtp_client by default,
+    which returns the fake SMTP client unless system.smtp is set.
+    '''
+    def __init__(self, rr_client, pool_size=None, queue_size=None, coalesce_window=None, put_timeout=None, client_factory=None):
+        self.rr_client       = rr_client
+        self.pool_size       = pool_size if pool_size is not None else CFG.get_safe('service.user_notification.smtp_pool_size', 4)
+        self.queue_size      = queue_size if queue_size is not None else CFG.get_safe('service.user_notification.delivery_queue_size', 1000)
+        self.coalesce_window = coalesce_window if coalesce_window is not None else CFG.get_safe('service.user_notification.coalesce_window', 1.)
+        self.put_timeout     = put_timeout if put_timeout is not None else CFG.get_safe('service.user_notification.put_timeout', 0.)
+        self.client_factory  = client_factory or setting_up_smtp_client
+
+        self._queue   = Queue(maxsize=self.queue_size)
+        self._pending = {}
+        self._senders = []
+        self.clients  = []
+        self.metrics  = dict(queued=0, coalesced=0, sent=0, messages=0, dropped=0, failed=0, max_depth=0)
+
+    def start(self):
+        for i in xrange(self.pool_size):
+            self._senders.append(gevent.spawn(self._send_loop))
+
+    def stop(self, timeout=10):
+        '''
+        Waits up to timeout seconds for the queued emails to be sent, then stops the senders
+        '''
+        deadline = time.time() + timeout
+        while (self._queue.qsize() or self._pending) and time.time() < deadline:
+            gevent.sleep(0.1)
+        gevent.killall(self._senders, timeout=timeout)
+        self._senders = []
+        for client in self.clients:
+            try:
+                client.quit()
+            except Exception:
+                log.debug('Failed to close SMTP connection', exc_info=True)
+        self.clients = []
+
+    def deliver(self, event, msg_recipient):
+        '''
+        Queues an event for msg_recipient, returns False if it was dropped
+        '''
+        batch = self._pending.get(msg_recipient)
+        if batch is not None:
+            batch.append(event)
+            self.metrics['coalesced'] += 1
+            return True
+
+        batch = [event]
+        self._pending[msg_recipient] = batch
+        try:
+            item = (msg_recipient, time.time() + self.coalesce_window)
+            if self.put_timeout:
+                self._queue.put(item, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except Full:
+            del self._pending[msg_recipient]
+            self.metrics['dropped'] += len(batch)
+            log.warning('Email delivery queue is full, dropped %s event(s) for %s', len(batch), msg_recipient)
+            return False
+        self.metrics['queued'] += 1
+        self.metrics['max_depth'] = max(self.metrics['max_depth'], self._queue.qsize())
+        return True
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['depth'] = self._queue.qsize()
+        return stats
+
+    def _send_loop(self):
+        client = None
+        while True:
+            msg_recipient, due = self._queue.get()
+            delay = due - time.time()
+            if delay > 0:
+                gevent.sleep(delay)
+            events = self._pending.pop(msg_recipient, [])
+            if not events:
+                continue
+            try:
+                client = self._send(client, msg_recipient, events)
+            except Exception:
+                client = None
+                self.metrics['failed'] += len(events)
+                log.exception('Failed to send notification email to %s', msg_recipient)
+
+    def _connect(self, client=None):
+        if client in self.clients:
+            self.clients.remove(client)
+        client = self.client_factory()
+        self.clients.append(client)
+        return client
+
+    def _send(self, client, msg_recipient, events):
+        if client is None:
+            client = self._connect()
+        reconnected = []
+        def reconnect():
+            reconnected.append(self._connect(client))
+            return reconnected[-1]
+        try:
+            client = send_events_email(events, msg_recipient, client, self.rr_client, reconnect)
+        except Exception:
+            # the replacement connection failed as well
+            for failed in reconnected:
+                self.clients.remove(failed)
+            raise
+        self.metrics['messages'] += 1
+        self.metrics['sent'] += len(events)
+        return client
@@ -14,7 +14,8 @@ from pyon.core.object import IonObjectSerializer
 from pyon.core.interceptor.encode import encode_ion
 from pyon.util.arg_check import validate_equal
 from pyon.util.log import log
-from pyon.util.memoize import memoize_lru
+from pyon.ion.event import EventSubscriber
+from pyon.public import OT, RT
 
 from ion.util.stored_values import StoredValueManager
 
@@ -26,10 +27,53 @@ from coverage_model.parameter_functions import ParameterFunctionException
 from coverage_model.parameter_values import AbstractParameterValue, ConstantValue
 from coverage_model.parameter_types import ParameterFunctionType
 
+import collections
 import numpy as np
 import msgpack
 import time
 
+class ParameterMetadata(object):
+    '''
+    Lookups derived from a parameter dictionary that the record dictionary needs for
+    every granule it decodes or encodes: ordinals and parameter types by name, and the
+    parameters whose values can be wrapped without copying.
+    '''
+    def __init__(self, pdict):
+        self.key_from_ord = {}
+        self.ord_from_key = {}
+        self.param_types  = {}
+        self.zero_copy    = set()
+        for key in pdict.keys():
+            ordinal = pdict.ord_from_key(key)
+            ptype = pdict.get_context(key).param_type
+            self.key_from_ord[ordinal] = key
+            self.ord_from_key[key] = ordinal
+            self.param_types[key] = ptype
+            if type(ptype) is QuantityType:
+                self.zero_copy.add(key)
+
+
+class DecodedStreamDefinition(object):
+    '''
+    A stream definition with its parameter dictionary decoded and the field lists and
+    parameter metadata precomputed. Instances are shared by every record dictionary
+    built from the same stream definition and must not be modified.
+    '''
+    def __init__(self, stream_definition):
+        self.stream_definition    = stream_definition
+        self.revision             = getattr(stream_definition, '_rev', None)
+        self.pdict                = ParameterDictionary.load(stream_definition.parameter_dictionary)
+        self.available_fields     = stream_definition.available_fields or None
+        self.stream_configuration = stream_definition.stream_configuration
+        keys = self.pdict.keys()
+        if self.available_fields is not None:
+            self.fields = list(set(self.available_fields).intersection(keys))
+        else:
+            self.fields = keys
+        self.field_set = frozenset(self.fields)
+        self.metadata  = ParameterMetadata(self.pdict)
+
+
 class RecordDictionaryTool(object):
     """
     A record dictionary is a key/value store which contains records for a particular dataset. The keys are specified by
@@ -58,9 +102,21 @@ class RecordDictionaryTool(object):
     _creation_timestamp = None
     _stream_config      = {}
     _definition         = None
+    _metadata           = None
+    _fields             = None
+    _field_set          = None
     connection_id       = ''
     connection_index    = ''
 
+    #--------------------------------------------------------------------------------
+    # Process-wide cache of decoded stream definitions
+    # - Keyed by stream definition id, revalidated against the revision when known
+    # - Invalidated by ResourceModifiedEvents for stream definitions
+    #--------------------------------------------------------------------------------
+    _decoded_cache        = collections.OrderedDict()
+    _decoded_cache_limit  = 100
+    _decoded_subscriber   = None
+
 
     def __init__(self,param_dictionary=None, stream_definition_id='', locator=None, stream_definition=None):
         """
@@ -77,11 +133,13 @@ class RecordDictionaryTool(object):
                     raise BadRequest('Improper StreamDefinition object')
                 self._definition = stream_definition
 
-            stream_def_obj = stream_definition or RecordDictionaryTool.read_stream_def(stream_definition_id)
-            pdict = stream_def_obj.parameter_dictionary
-            self._available_fields = stream_def_obj.available_fields or None
-            self._stream_config = stream_def_obj.stream_configuration
-            self._pdict = ParameterDictionary.load(pdict)
+            decoded = RecordDictionaryTool.decode_stream_def(stream_definition_id, stream_definition)
+            self._available_fields = decoded.available_fields
+            self._stream_config = decoded.stream_configuration
+            self._pdict = decoded.pdict
+            self._fields = decoded.fields
+            self._field_set = decoded.field_set
+            self._metadata = decoded.metadata
             self._stream_def = stream_definition_id
 
         else:
@@ -101,7 +159,11 @@ class RecordDictionaryTool(object):
         return retval[slice_]
 
     @classmethod
-    def get_paramval(cls, ptype, domain, values):
+    def get_paramval(cls, ptype, domain, values, copy=True):
+        '''
+        Builds the parameter value for values. With copy=False numeric values whose
+        encoding and shape already match are wrapped read-only instead of copied.
+        '''
         paramval = get_value_class(ptype, domain_set=domain)
         if isinstance(ptype,ParameterFunctionType):
             paramval.memoized_values = values
@@ -109,39 +171,74 @@ class RecordDictionaryTool(object):
             values = np.atleast_1d(values)
             spans = cls.spanify(values)
             paramval.storage._storage = np.array([spans],dtype='object')
+        elif not copy and type(ptype) is QuantityType and isinstance(values, np.ndarray) \
+                and values.dtype == paramval.storage._storage.dtype and values.shape == paramval.storage._storage.shape:
+            paramval.storage._storage = values.view()
         else:
             paramval[:] = values
         paramval.storage._storage.flags.writeable = False
         return paramval
 
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = ParameterMetadata(self._pdict)
+        return self._metadata
+
     def lookup_values(self):
         return [i for i in self._lookup_values() if not self.context(i).document_key]
 
     def _lookup_values(self):
         lookup_values = []
-        for field in self.fields:
+        for field in self._get_fields():
             if hasattr(self.context(field), 'lookup_value'):
                 lookup_values.append(field)
         return lookup_values
     
     @classmethod
     def spanify(cls,arr):
+        '''
+        Run-length encodes arr into the Spans of a sparse constant value,
+        a new Span starts wherever a value differs from its predecessor.
+        '''
+        arr = np.asanyarray(arr)
+        if not len(arr):
+            return []
+        starts = np.concatenate(([0], np.flatnonzero(cls._value_changes(arr)) + 1))
         spans = []
-        lastval = None
-        for i,val in enumerate(arr):
+        for i in starts.tolist():
             if i == 0:
-                span = Span(None,None,0,val)
-                spans.append(span)
-                lastval = val
-                continue
-            if np.atleast_1d(lastval == val).all():
-                continue
-            spans[-1].upper_bound = i
-            span = Span(i,None,-i,val)
+                span = Span(None,None,0,arr[0])
+            else:
+                spans[-1].upper_bound = i
+                span = Span(i,None,-i,arr[i])
             spans.append(span)
-            lastval = val
         return spans
 
+    @classmethod
+    def _value_changes(cls, arr):
+        '''
+        Boolean array, True at i if arr[i+1] differs from arr[i]
+        '''
+        n = len(arr)
+        try:
+            changes = np.asanyarray(arr[1:] != arr[:-1])
+            if changes.dtype == np.bool_ and changes.shape[:1] == (n-1,):
+                if changes.ndim > 1: # Records of arrays differ if any element differs
+                    changes = changes.reshape(n-1, -1).any(axis=1)
+                return changes
+        except (TypeError, ValueError):
+            pass
+        # Objects that don't compare element-wise (e.g. arrays stored in object arrays)
+        return np.array([cls._differ(arr[i], arr[i+1]) for i in xrange(n-1)], dtype=np.bool_)
+
+    @classmethod
+    def _differ(cls, a, b):
+        try:
+            return not np.atleast_1d(a == b).all()
+        except ValueError: # Arrays of different shapes
+            return True
+
 
     def fetch_lookup_values(self):
         doc_keys = []
@@ -173,7 +270,11 @@ class RecordDictionaryTool(object):
                     self[lv] = [doc[context.lookup_value]] * self._shp[0] if self._shp else doc[context.lookup_value]
 
     @classmethod
-    def load_from_granule(cls, g):
+    def load_from_granule(cls, g, copy=False):
+        '''
+        Builds a record dictionary from a granule. Unless copy is set, numeric
+        values wrap the granule's buffers read-only instead of copying them.
+        '''
         if g.stream_definition_id:
             instance = cls(stream_definition_id=g.stream_definition_id, locator=g.locator)
         elif g.stream_definition:
@@ -188,11 +289,12 @@ class RecordDictionaryTool(object):
         if g.creation_timestamp:
             instance._creation_timestamp = g.creation_timestamp
 
+        metadata = instance.metadata
+        domain = instance.domain
         for k,v in g.record_dictionary.iteritems():
-            key = instance._pdict.key_from_ord(k)
+            key = metadata.key_from_ord[k]
             if v is not None:
-                ptype = instance._pdict.get_context(key).param_type
-                paramval = cls.get_paramval(ptype, instance.domain, v)
+                paramval = cls.get_paramval(metadata.param_types[key], domain, v, copy=copy)
                 instance._rd[key] = paramval
         
         instance.connection_id = g.connection_id
@@ -200,15 +302,80 @@ class RecordDictionaryTool(object):
 
         return instance
 
+    @classmethod
+    def concatenate(cls, rdts):
+        '''
+        Joins a sequence of record dictionaries that share a parameter dictionary into a single
+        record dictionary, preserving the order of the records. Fields that are missing from some
+        of the record dictionaries are padded with the field's fill value. Constant fields take
+        the value of the last record dictionary.
+        '''
+        rdts = [rdt for rdt in rdts if len(rdt)]
+        if not rdts:
+            return None
+        if len(rdts) == 1:
+            return rdts[0]
+
+        first = rdts[0]
+        instance = cls(param_dictionary=first._pdict, locator=first._locator)
+        instance._stream_def         = first._stream_def
+        instance._definition         = first._definition
+        instance._available_fields   = first._available_fields
+        instance._stream_config      = first._stream_config
+        instance._creation_timestamp = first._creation_timestamp
+        instance.connection_id       = rdts[-1].connection_id
+        instance.connection_index    = rdts[-1].connection_index
+        instance._shp = (sum(len(rdt) for rdt in rdts),)
+
+        for field in instance.fields:
+            if all(rdt._rd[field] is None for rdt in rdts):
+                continue
+            ptype = instance._pdict.get_context(field).param_type
+            if isinstance(ptype, (ConstantType, ConstantRangeType)):
+                paramval = [rdt._rd[field] for rdt in rdts if rdt._rd[field] is not None][-1]
+                paramval.domain_set = instance.domain
+                instance._rd[field] = paramval
+                continue
+
+            values = [rdt[field] for rdt in rdts]
+            reference = np.asanyarray([v for v in values if v is not None][0])
+            for i, rdt in enumerate(rdts):
+                if values[i] is None:
+                    padding = np.empty((len(rdt),) + reference.shape[1:], dtype=reference.dtype)
+                    padding.fill(instance.fill_value(field))
+                    values[i] = padding
+            instance._set(field, np.concatenate([np.atleast_1d(v) for v in values]))
+
+        return instance
+
+    def empty_copy(self):
+        '''
+        Returns an empty record dictionary sharing the parameter dictionary and stream definition
+        of this one, without decoding the stream definition again.
+        '''
+        instance = self.__class__(param_dictionary=self._pdict, locator=self._locator)
+        instance._stream_def       = self._stream_def
+        instance._definition       = self._definition
+        instance._available_fields = self._available_fields
+        instance._stream_config    = self._stream_config
+        instance._fields           = self._fields
+        instance._field_set        = self._field_set
+        instance._metadata         = self._metadata
+        return instance
+
     def to_granule(self, data_producer_id='',provider_metadata_update={}, connection_id='', connection_index=''):
         granule = Granule()
         granule.record_dictionary = {}
         
+        metadata = self.metadata
         for key,val in self._rd.iteritems():
-            if val is not None:
-                granule.record_dictionary[self._pdict.ord_from_key(key)] = self[key]
+            if val is None or not self._shp:
+                granule.record_dictionary[metadata.ord_from_key[key]] = None
+            elif key in metadata.zero_copy:
+                # Numeric storage is already the dense array, serialize it as is
+                granule.record_dictionary[metadata.ord_from_key[key]] = val.storage._storage
             else:
-                granule.record_dictionary[self._pdict.ord_from_key(key)] = None
+                granule.record_dictionary[metadata.ord_from_key[key]] = self[key]
         
         granule.param_dictionary = {} if self._stream_def else self._pdict.dump()
         if self._definition:
@@ -232,9 +399,21 @@ class RecordDictionaryTool(object):
 
     @property
     def fields(self):
-        if self._available_fields is not None:
-            return list(set(self._available_fields).intersection(self._pdict.keys()))
-        return self._pdict.keys()
+        return list(self._get_fields())
+
+    def _get_fields(self):
+        if self._fields is None:
+            if self._available_fields is not None:
+                self._fields = list(set(self._available_fields).intersection(self._pdict.keys()))
+            else:
+                self._fields = self._pdict.keys()
+            self._field_set = frozenset(self._fields)
+        return self._fields
+
+    def _has_field(self, name):
+        if self._field_set is None:
+            self._get_fields()
+        return name in self._field_set
 
     @property
     def domain(self):
@@ -275,7 +454,7 @@ class RecordDictionaryTool(object):
         """
         Set a parameter
         """
-        if name not in self.fields:
+        if not self._has_field(name):
             raise KeyError(name)
 
         if vals is None:
@@ -313,17 +492,17 @@ class RecordDictionaryTool(object):
         self._rd[name] = paramval
 
     def param_type(self, name):
-        if name in self.fields:
+        if self._has_field(name):
             return self._pdict.get_context(name).param_type
         raise KeyError(name)
 
     def context(self, name):
-        if name in self.fields:
+        if self._has_field(name):
             return self._pdict.get_context(name)
         raise KeyError(name)
 
     def _reshape_const(self):
-        for k in self.fields:
+        for k in self._get_fields():
             if isinstance(self._rd[k], ConstantValue):
                 self._rd[k].domain_set = self.domain
 
@@ -333,7 +512,7 @@ class RecordDictionaryTool(object):
         """
         if not self._shp:
             return None
-        if self._available_fields and name not in self._available_fields:
+        if self._available_fields and not self._has_field(name):
             raise KeyError(name)
         ptype = self._pdict.get_context(name).param_type
         if isinstance(ptype, ParameterFunctionType):
@@ -352,7 +531,7 @@ class RecordDictionaryTool(object):
     def iteritems(self):
         """ D.iteritems() -> an iterator over the (key, value) items of D """
         for k,v in self._rd.iteritems():
-            if self._available_fields and k not in self._available_fields:
+            if self._available_fields and not self._has_field(k):
                 continue
             if v is not None:
                 yield k,v
@@ -439,10 +618,47 @@ class RecordDictionaryTool(object):
 
     
     @staticmethod
-    @memoize_lru(maxsize=100)
     def read_stream_def(stream_def_id):
-        pubsub_cli = PubsubManagementServiceClient()
-        stream_def_obj = pubsub_cli.read_stream_definition(stream_def_id)
-        return stream_def_obj
+        return RecordDictionaryTool.decode_stream_def(stream_def_id).stream_definition
+
+    @classmethod
+    def decode_stream_def(cls, stream_def_id='', stream_definition=None):
+        '''
+        Memoization (LRU) of the decoded stream definition. A stream definition object
+        whose revision differs from the cached one replaces the cached entry.
+        '''
+        stream_def_id = stream_def_id or getattr(stream_definition, '_id', None)
+        if not stream_def_id:
+            return DecodedStreamDefinition(stream_definition)
+        cls._start_decoded_subscriber()
+        decoded = cls._decoded_cache.pop(stream_def_id, None)
+        if decoded is not None and stream_definition is not None and decoded.revision != getattr(stream_definition, '_rev', None):
+            decoded = None
+        if decoded is None:
+            if stream_definition is None:
+                pubsub_cli = PubsubManagementServiceClient()
+                stream_definition = pubsub_cli.read_stream_definition(stream_def_id)
+            decoded = DecodedStreamDefinition(stream_definition)
+            if len(cls._decoded_cache) >= cls._decoded_cache_limit:
+                cls._decoded_cache.popitem(0)
+        cls._decoded_cache[stream_def_id] = decoded
+        return decoded
+
+    @classmethod
+    def invalidate_stream_def(cls, stream_def_id):
+        cls._decoded_cache.pop(stream_def_id, None)
+
+    @classmethod
+    def _start_decoded_subscriber(cls):
+        '''
+        Listens for stream definition updates once a container is available
+        '''
+        if cls._decoded_subscriber is not None or Container.instance is None:
+            return
+        cls._decoded_subscriber = EventSubscriber(event_type=OT.ResourceModifiedEvent,
+                                                  origin_type=RT.StreamDefinition,
+                                                  callback=lambda event, *args, **kwargs: cls.invalidate_stream_def(event.origin),
+                                                  auto_delete=True)
+        cls._decoded_subscriber.start()
 
 
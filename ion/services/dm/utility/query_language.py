@@ -7,6 +7,10 @@
 '''
 from pyparsing import ParseException, Regex, quotedString, CaselessLiteral, MatchFirst, removeQuotes, Optional
 from pyon.core.exception import BadRequest
+from gevent.coros import RLock
+
+import collections
+import copy
 
 
 class QueryLanguage(object):
@@ -57,13 +61,39 @@ class QueryLanguage(object):
               <number>  ::= <integer> | <double>
               <double>  ::= 0-9 ('.' 0-9)
               <integer> ::= 0-9
-    '''
 
-    def __init__(self):
+    The grammar is built once per process and shared by every instance, parsed
+    query strings are kept in an LRU cache of up to cache_size entries.
+    '''
+    cache_size = 1024
 
+    _grammar = None
+    _lock    = RLock()
+    _cache   = collections.OrderedDict()
 
+    def __init__(self):
         self.json_query = {'query':{}, 'and': [], 'or': []}
         self.tokens = None
+
+    @classmethod
+    def grammar(cls):
+        '''
+        Returns the process-wide instance holding the compiled grammar
+        '''
+        if cls._grammar is None:
+            with cls._lock:
+                if cls._grammar is None:
+                    grammar = cls()
+                    grammar._build_grammar()
+                    cls._grammar = grammar
+        return cls._grammar
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._cache.clear()
+
+    def _build_grammar(self):
         #--------------------------------------------------------------------------------------
         # <integer> ::= 0-9
         # <double>  ::= 0-9 ('.' 0-9)
@@ -305,14 +335,28 @@ class QueryLanguage(object):
         '''
         Parses string s and returns a json_query object, self.tokens is set to the tokens
         '''
+        cls = type(self)
+        with cls._lock:
+            if s in cls._cache:
+                json_query, self.tokens = cls._cache.pop(s)
+            else:
+                json_query, self.tokens = cls.grammar()._parse(s)
+            cls._cache[s] = (json_query, self.tokens)
+            while len(cls._cache) > cls.cache_size:
+                cls._cache.popitem(last=False)
+
+        # Callers are free to modify their query
+        self.json_query = copy.deepcopy(json_query)
+        return self.json_query
+
+    def _parse(self, s):
         self.json_query = {'query':{}, 'and': [], 'or': []}
         self.frame = {}
         try:
-            self.tokens = self.sentence.parseString(s)
+            tokens = self.sentence.parseString(s)
         except ParseException as e:
             raise BadRequest('%s' % e)
-
-        return self.json_query
+        return self.json_query, tokens
 
     #=========================================
     # Methods for checking the requests
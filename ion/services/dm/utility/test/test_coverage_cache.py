@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_coverage_cache.py
+@brief Tests for the read-mode coverage cache
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.coverage_cache import CoverageCache
+from nose.plugins.attrib import attr
+from mock import Mock
+
+
+@attr('UNIT',group='dm')
+class CoverageCacheTest(PyonTestCase):
+    def setUp(self):
+        self.coverages = {}
+
+    def opener(self, dataset_id):
+        coverage = Mock()
+        coverage.num_timesteps = 10
+        coverage.list_parameters.return_value = ['time', 'temp']
+        coverage.get_parameter_context.return_value.param_type.value_encoding = 'float64'
+        self.coverages[dataset_id] = coverage
+        return coverage
+
+    def test_lru(self):
+        cache = CoverageCache(self.opener, max_entries=2)
+        cache.get('a')
+        cache.get('b')
+        cache.get('a') # b is now the least recently used
+        cache.get('c')
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+        self.coverages['b'].close.assert_called_once_with(timeout=5)
+
+        stats = cache.stats()
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 3)
+        self.assertEquals(stats['evictions'], 1)
+
+    def test_lfu(self):
+        cache = CoverageCache(self.opener, max_entries=2, policy=CoverageCache.LFU)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        cache.get('c')
+
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+
+    def test_budgets(self):
+        # Each coverage is estimated at 2 * 10 * 8 bytes and 3 handles
+        cache = CoverageCache(self.opener, max_entries=10, max_bytes=400)
+        for dataset_id in 'abc':
+            cache.get(dataset_id)
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.stats()['bytes'], 320)
+
+        cache = CoverageCache(self.opener, max_entries=10, max_handles=7)
+        for dataset_id in 'abc':
+            cache.get(dataset_id)
+        self.assertEquals(len(cache), 2)
+        self.assertEquals(cache.stats()['handles'], 6)
+
+    def test_invalidate_during_checkout(self):
+        cache = CoverageCache(self.opener)
+        with cache.checkout('a') as coverage:
+            self.assertTrue(cache.invalidate('a'))
+            self.assertFalse('a' in cache)
+            self.assertFalse(coverage.close.called)
+        coverage.close.assert_called_once_with(timeout=5)
+        self.assertEquals(cache.stats()['invalidations'], 1)
+
+        self.assertFalse(cache.invalidate('a'))
+        self.assertTrue(cache.get('a') is not coverage)
+
+    def test_max_age(self):
+        cache = CoverageCache(self.opener, max_age=10)
+        coverage = cache.get('a')
+        self.assertTrue(cache.get('a') is coverage)
+
+        cache._entries['a'].opened -= 11
+        with cache.checkout('a') as reopened:
+            self.assertTrue(reopened is not coverage)
+        coverage.close.assert_called_once_with(timeout=5)
+        self.assertEquals(cache.stats()['expirations'], 1)
+        self.assertEquals(len(cache), 1)
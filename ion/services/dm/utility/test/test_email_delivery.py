@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_email_delivery.py
+@brief Tests for the pooled notification email delivery
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import get_ion_ts
+from pyon.public import IonObject, OT
+from pyon.core.exception import NotFound
+from ion.services.dm.utility.email_delivery import EmailDelivery
+from ion.services.dm.utility.uns_utility_methods import fake_smtplib
+from nose.plugins.attrib import attr
+from mock import Mock
+
+import gevent
+
+
+@attr('UNIT', group='dm')
+class EmailDeliveryTest(PyonTestCase):
+    def setUp(self):
+        self.rr_client = Mock()
+        self.rr_client.read.side_effect = NotFound
+        self.clients = []
+
+    def client_factory(self):
+        client = fake_smtplib.SMTP('localhost')
+        self.clients.append(client)
+        return client
+
+    def event(self, origin):
+        return IonObject(OT.ResourceModifiedEvent, origin=origin, origin_type='InstrumentDevice', sub_type='UPDATE', ts_created=get_ion_ts())
+
+    def sent_mail(self):
+        mail = []
+        for client in self.clients:
+            while not client.sent_mail.empty():
+                mail.append(client.sent_mail.get())
+        return mail
+
+    def test_coalescing(self):
+        delivery = EmailDelivery(self.rr_client, pool_size=2, coalesce_window=0.2, client_factory=self.client_factory)
+        delivery.start()
+        self.addCleanup(delivery.stop, 0)
+
+        for i in xrange(3):
+            delivery.deliver(self.event('instrument_%s' % i), 'user_1@example.com')
+        delivery.deliver(self.event('instrument_0'), 'user_2@example.com')
+        gevent.sleep(0.5)
+
+        mail = self.sent_mail()
+        self.assertEquals(sorted(m[1] for m in mail), ['user_1@example.com', 'user_2@example.com'])
+        self.assertTrue('summary of 3 ION events' in [m for m in mail if m[1] == 'user_1@example.com'][0][2])
+
+        # Connections are reused
+        for i in xrange(4):
+            delivery.deliver(self.event('instrument_0'), 'user_%s@example.com' % i)
+        gevent.sleep(0.5)
+        self.assertEquals(len(self.sent_mail()), 4)
+        self.assertTrue(len(self.clients) <= 2)
+
+        stats = delivery.stats()
+        self.assertEquals(stats['queued'], 6)
+        self.assertEquals(stats['coalesced'], 2)
+        self.assertEquals(stats['messages'], 6)
+        self.assertEquals(stats['sent'], 8)
+        self.assertEquals(stats['depth'], 0)
+
+    def test_backpressure(self):
+        delivery = EmailDelivery(self.rr_client, pool_size=1, queue_size=2, coalesce_window=0, client_factory=self.client_factory)
+        # Not started, nothing drains the queue
+        self.assertTrue(delivery.deliver(self.event('instrument_0'), 'user_1@example.com'))
+        self.assertTrue(delivery.deliver(self.event('instrument_0'), 'user_2@example.com'))
+        self.assertFalse(delivery.deliver(self.event('instrument_0'), 'user_3@example.com'))
+        # Coalesced into a queued message
+        self.assertTrue(delivery.deliver(self.event('instrument_1'), 'user_1@example.com'))
+
+        stats = delivery.stats()
+        self.assertEquals(stats['dropped'], 1)
+        self.assertEquals(stats['max_depth'], 2)
+
+        delivery.start()
+        delivery.stop()
+        self.assertEquals(len(self.sent_mail()), 2)
+        self.assertEquals(delivery.stats()['sent'], 3)
+
+    def test_reconnect(self):
+        delivery = EmailDelivery(self.rr_client, pool_size=1, coalesce_window=0, client_factory=self.client_factory)
+        delivery.start()
+        self.addCleanup(delivery.stop, 0)
+
+        delivery.deliver(self.event('instrument_0'), 'user_1@example.com')
+        gevent.sleep(0.1)
+        self.clients[0].sendmail = Mock(side_effect=IOError('Connection lost'))
+        delivery.deliver(self.event('instrument_0'), 'user_2@example.com')
+        gevent.sleep(0.1)
+
+        self.assertEquals(len(self.clients), 2)
+        self.assertEquals(self.clients[1].sent_mail.get(timeout=1)[1], 'user_2@example.com')
+        self.assertEquals(delivery.stats()['failed'], 0)
@@ -8,6 +8,7 @@
 
 from pyon.ion.stream import StandaloneStreamPublisher, StandaloneStreamSubscriber
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 
 from ion.services.dm.inventory.dataset_management_service import DatasetManagementService
 from ion.services.dm.utility.granule import RecordDictionaryTool
@@ -15,15 +16,90 @@ from ion.services.dm.utility.test.parameter_helper import ParameterHelper
 
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceClient
 from interface.services.dm.idataset_management_service import DatasetManagementServiceClient
+from interface.objects import StreamDefinition
 
 from gevent.event import Event
 from nose.plugins.attrib import attr
-from coverage_model import ParameterContext, QuantityType, AxisTypeEnum, ConstantType, NumexprFunction, ParameterFunctionType, VariabilityEnum, PythonFunction
+from coverage_model import ParameterContext, ParameterDictionary, QuantityType, AxisTypeEnum, ConstantType, NumexprFunction, ParameterFunctionType, VariabilityEnum, PythonFunction
+from mock import patch
 
 from ion.util.stored_values import StoredValueManager
 
 import numpy as np
 
+@attr('UNIT',group='dm')
+class RecordDictionaryUnitTest(PyonTestCase):
+    def setUp(self):
+        RecordDictionaryTool._decoded_cache.clear()
+        patcher = patch.object(RecordDictionaryTool, '_start_decoded_subscriber')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(RecordDictionaryTool._decoded_cache.clear)
+
+    def create_stream_definition(self, rev='1'):
+        pdict = ParameterDictionary()
+        t_ctxt = ParameterContext('time', param_type=QuantityType(value_encoding=np.dtype('float64')))
+        pdict.add_context(t_ctxt, is_temporal=True)
+        pdict.add_context(ParameterContext('temp', param_type=QuantityType(value_encoding=np.dtype('float32')), fill_value=-9999))
+        pdict.add_context(ParameterContext('pressure', param_type=QuantityType(value_encoding=np.dtype('float32')), fill_value=-9999))
+        stream_def = StreamDefinition(parameter_dictionary=pdict.dump(), available_fields=['time','temp'])
+        stream_def._id = 'stream_def_id'
+        stream_def._rev = rev
+        return stream_def
+
+    @patch('ion.services.dm.utility.granule.record_dictionary.PubsubManagementServiceClient')
+    def test_decoded_stream_def_cache(self, pubsub_cli):
+        pubsub_cli.return_value.read_stream_definition.return_value = self.create_stream_definition()
+
+        rdt = RecordDictionaryTool(stream_definition_id='stream_def_id')
+        rdt2 = RecordDictionaryTool(stream_definition_id='stream_def_id')
+        self.assertEquals(pubsub_cli.return_value.read_stream_definition.call_count, 1)
+        self.assertTrue(rdt._pdict is rdt2._pdict)
+        self.assertEquals(set(rdt.fields), set(['time','temp']))
+        with self.assertRaises(KeyError):
+            rdt['pressure'] = [1]
+
+        # A newer revision of the stream definition replaces the cached one
+        rdt3 = RecordDictionaryTool(stream_definition=self.create_stream_definition(rev='2'))
+        self.assertFalse(rdt3._pdict is rdt._pdict)
+
+        RecordDictionaryTool.invalidate_stream_def('stream_def_id')
+        rdt4 = RecordDictionaryTool(stream_definition_id='stream_def_id')
+        self.assertEquals(pubsub_cli.return_value.read_stream_definition.call_count, 2)
+        self.assertFalse(rdt4._pdict is rdt3._pdict)
+
+    def test_empty_copy(self):
+        rdt = RecordDictionaryTool(stream_definition=self.create_stream_definition())
+        rdt['time'] = np.arange(3)
+        copy = rdt.empty_copy()
+        self.assertTrue(copy._pdict is rdt._pdict)
+        self.assertEquals(set(copy.fields), set(['time','temp']))
+        self.assertEquals(len(copy), 0)
+        self.assertEquals(copy._stream_def, rdt._stream_def)
+        with self.assertRaises(KeyError):
+            copy['pressure'] = [1]
+        copy['temp'] = np.arange(5)
+        self.assertEquals(len(rdt), 3)
+
+    def test_spanify(self):
+        def bounds(arr):
+            return [(s.lower_bound, s.upper_bound, s.offset, s.value) for s in RecordDictionaryTool.spanify(arr)]
+
+        self.assertEquals(bounds(np.array([1,1,2,2,2,3])), [(None,2,0,1), (2,5,-2,2), (5,None,-5,3)])
+        self.assertEquals(bounds(np.array(['a','a','b'])), [(None,2,0,'a'), (2,None,-2,'b')])
+        self.assertEquals(bounds(np.array([7])), [(None,None,0,7)])
+        self.assertEquals(bounds(np.array([])), [])
+
+        arr = np.empty(3, dtype=object)
+        arr[:] = [np.arange(3), np.arange(3), np.arange(4)]
+        spans = RecordDictionaryTool.spanify(arr)
+        self.assertEquals([(s.lower_bound, s.upper_bound) for s in spans], [(None,2), (2,None)])
+        np.testing.assert_array_equal(spans[1].value, np.arange(4))
+
+        spans = RecordDictionaryTool.spanify(np.array([[1,2],[1,2],[1,3]]))
+        self.assertEquals([(s.lower_bound, s.upper_bound) for s in spans], [(None,2), (2,None)])
+
+
 @attr('INT',group='dm')
 class RecordDictionaryIntegrationTest(IonIntegrationTestCase):
     def setUp(self):
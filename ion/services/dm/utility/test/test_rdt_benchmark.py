@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_rdt_benchmark.py
+@brief Microbenchmarks for the record dictionary decode, encode and run-length encoding paths
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.log import log
+from ion.services.dm.utility.granule import RecordDictionaryTool
+from ion.util.test.benchmark_helper import best_of
+from coverage_model import ParameterDictionary, ParameterContext, QuantityType
+from nose.plugins.attrib import attr
+
+import numpy as np
+
+
+@attr('UTIL', group='dm')
+class RecordDictionaryBenchmark(PyonTestCase):
+    fields  = 20
+    records = 100000
+
+    def create_rdt(self):
+        pdict = ParameterDictionary()
+        t_ctxt = ParameterContext('time', param_type=QuantityType(value_encoding=np.dtype('float64')))
+        t_ctxt.uom = 'seconds since 1900-01-01'
+        pdict.add_context(t_ctxt, is_temporal=True)
+        for i in xrange(self.fields):
+            pdict.add_context(ParameterContext('field_%s' % i, param_type=QuantityType(value_encoding=np.dtype('float32')), fill_value=-9999))
+
+        rdt = RecordDictionaryTool(param_dictionary=pdict)
+        rdt['time'] = np.arange(self.records, dtype='float64')
+        for i in xrange(self.fields):
+            rdt['field_%s' % i] = np.random.random(self.records).astype('float32')
+        return rdt
+
+    def test_load_from_granule(self):
+        rdt = self.create_rdt()
+        granule = rdt.to_granule()
+
+        copied = best_of(lambda : RecordDictionaryTool.load_from_granule(granule, copy=True), repeat=5, number=20)
+        wrapped = best_of(lambda : RecordDictionaryTool.load_from_granule(granule), repeat=5, number=20)
+        log.info('load_from_granule (%s fields x %s records): copy %.6fs, zero-copy %.6fs (%.1fx)', self.fields + 1, self.records, copied, wrapped, copied / wrapped)
+
+        rdt2 = RecordDictionaryTool.load_from_granule(granule)
+        for key in rdt.fields:
+            np.testing.assert_array_equal(rdt[key], rdt2[key])
+        with self.assertRaises(ValueError):
+            rdt2._rd['time'].storage._storage[0] = 1
+
+    def test_to_granule(self):
+        rdt = RecordDictionaryTool.load_from_granule(self.create_rdt().to_granule())
+
+        elapsed = best_of(lambda : rdt.to_granule(), repeat=5, number=20)
+        log.info('to_granule (%s fields x %s records): %.6fs', self.fields + 1, self.records, elapsed)
+
+
+@attr('UTIL', group='dm')
+class SpanifyBenchmark(PyonTestCase):
+    @staticmethod
+    def per_element(arr):
+        '''
+        Baseline: compares each element with the start of the current span in Python
+        '''
+        spans = []
+        start = 0
+        for i in xrange(1, len(arr)):
+            if np.any(arr[i] != arr[start]):
+                spans.append((start, i))
+                start = i
+        spans.append((start, len(arr)))
+        return spans
+
+    def rate(self, arr, number=1):
+        elapsed = best_of(lambda : RecordDictionaryTool.spanify(arr), number=number)
+        baseline = best_of(lambda : self.per_element(arr), repeat=1, number=1)
+        log.info('spanify %s x %s (%s spans): %.6fs, per-element %.6fs (%.1fx)', len(arr), arr.dtype,
+                 len(RecordDictionaryTool.spanify(arr)), elapsed, baseline, baseline / elapsed)
+
+    def test_spanify(self):
+        for size in (10**3, 10**4, 10**5, 10**6):
+            # Calibration-style values change rarely
+            self.rate(np.repeat(np.arange(10, dtype='float32'), size / 10), number=10)
+            self.rate(np.repeat(np.array(['cal_a', 'cal_b']), size / 2), number=10)
+
+    def test_spanify_objects(self):
+        for size in (10**3, 10**4, 10**5):
+            arr = np.empty(size, dtype=object)
+            for i in xrange(size):
+                arr[i] = np.arange(3) + (i * 4 / size)
+            self.rate(arr)
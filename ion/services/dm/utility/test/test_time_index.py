@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_time_index.py
+@brief Tests for the dataset time index
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.services.dm.utility.time_index import TimeIndex
+from nose.plugins.attrib import attr
+
+import numpy as np
+
+
+@attr('UNIT',group='dm')
+class TimeIndexTest(PyonTestCase):
+    def test_index_range(self):
+        time_index = TimeIndex.new('time', 'seconds since 1900-01-01')
+        time_index.append(0, np.arange(10) + 2208988800)
+        time_index.append(10, np.arange(10, 20) + 2208988800)
+        time_index.append(20, np.arange(30, 40) + 2208988800)
+
+        self.assertEquals(time_index.doc['bounds'], [2208988800, 2208988839])
+        self.assertEquals(time_index.to_ts(2208988805), 5)
+        self.assertEquals(time_index.index_range(12, 15), slice(10, 20))
+        self.assertEquals(time_index.index_range(5, 12), slice(0, 20))
+        self.assertEquals(time_index.index_range(None, 3), slice(0, 10))
+        self.assertEquals(time_index.index_range(35, None), slice(20, 30))
+        self.assertEquals(time_index.index_range(21, 28), None)
+        self.assertEquals(time_index.index_range(100, 200), None)
+        self.assertEquals(time_index.num_records, 30)
+        self.assertEquals(time_index.units_index_range(2208988812, 2208988815), slice(10, 20))
+
+    def test_unindexed_prefix(self):
+        time_index = TimeIndex.new('time', '', start_index=50)
+        self.assertEquals(time_index.num_records, 50)
+        time_index.append(50, np.arange(100, 110))
+        self.assertEquals(time_index.index_range(0, 10), slice(0, 50))
+        self.assertEquals(time_index.index_range(105, None), slice(0, 60))
+
+    def test_compaction(self):
+        time_index = TimeIndex.new('time', '')
+        for i in xrange(TimeIndex.MAX_BLOCKS + 1):
+            time_index.append(i * 10, np.arange(i * 10, (i + 1) * 10))
+        self.assertEquals(len(time_index.blocks), TimeIndex.MAX_BLOCKS / 2 + 1)
+        self.assertEquals(time_index.blocks[0], [0, 20, 0, 19])
+        self.assertEquals(time_index.index_range(25, 25), slice(20, 40))
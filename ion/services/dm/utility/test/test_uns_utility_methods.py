@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/test/test_uns_utility_methods.py
+@brief Tests for the notification subscription index and user info loading
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from pyon.util.log import log
+from pyon.public import PRED, OT, RT
+from ion.services.dm.utility.uns_utility_methods import SubscriptionIndex, calculate_reverse_user_info
+from ion.services.dm.utility.uns_utility_methods import load_user_info, users_affected_by, update_user_info, EventIndex
+from interface.objects import NotificationRequest, TemporalBounds
+from nose.plugins.attrib import attr
+from mock import Mock
+
+import random
+import time
+
+
+def notification(event_type='', origin='', origin_type='', event_subtype='', end_datetime=''):
+    return NotificationRequest(event_type=event_type, origin=origin, origin_type=origin_type, event_subtype=event_subtype,
+                               temporal_bounds=TemporalBounds(end_datetime=end_datetime))
+
+def event(type_='', origin='', origin_type='', sub_type=''):
+    return DotDict(type_=type_, origin=origin, origin_type=origin_type, sub_type=sub_type)
+
+
+@attr('UNIT', group='dm')
+class SubscriptionIndexTest(PyonTestCase):
+    def setUp(self):
+        self.user_info = {
+            'user_1' : {'notifications' : [notification('ResourceLifecycleEvent', 'instrument_1', 'type_1', 'subtype_1')]},
+            'user_2' : {'notifications' : [notification('DetectionEvent', 'instrument_2', 'type_2')]},
+            # Any event from instrument_2
+            'user_3' : {'notifications' : [notification(origin='instrument_2')]},
+            'user_4' : {'notifications' : [notification('DetectionEvent', 'instrument_2')], 'notifications_daily_digest' : True},
+            'user_5' : {'notifications' : [notification('DetectionEvent', 'instrument_2', end_datetime='1')]},
+        }
+
+    def test_match(self):
+        index = SubscriptionIndex(self.user_info)
+        self.assertEquals(len(index), 3)
+
+        self.assertEquals(index.match(event('ResourceLifecycleEvent', 'instrument_1', 'type_1', 'subtype_1')), set(['user_1']))
+        self.assertEquals(index.match(event('ResourceLifecycleEvent', 'instrument_1')), set(['user_1']))
+        self.assertEquals(index.match(event('ResourceLifecycleEvent', 'instrument_1', sub_type='subtype_2')), set())
+        self.assertEquals(index.match(event('DetectionEvent', 'instrument_2', 'type_2')), set(['user_2', 'user_3']))
+        self.assertEquals(index.match(event('ResourceModifiedEvent', 'instrument_2', 'type_3')), set(['user_3']))
+        self.assertEquals(index.match(event('ResourceModifiedEvent', 'instrument_1')), set())
+        self.assertEquals(index.match(event(origin='instrument_2')), set())
+
+    def test_reverse_user_info(self):
+        index = SubscriptionIndex(self.user_info)
+        reverse_user_info = index.reverse_user_info()
+        expected = calculate_reverse_user_info(self.user_info)
+        for key in expected:
+            self.assertEquals(set(expected[key]), set(reverse_user_info[key]))
+            for value in expected[key]:
+                self.assertEquals(set(expected[key][value]), set(reverse_user_info[key][value]))
+
+        self.assertEquals(SubscriptionIndex().reverse_user_info(), {})
+
+    def test_update(self):
+        index = SubscriptionIndex(self.user_info)
+        buckets = dict(index._buckets['event_origin'])
+
+        # user_2 moves to instrument_3, the instrument_1 bucket is left alone
+        index.update({'user_2' : {'notifications' : [notification('DetectionEvent', 'instrument_3')]}})
+        self.assertTrue(index._buckets['event_origin']['instrument_1'] is buckets['instrument_1'])
+        self.assertEquals(index.match(event('DetectionEvent', 'instrument_2')), set(['user_3']))
+        self.assertEquals(index.match(event('DetectionEvent', 'instrument_3')), set(['user_2']))
+
+        # Removing the only origin wildcard
+        index.remove(['user_3'])
+        self.assertEquals(index.match(event('DetectionEvent', 'instrument_2')), set())
+        self.assertFalse('instrument_2' in index._buckets['event_origin'])
+        self.assertEquals(len(index), 2)
+
+        index.update({'user_4' : {'notifications' : [notification('DetectionEvent')]}})
+        self.assertEquals(index.match(event('DetectionEvent', 'instrument_9')), set(['user_4']))
+        self.assertEquals(index.match(event('DetectionEvent', 'instrument_3')), set(['user_2', 'user_4']))
+
+
+@attr('UNIT', group='dm')
+class EventIndexTest(PyonTestCase):
+    def test_events_for(self):
+        events = [event('DetectionEvent', 'instrument_1', 'InstrumentDevice'),
+                  event('ResourceModifiedEvent', 'instrument_1', 'InstrumentDevice'),
+                  event('DetectionEvent', 'instrument_2', 'PlatformDevice'),
+                  event('DetectionEvent', 'instrument_1', 'InstrumentDevice')]
+        index = EventIndex(events)
+
+        self.assertEquals(index.match(notification('DetectionEvent', 'instrument_1')), set([0, 3]))
+        self.assertEquals(index.match(notification(origin_type='PlatformDevice')), set([2]))
+        self.assertEquals(index.match(notification('DetectionEvent', 'instrument_3')), set())
+        self.assertEquals(index.match(notification()), set([0, 1, 2, 3]))
+
+        # Overlapping notifications do not repeat events, expired ones are ignored
+        notifications = [notification(origin='instrument_1'), notification('DetectionEvent', 'instrument_1'),
+                         notification(origin='instrument_2', end_datetime='1')]
+        self.assertEquals(index.events_for(notifications), [events[0], events[1], events[3]])
+        self.assertEquals(EventIndex([]).events_for(notifications), [])
+
+
+@attr('UNIT', group='dm')
+class UserInfoLoaderTest(PyonTestCase):
+    def setUp(self):
+        self.users = {'user_1' : DotDict(_id='user_1', contact=DotDict(email='user_1@example.com'), variables=[]),
+                      'user_2' : DotDict(_id='user_2', contact=DotDict(email='user_2@example.com'),
+                                         variables=[{'name':'notifications_daily_digest', 'value':True}])}
+        self.notifications = {'user_1' : [notification('DetectionEvent', 'instrument_1'), notification('DetectionEvent', 'instrument_2', end_datetime='1')],
+                              'user_2' : [notification('DeviceStatusEvent', 'instrument_1')]}
+        for i, n in enumerate(self.notifications['user_1'] + self.notifications['user_2']):
+            n._id = 'notification_%s' % i
+
+        self.rr_client = Mock()
+        self.rr_client.find_resources.side_effect = lambda restype : (self.users.values(), [])
+        self.rr_client.read_mult.side_effect = lambda ids : [self.users.get(i) for i in ids]
+        def find_objects_mult(subjects=[], id_only=False):
+            objects, assocs = [], []
+            for s in subjects:
+                for n in self.notifications.get(s, []):
+                    objects.append(n)
+                    assocs.append(DotDict(s=s, p=PRED.hasNotification, o=n._id))
+                objects.append(DotDict(_id='org'))
+                assocs.append(DotDict(s=s, p=PRED.hasRole, o='org'))
+            return objects, assocs
+        self.rr_client.find_objects_mult.side_effect = find_objects_mult
+
+    def test_load_user_info(self):
+        user_info = load_user_info(self.rr_client)
+        self.assertEquals(set(user_info), set(['user_1', 'user_2']))
+        self.assertEquals(user_info['user_1']['notifications'], self.notifications['user_1'][:1])
+        self.assertEquals(user_info['user_1']['user_contact'].email, 'user_1@example.com')
+        self.assertTrue(user_info['user_2']['notifications_daily_digest'])
+        self.assertEquals(self.rr_client.find_objects_mult.call_count, 1)
+        self.assertFalse(self.rr_client.find_objects.called)
+
+        self.assertEquals(set(load_user_info(self.rr_client, ['user_2'])), set(['user_2']))
+        self.assertEquals(load_user_info(self.rr_client, []), {})
+
+    def test_update_user_info(self):
+        user_info = load_user_info(self.rr_client)
+
+        event = DotDict(type_=OT.ResourceModifiedEvent, origin='user_2', origin_type=RT.UserInfo)
+        self.assertEquals(users_affected_by(event, user_info, self.rr_client), set(['user_2']))
+        self.assertEquals(users_affected_by(event, None, self.rr_client), None)
+
+        # notification_0 was dropped by user_1, only user_1 is reloaded
+        self.notifications['user_1'] = []
+        self.rr_client.find_subjects.return_value = ([], [])
+        event = DotDict(type_=OT.ReloadUserInfoEvent, notification_id='notification_0')
+        user_ids = users_affected_by(event, user_info, self.rr_client)
+        self.assertEquals(user_ids, set(['user_1']))
+
+        self.rr_client.read_mult.reset_mock()
+        updates = update_user_info(user_info, user_ids, self.rr_client)
+        self.rr_client.read_mult.assert_called_once_with(['user_1'])
+        self.assertEquals(updates['user_1']['notifications'], [])
+        self.assertEquals(user_info['user_1']['notifications'], [])
+
+        del self.users['user_2']
+        self.assertEquals(update_user_info(user_info, set(['user_2']), self.rr_client), {'user_2' : None})
+        self.assertFalse('user_2' in user_info)
+
+
+@attr('UTIL', group='dm')
+class SubscriptionIndexBenchmark(PyonTestCase):
+    subscriptions = 100000
+    events = 100000
+
+    def test_match_rate(self):
+        random.seed(0)
+        event_types = ['ResourceLifecycleEvent', 'DetectionEvent', 'DeviceStatusEvent', 'ResourceModifiedEvent']
+        user_info = {}
+        for i in xrange(self.subscriptions):
+            origin = 'instrument_%s' % random.randint(0, self.subscriptions / 10)
+            user_info['user_%s' % i] = {'notifications' : [notification(random.choice(event_types + ['']), origin)]}
+
+        start = time.time()
+        index = SubscriptionIndex(user_info)
+        log.info('Indexed %s subscriptions in %.3fs', self.subscriptions, time.time() - start)
+
+        events = [event(random.choice(event_types + ['UnsubscribedEvent']), 'instrument_%s' % random.randint(0, self.subscriptions / 5), sub_type='subtype')
+                  for i in xrange(self.events)]
+        start = time.time()
+        matched = sum(len(index.match(e)) for e in events)
+        elapsed = time.time() - start
+        log.info('Matched %s events (%s notifications) in %.3fs, %.0f events/s', self.events, matched, elapsed, self.events / elapsed)
+
+        start = time.time()
+        for i in xrange(100):
+            index.update({'user_%s' % i : {'notifications' : [notification('DetectionEvent', 'instrument_0')]}})
+        log.info('Incremental update of one user: %.6fs', (time.time() - start) / 100)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+'''
+@file ion/services/dm/utility/time_index.py
+@description Sparse index over a dataset's time axis
+'''
+
+from ion.util.time_utils import TimeUtils
+
+import numpy as np
+
+class TimeIndex(object):
+    '''
+    A sparse block index over a dataset's time axis. The index lives in the dataset's
+    metadata document (object store) and is extended by ingestion on every append, so
+    temporal bounds and time windows can be resolved without opening the coverage.
+
+    The document is a plain dictionary:
+      parameter: Name of the temporal parameter
+      units:     Units of the temporal parameter
+      linear:    (scale, offset) converting unix timestamps to units, None if not linear
+      bounds:    [min, max] time in the parameter's units
+      blocks:    [[start_index, count, min_time, max_time], ...] ordered by start_index
+      start:     Index of the first indexed record, earlier records are always considered a match
+
+    The number of blocks is bounded by MAX_BLOCKS, adjacent blocks are merged when the
+    limit is reached so the document stays small no matter how long the dataset is.
+    '''
+    MAX_BLOCKS = 1024
+
+    def __init__(self, doc):
+        self.doc = doc
+
+    @classmethod
+    def new(cls, parameter, units, start_index=0):
+        units = units or ''
+        linear = TimeUtils.linear_units(units)
+        doc = {'parameter' : parameter,
+               'units'     : units,
+               'linear'    : list(linear) if linear is not None else None,
+               'bounds'    : None,
+               'blocks'    : [],
+               'start'     : int(start_index)}
+        return cls(doc)
+
+    @property
+    def parameter(self):
+        return self.doc['parameter']
+
+    @property
+    def blocks(self):
+        return self.doc['blocks']
+
+    @property
+    def num_records(self):
+        '''
+        Number of records the index accounts for, the index is out of date when
+        the dataset holds more
+        '''
+        blocks = self.doc['blocks']
+        if blocks:
+            return blocks[-1][0] + blocks[-1][1]
+        return self.doc.get('start') or 0
+
+    def append(self, start_index, times):
+        '''
+        Records times appended to the dataset at start_index
+        '''
+        times = np.atleast_1d(times).flatten()
+        if not times.size:
+            return
+        self.add_block(start_index, times.size, np.min(times), np.max(times))
+
+    def add_block(self, start_index, count, t_min, t_max):
+        '''
+        Records count records starting at start_index with times between t_min and t_max
+        '''
+        t_min, t_max = float(t_min), float(t_max)
+        bounds = self.doc['bounds']
+        self.doc['bounds'] = [t_min, t_max] if bounds is None else [min(bounds[0], t_min), max(bounds[1], t_max)]
+
+        blocks = self.doc['blocks']
+        blocks.append([int(start_index), int(count), t_min, t_max])
+        if len(blocks) > self.MAX_BLOCKS:
+            self._compact()
+
+    def _compact(self):
+        '''
+        Halves the number of blocks by merging adjacent pairs
+        '''
+        blocks = self.doc['blocks']
+        merged = []
+        for i in xrange(0, len(blocks) - 1, 2):
+            a, b = blocks[i], blocks[i+1]
+            merged.append([a[0], b[0] + b[1] - a[0], min(a[2], b[2]), max(a[3], b[3])])
+        if len(blocks) % 2:
+            merged.append(blocks[-1])
+        self.doc['blocks'] = merged
+
+    def to_units(self, timestamp):
+        '''
+        Converts a unix timestamp into the temporal parameter's units
+        '''
+        if self.doc['linear'] is None:
+            return TimeUtils.ts_to_units(self.doc['units'], timestamp)
+        scale, offset = self.doc['linear']
+        return offset + timestamp * scale
+
+    def to_ts(self, value):
+        '''
+        Converts a value of the temporal parameter into a unix timestamp
+        '''
+        if self.doc['linear'] is None:
+            return TimeUtils.units_to_ts(self.doc['units'], value)
+        scale, offset = self.doc['linear']
+        return (value - offset) / scale
+
+    def index_range(self, start_time=None, end_time=None):
+        '''
+        Returns a slice of indices containing every record between the start and end
+        unix timestamps (at block granularity), or None if no record falls in the window.
+        '''
+        lower = self.to_units(start_time) if start_time is not None else None
+        upper = self.to_units(end_time) if end_time is not None else None
+        return self.units_index_range(lower, upper)
+
+    def units_index_range(self, lower=None, upper=None):
+        '''
+        Same as index_range for bounds already in the temporal parameter's units
+        '''
+        start, stop = None, None
+        if self.doc.get('start'):
+            start, stop = 0, self.doc['start']
+        for block_start, count, t_min, t_max in self.doc['blocks']:
+            if lower is not None and t_max < lower:
+                continue
+            if upper is not None and t_min > upper:
+                continue
+            start = block_start if start is None else min(start, block_start)
+            stop = block_start + count if stop is None else max(stop, block_start + count)
+        if start is None:
+            return None
+        return slice(start, stop)
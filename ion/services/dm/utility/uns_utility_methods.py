@@ -3,7 +3,7 @@
 @file ion/services/dm/utility/uns_utility_methods.py
 @description A module containing common utility methods used by UNS and the notification workers.
 """
-from pyon.public import get_sys_name, OT, IonObject, CFG
+from pyon.public import get_sys_name, OT, RT, PRED, IonObject, CFG
 from pyon.util.ion_time import IonTime
 from pyon.util.log import log
 from pyon.core.exception import BadRequest, NotFound
@@ -16,6 +16,9 @@ import string
 from email.mime.text import MIMEText
 from gevent import Greenlet
 
+# the default 'from' email address for notification emails, see server.smtp.sender
+ION_NOTIFICATION_EMAIL_ADDRESS = 'data_alerts@oceanobservatories.org'
+
 
 
 class fake_smtplib(object):
@@ -164,28 +167,35 @@ def send_email(event, msg_recipient, smtp_client, rr_client):
     @param smtp_client          fake or real smtp client object
 
     """
+    log.debug("UNS sending email to %s for event type: %s", msg_recipient, event.type_)
+    send_events_email([event], msg_recipient, smtp_client, rr_client)
 
-    #log.debug("Got type of event to notify on: %s", event.type_)
 
-    #------------------------------------------------------------------------------------
-    # the 'from' email address for notification emails
-    #------------------------------------------------------------------------------------
+def send_events_email(events, msg_recipient, smtp_client, rr_client, connect=setting_up_smtp_client):
+    """
+    Sends the events to msg_recipient in one formatted email. When the send fails, which
+    can be due to a broken connection, a new client is created with connect and the send
+    is retried once.
 
-    ION_NOTIFICATION_EMAIL_ADDRESS = 'data_alerts@oceanobservatories.org'
+    @param events               list of Event
+    @param msg_recipient        str
+    @param smtp_client          fake or real smtp client object
+    @param connect              callable returning a new smtp client
+    @retval the smtp client the email was sent with
+    """
     smtp_sender = CFG.get_safe('server.smtp.sender', ION_NOTIFICATION_EMAIL_ADDRESS)
 
-    msg = convert_events_to_email_message([event], rr_client)
+    msg = convert_events_to_email_message(events, rr_client)
     msg['From'] = smtp_sender
     msg['To'] = msg_recipient
-    log.debug("UNS sending email from %s to %s for event type: %s", smtp_sender,msg_recipient, event.type_)
-    #log.debug("UNS using the smtp client: %s", smtp_client)
 
     try:
         smtp_client.sendmail(smtp_sender, [msg_recipient], msg.as_string())
-    except: # Can be due to a broken connection... try to create a connection
-        smtp_client = setting_up_smtp_client()
-        log.debug("Connect again...message received after ehlo exchange: %s", str(smtp_client.ehlo()))
+    except Exception: # Can be due to a broken connection... try to create a connection
+        log.debug('Reconnecting to the SMTP server', exc_info=True)
+        smtp_client = connect()
         smtp_client.sendmail(smtp_sender, [msg_recipient], msg.as_string())
+    return smtp_client
 
 
 def check_user_notification_interest(event, reverse_user_info):
@@ -226,10 +236,8 @@ def check_user_notification_interest(event, reverse_user_info):
 
     if event.type_: # for an incoming event with origin type specified
         if reverse_user_info['event_type'].has_key(event.type_):
-            user_list_1 = reverse_user_info['event_type'][event.type_]
-            if reverse_user_info['event_type'].has_key(''): # for users who subscribe to any event types
-                user_list_1.extend(reverse_user_info['event_type'][''])
-            users = set(user_list_1)
+            # for users who subscribe to any event types
+            users = set(reverse_user_info['event_type'][event.type_]).union(reverse_user_info['event_type'].get('', []))
 #            log.debug("For event_type = %s, UNS got interested users here  %s", event.type_, users)
         else:
 #            log.debug("After checking event_type = %s, UNS got no interested users here", event.type_)
@@ -237,10 +245,8 @@ def check_user_notification_interest(event, reverse_user_info):
 
     if event.origin: # for an incoming event that has origin specified (this should be true for almost all events)
         if reverse_user_info['event_origin'].has_key(event.origin):
-            user_list_2 = set(reverse_user_info['event_origin'][event.origin])
-            if reverse_user_info['event_origin'].has_key(''): # for users who subscribe to any event origins
-                user_list_2.extend(reverse_user_info['event_origin'][''])
-            users = set.intersection(users, user_list_2)
+            # for users who subscribe to any event origins
+            users.intersection_update(set(reverse_user_info['event_origin'][event.origin]).union(reverse_user_info['event_origin'].get('', [])))
 #            log.debug("For event origin = %s too, UNS got interested users here  %s", event.origin, users)
         else:
 #            log.debug("After checking  event origin = %s, UNS got no interested users here", event.origin)
@@ -248,20 +254,16 @@ def check_user_notification_interest(event, reverse_user_info):
 
     if event.sub_type:  # for an incoming event with the sub type specified
         if reverse_user_info['event_subtype'].has_key(event.sub_type):
-            user_list_3 = reverse_user_info['event_subtype'][event.sub_type]
-            if reverse_user_info['event_subtype'].has_key(''): # for users who subscribe to any event subtypes
-                user_list_3.extend(reverse_user_info['event_subtype'][''])
-            users = set.intersection(users, user_list_3)
+            # for users who subscribe to any event subtypes
+            users.intersection_update(set(reverse_user_info['event_subtype'][event.sub_type]).union(reverse_user_info['event_subtype'].get('', [])))
 #        else:
 #            log.debug("After checking event_subtype = %s, UNS got no interested users here", event.sub_type)
 #            return []
 
     if event.origin_type:  # for an incoming event with origin type specified
         if reverse_user_info['event_origin_type'].has_key(event.origin_type):
-            user_list_4 = reverse_user_info['event_origin_type'][event.origin_type]
-            if reverse_user_info['event_origin_type'].has_key(''): # for users who subscribe to any event origin types
-                user_list_4.extend(reverse_user_info['event_origin_type'][''])
-            users = set.intersection(users, user_list_4)
+            # for users who subscribe to any event origin types
+            users.intersection_update(set(reverse_user_info['event_origin_type'][event.origin_type]).union(reverse_user_info['event_origin_type'].get('', [])))
         else:
 #            log.debug("After checking event_origin_type = %s, UNS got no interested users here", event.origin_type)
             return []
@@ -269,6 +271,154 @@ def check_user_notification_interest(event, reverse_user_info):
 #    log.debug("The interested users found here are: %s, for event: %s", list(users), event)
     return list( users)
 
+class EventIndex(object):
+    """
+    Buckets a list of events by origin, type and origin type so the events matching a notification
+    request are found with set intersections instead of a search per notification.
+    """
+    # (event attribute, notification attribute)
+    ATTRIBUTES = (('origin', 'origin'), ('type_', 'event_type'), ('origin_type', 'origin_type'))
+
+    def __init__(self, events):
+        self.events = list(events)
+        self._buckets = dict((attribute, {}) for attribute, _ in self.ATTRIBUTES)
+        for i, event in enumerate(self.events):
+            for attribute, _ in self.ATTRIBUTES:
+                self._buckets[attribute].setdefault(getattr(event, attribute, '') or '', set()).add(i)
+
+    def match(self, notification):
+        """
+        Returns the set of positions of the events matching the notification, empty attributes match anything
+        """
+        buckets = []
+        for attribute, notification_attribute in self.ATTRIBUTES:
+            value = getattr(notification, notification_attribute, '')
+            if value:
+                bucket = self._buckets[attribute].get(value)
+                if not bucket:
+                    return set()
+                buckets.append(bucket)
+        if not buckets:
+            return set(xrange(len(self.events)))
+        buckets.sort(key=len)
+        matches = set(buckets[0])
+        for bucket in buckets[1:]:
+            matches.intersection_update(bucket)
+        return matches
+
+    def events_for(self, notifications):
+        """
+        Returns the events matching any of the active notifications, in their original order
+        """
+        matches = set()
+        for notification in notifications:
+            # If the notification request has expired, then do not use it
+            if notification.temporal_bounds.end_datetime:
+                continue
+            matches.update(self.match(notification))
+        return [self.events[i] for i in sorted(matches)]
+
+def load_user_info(rr_client, user_ids=None):
+    """
+    Loads the user info dictionary used by the notification workers and the UNS
+
+    All the users (or the users in user_ids) and their active notifications are read with two
+    resource registry calls, regardless of the number of users.
+
+    @param rr_client    resource registry client
+    @param user_ids     list, loads only these users if specified
+    @retval user_info   dict
+    """
+    if user_ids is None:
+        users, _ = rr_client.find_resources(restype=RT.UserInfo)
+    else:
+        users = [user for user in rr_client.read_mult(user_ids) if user is not None] if user_ids else []
+
+    if not users:
+        return {}
+
+    notifications = dict((user._id, []) for user in users)
+    objects, assocs = rr_client.find_objects_mult(subjects=notifications.keys(), id_only=False)
+    for notification, assoc in zip(objects, assocs):
+        if assoc.p != PRED.hasNotification or not isinstance(notification, NotificationRequest):
+            continue
+        # do not include notifications that have expired
+        if notification.temporal_bounds.end_datetime == '':
+            notifications[assoc.s].append(notification)
+
+    user_info = {}
+    for user in users:
+        notifications_disabled = False
+        notifications_daily_digest = False
+
+        for variable in user.variables:
+            if type(variable) is dict and variable.has_key('name'):
+
+                if variable['name'] == 'notifications_daily_digest':
+                    notifications_daily_digest = variable['value']
+
+                if variable['name'] == 'notifications_disabled':
+                    notifications_disabled = variable['value']
+            else:
+                log.warning('Invalid variables attribute on UserInfo instance. UserInfo: %s', user)
+
+        user_info[user._id] = { 'user_contact' : user.contact, 'notifications' : notifications[user._id],
+                                'notifications_daily_digest' : notifications_daily_digest, 'notifications_disabled' : notifications_disabled}
+
+    return user_info
+
+def users_affected_by(event, user_info, rr_client):
+    """
+    Returns the ids of the users whose user info is changed by a ReloadUserInfoEvent or a UserInfo
+    ResourceModifiedEvent, None if they can not be determined and every user has to be reloaded
+
+    @param event        Event
+    @param user_info    dict, the current user info
+    @param rr_client    resource registry client
+    @retval user_ids    set or None
+    """
+    if user_info is None:
+        return None
+    if event.type_ == OT.ReloadUserInfoEvent and getattr(event, 'notification_id', None):
+        user_ids, _ = rr_client.find_subjects(subject_type=RT.UserInfo, predicate=PRED.hasNotification, object=event.notification_id, id_only=True)
+        user_ids = set(user_ids)
+        # Users still holding the notification locally
+        for user_id, value in user_info.iteritems():
+            if any(notification._id == event.notification_id for notification in value['notifications']):
+                user_ids.add(user_id)
+        return user_ids
+    if event.type_ == OT.ResourceModifiedEvent and event.origin_type == RT.UserInfo and event.origin:
+        return set([event.origin])
+    return None
+
+def update_user_info(user_info, user_ids, rr_client):
+    """
+    Reloads the users in user_ids into user_info, users that no longer exist are removed
+
+    @retval updates     dict of the reloaded entries, None for removed users
+    """
+    if user_ids:
+        try:
+            loaded = load_user_info(rr_client, list(user_ids))
+        except NotFound:
+            # One of them was deleted
+            loaded = {}
+            for user_id in user_ids:
+                try:
+                    loaded.update(load_user_info(rr_client, [user_id]))
+                except NotFound:
+                    pass
+    else:
+        loaded = {}
+    updates = {}
+    for user_id in user_ids:
+        if user_id in loaded:
+            user_info[user_id] = updates[user_id] = loaded[user_id]
+        else:
+            user_info.pop(user_id, None)
+            updates[user_id] = None
+    return updates
+
 def calculate_reverse_user_info(user_info=None):
     """
     Calculate a reverse user info... used by the notification workers and the UNS
@@ -361,6 +511,127 @@ def calculate_reverse_user_info(user_info=None):
 
     return reverse_user_info
 
+class SubscriptionIndex(object):
+    """
+    Index of the users interested in each event type, origin, origin type and sub type, used by the
+    notification workers to match events against the realtime notifications of every user.
+
+    For each attribute the index maps a value to the frozenset of users subscribed to it. Users with a
+    notification that leaves the attribute empty (a wildcard) are merged into every bucket when the bucket
+    is built, and make up the bucket used for values nobody subscribed to explicitly. Matching an event is
+    a dictionary lookup per attribute and an intersection of frozensets; an event type nobody is interested
+    in is rejected with a single lookup.
+
+    update() takes user_info entries for a subset of the users and only rebuilds the buckets they touch.
+    """
+    # (reverse user info key, event attribute, notification attribute)
+    ATTRIBUTES = (('event_type',        'type_',       'event_type'),
+                  ('event_origin',      'origin',      'origin'),
+                  ('event_subtype',     'sub_type',    'event_subtype'),
+                  ('event_origin_type', 'origin_type', 'origin_type'))
+
+    def __init__(self, user_info=None):
+        self._subscriptions = {}
+        self._members = dict((key, {}) for key, _, _ in self.ATTRIBUTES)
+        self._wildcard_members = dict((key, set()) for key, _, _ in self.ATTRIBUTES)
+        self._buckets = dict((key, {}) for key, _, _ in self.ATTRIBUTES)
+        self._wildcards = dict((key, frozenset()) for key, _, _ in self.ATTRIBUTES)
+        if user_info:
+            self.update(user_info)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    @classmethod
+    def subscriptions(cls, value):
+        """
+        Returns {attribute: set of subscribed values} for a user_info entry ('' for a wildcard),
+        None if the user does not receive realtime notifications
+        """
+        if value.get('notifications_disabled', False) or value.get('notifications_daily_digest', False):
+            return None
+        subscriptions = dict((key, set()) for key, _, _ in cls.ATTRIBUTES)
+        found = False
+        for notification in value['notifications'] or []:
+            if not isinstance(notification, NotificationRequest):
+                continue
+            if notification.temporal_bounds.end_datetime:
+                continue
+            found = True
+            for key, _, attribute in cls.ATTRIBUTES:
+                subscriptions[key].add(getattr(notification, attribute) or '')
+        return subscriptions if found else None
+
+    def update(self, user_info):
+        """
+        Replaces the subscriptions of the users in user_info, a user mapped to None is removed
+        """
+        touched = dict((key, set()) for key, _, _ in self.ATTRIBUTES)
+        for user_id, value in user_info.iteritems():
+            old = self._subscriptions.pop(user_id, None)
+            new = self.subscriptions(value) if value else None
+            if new is not None:
+                self._subscriptions[user_id] = new
+            for key, _, _ in self.ATTRIBUTES:
+                old_values = old[key] if old else set()
+                new_values = new[key] if new else set()
+                if old_values == new_values:
+                    continue
+                for v in old_values - new_values:
+                    if v:
+                        self._members[key][v].discard(user_id)
+                    else:
+                        self._wildcard_members[key].discard(user_id)
+                for v in new_values - old_values:
+                    if v:
+                        self._members[key].setdefault(v, set()).add(user_id)
+                    else:
+                        self._wildcard_members[key].add(user_id)
+                touched[key].update(old_values ^ new_values)
+
+        for key, values in touched.iteritems():
+            if not values:
+                continue
+            if '' in values:
+                # The wildcards are part of every bucket
+                self._wildcards[key] = frozenset(self._wildcard_members[key])
+                values = self._members[key].keys()
+            wildcards = self._wildcards[key]
+            for v in values:
+                members = self._members[key].get(v)
+                if members:
+                    self._buckets[key][v] = frozenset(members) | wildcards
+                else:
+                    self._members[key].pop(v, None)
+                    self._buckets[key].pop(v, None)
+
+    def remove(self, user_ids):
+        self.update(dict((user_id, None) for user_id in user_ids))
+
+    def match(self, event):
+        """
+        Returns the frozenset of users interested in the event
+        """
+        if not event.type_:
+            return frozenset()
+        users = self._buckets['event_type'].get(event.type_, self._wildcards['event_type'])
+        for key, attribute, _ in self.ATTRIBUTES[1:]:
+            if not users:
+                break
+            value = getattr(event, attribute, None)
+            if value:
+                users = users & self._buckets[key].get(value, self._wildcards[key])
+        return users
+
+    def reverse_user_info(self):
+        """
+        Returns the index in the reverse_user_info form computed by calculate_reverse_user_info
+        """
+        if not self._subscriptions:
+            return {}
+        return dict((key, dict((v, list(members)) for v, members in self._members[key].iteritems()))
+                    for key, _, _ in self.ATTRIBUTES)
+
 def get_event_computed_attributes(event):
     """
     @param event any Event to compute attributes for
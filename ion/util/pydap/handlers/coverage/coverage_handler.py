@@ -14,6 +14,7 @@ from coverage_model.parameter_functions import ParameterFunctionException
 from pydap.model import DatasetType,BaseType, GridType, SequenceType
 from pydap.handlers.lib import BaseHandler
 from pyon.public import CFG
+from ion.services.dm.inventory.data_retriever_service import DataRetrieverService
 import time
 import simplejson as json
 import collections
@@ -27,6 +28,9 @@ numpy_complex = 'FDG'
 numpy_object = 'O'
 numpy_str = 'SUV'
 
+# str() applied element by element in C, for object arrays
+object_str = np.frompyfunc(str, 1, 1)
+
 def exception_wrapper(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
@@ -54,7 +58,10 @@ class Handler(BaseHandler):
     CACHE_LIMIT = CFG.get_safe('server.pydap.cache_limit', 5)
     CACHE_EXPIRATION = CFG.get_safe('server.pydap.cache_expiration', 5)
     REQUEST_LIMIT = CFG.get_safe('server.pydap.request_limit', 200) # MB
+    CHUNK_SIZE = CFG.get_safe('server.pydap.chunk_size', 100000) # Timesteps per read
+    METADATA_CACHE_LIMIT = CFG.get_safe('server.pydap.metadata_cache_limit', 100)
     _coverages = collections.OrderedDict() # Cache has to be a class var because each handler is initialized per request
+    _metadata = collections.OrderedDict() # dataset_id -> (parameters, {name: (context, dap type, attrs)})
 
     extensions = re.compile(r'^.*[0-9A-Za-z\-]{32}',re.IGNORECASE)
 
@@ -132,20 +139,85 @@ class Handler(BaseHandler):
             attrs['long_name'] = pc.display_name
         return attrs
 
-    def get_data(self,cov, name, bitmask):
-        #pc = cov.get_parameter_context(name)
+    def iter_chunks(self, slab):
+        '''
+        Splits the index range slab into contiguous slabs of at most CHUNK_SIZE timesteps
+        '''
+        for start in xrange(slab.start, slab.stop, self.CHUNK_SIZE):
+            yield slice(start, min(start + self.CHUNK_SIZE, slab.stop))
+
+    def read_slab(self, cov, name, chunk):
         if isinstance(cov._range_dictionary[name].param_type, ArrayType):
-            try:
-                vdict = cov.get_value_dictionary([name])
-                idxs = np.where(bitmask)[0]
-                data = vdict[name][idxs]
-            except ParameterFunctionException:
-                data = np.empty(cov.num_timesteps, dtype='object')
+            vdict = cov.get_value_dictionary([name], domain_slice=(chunk.start, chunk.stop))
+            return np.asanyarray(vdict[name])
+        return np.asanyarray(cov._range_value[name][chunk])
+
+    def mask_chunk(self, values, mask, fill_value=None):
+        '''
+        Selects the timesteps of the chunk in mask. Values not covering the whole chunk are
+        masked where they overlap it and padded with fill_value so every column stays aligned.
+        '''
+        values = np.atleast_1d(values)
+        if values.shape[0] == len(mask):
+            return values[mask]
+        log.warning('Read %s values for a chunk of %s timesteps, padding with fill values', values.shape[0], len(mask))
+        overlap = min(values.shape[0], len(mask))
+        padding = np.empty((np.sum(mask[overlap:]),) + values.shape[1:], dtype=values.dtype)
+        padding[...] = fill_value if fill_value is not None else np.ma.default_fill_value(values)
+        return np.concatenate([values[:overlap][mask[:overlap]], padding])
+
+    @classmethod
+    def clear_metadata(cls):
+        cls._metadata.clear()
+
+    def get_metadata(self, cov, dataset_id=None):
+        '''
+        Returns {name: (context, dap type, attrs)} for the parameters of the coverage,
+        cached per dataset until its parameters change
+        '''
+        parameters = tuple(cov.list_parameters())
+        cached = self._metadata.pop(dataset_id, None) if dataset_id else None
+        if cached is None or cached[0] != parameters:
+            metadata = {}
+            for name in parameters:
+                try:
+                    context = cov.get_parameter_context(name)
+                    metadata[name] = (context, self.dap_type(context), self.get_attrs(cov, name))
+                except Exception:
+                    log.exception('Problem reading cov %s', str(cov))
+            cached = (parameters, metadata)
+        if dataset_id:
+            self._metadata[dataset_id] = cached
+            while len(self._metadata) > self.METADATA_CACHE_LIMIT:
+                self._metadata.popitem(0)
+        return cached[1]
+
+    def get_data(self,cov, name, bitmask, slab=None):
+        '''
+        Reads the values of name selected by bitmask, bitmask is relative to the index range slab.
+        Only the chunks of the slab containing selected timesteps are read.
+        '''
+        slab = slab or slice(0, len(bitmask))
+        fill_value = getattr(cov._range_dictionary[name], 'fill_value', None)
+        parts = []
+        try:
+            for chunk in self.iter_chunks(slab):
+                mask = bitmask[chunk.start - slab.start:chunk.stop - slab.start]
+                if not mask.any():
+                    continue
+                values = self.read_slab(cov, name, chunk)
+                parts.append(self.mask_chunk(values, mask, fill_value))
+        except ParameterFunctionException:
+            parts = [np.empty(np.sum(bitmask), dtype='object')]
+        if len(parts) > 1:
+            data = np.concatenate(parts)
+        elif parts:
+            data = parts[0]
         else:
             try:
-                data = cov._range_value[name][:][bitmask]
-            except ParameterFunctionException:
-                data = np.empty(cov.num_timesteps, dtype='object')
+                data = np.empty((0,), dtype=cov._range_dictionary[name].param_type.value_encoding)
+            except TypeError:
+                data = np.empty((0,), dtype='object')
         data = np.asanyarray(data) 
         if not data.shape:
             data.shape = (1,)
@@ -177,9 +249,35 @@ class Handler(BaseHandler):
         return np.asanyarray(['Unsupported Type' for i in data]), 'S'
 
 
+    def format_rows(self, data, sep):
+        '''
+        Joins str() of the elements of each row of a 2-d boolean or numeric array with sep,
+        returns None for other types
+        '''
+        rows, columns = data.shape
+        char = data.dtype.char
+        if char in numpy_boolean:
+            fmt, values = '%s', data
+        elif char in numpy_integer_types + numpy_uinteger_types:
+            fmt, values = '%d', data
+        elif char in numpy_floats:
+            # str(float) is %.12g with a '.0' appended when it looks like an integer
+            fmt, values = '%.12g', data.astype('float64')
+        else:
+            return None
+        # A single format of the whole block instead of one per element
+        text = '\n'.join([sep.join([fmt] * columns)] * rows) % tuple(values.ravel().tolist())
+        if fmt == '%.12g':
+            text = re.sub(r'(?<![^%s\n])(-?\d+)(?![^%s\n])' % (sep, sep), r'\1.0', text)
+        return np.array(text.split('\n'))
+
     def ndim_stringify(self, data):
         retval = np.empty(data.shape[0], dtype='O')
         try:
+            if len(data.shape) == 2 and data.shape[0] and data.shape[1]:
+                strings = self.format_rows(data, ',')
+                if strings is not None:
+                    return strings
             if len(data.shape)>1:
                 for i in xrange(data.shape[0]):
                     retval[i] = ','.join(map(lambda x : str(x), data[i].tolist()))
@@ -192,38 +290,127 @@ class Handler(BaseHandler):
     def stringify(self, data):
         retval = np.empty(data.shape, dtype='O')
         try:
-            for i,obj in enumerate(data):
-                retval[i] = str(obj)
+            retval[:] = object_str(data)
         except:
             retval = np.asanyarray(['None' for d in data])
         return retval
 
     def stringify_inplace(self, data):
         try:
-            for i,obj in enumerate(data):
-                data[i] = str(obj)
+            data[:] = object_str(data)
         except:
             data = np.asanyarray(['None' for d in data])
         return data
 
-    def get_bitmask(self, cov, fields, slices, selectors):
+    def range_stringify(self, data):
+        '''
+        Converts the (lower, upper) values of a constant range parameter to 'lower_upper' strings
+        '''
+        try:
+            #scalar case
+            if data.shape == (2,):
+                return np.atleast_1d('_'.join([str(data[0]), str(data[1])]))
+            if len(data.shape) == 2 and data.shape[0] and data.shape[1] == 2:
+                strings = self.format_rows(data, '_')
+                if strings is None:
+                    strings = np.asanyarray(['_'.join(row) for row in object_str(data).tolist()])
+                return strings
+            data[:] = ['%s_%s' % (d[0], d[1]) for d in data.tolist()]
+        except Exception:
+            data = np.asanyarray(['None' for d in data])
+        return data
+
+    def get_time_index(self, cov, dataset_id):
+        '''
+        Returns the dataset's TimeIndex if it accounts for every timestep of the coverage,
+        None otherwise
+        '''
+        if not dataset_id:
+            return None
+        for refresh in (False, True):
+            try:
+                time_index = DataRetrieverService._get_time_index(dataset_id, refresh=refresh)
+            except Exception:
+                log.exception('Problem reading the time index of %s', dataset_id)
+                return None
+            if time_index is None or time_index.parameter != cov.temporal_parameter_name:
+                return None
+            if time_index.num_records == cov.num_timesteps:
+                return time_index
+        return None
+
+    def get_time_slab(self, cov, selectors, dataset_id=None):
         '''
-        returns a bitmask appropriate to the values
+        Turns the selectors on the temporal parameter into an index range of the time axis,
+        returns the range and the selectors left to evaluate.
+        The range comes from the dataset's time index when it is up to date, the time axis
+        is only read in full otherwise.
         '''
-        bitmask = np.ones(cov.num_timesteps, dtype=np.bool)
+        slab = slice(0, cov.num_timesteps)
+        time_selectors = []
+        remaining = []
         for selector in selectors:
             field, operator, value = self.parse_selectors(selector)
-            if operator is None:
-                continue
-            values = cov._range_value[field][:]
-            expression = ' '.join(['values', operator, value])
-            bitmask = bitmask & ne.evaluate(expression)
+            if field == cov.temporal_parameter_name and operator in ('<', '<=', '>', '>=', '=='):
+                try:
+                    time_selectors.append((operator, float(value)))
+                    continue
+                except ValueError:
+                    pass
+            remaining.append(selector)
+        if not time_selectors or not slab.stop:
+            return slab, selectors
+
+        time_index = self.get_time_index(cov, dataset_id)
+        if time_index is not None:
+            lower, upper = None, None
+            for operator, value in time_selectors:
+                if operator in ('>', '>=', '=='):
+                    lower = value if lower is None else max(lower, value)
+                if operator in ('<', '<=', '=='):
+                    upper = value if upper is None else min(upper, value)
+            # Blocks are coarser than the selectors, which still go into the bitmask
+            return time_index.units_index_range(lower, upper) or slice(0, 0), selectors
+
+        times = np.atleast_1d(np.asanyarray(cov._range_value[cov.temporal_parameter_name][:], dtype='float64'))
+        # The index range is only exact when the time axis is sorted (no fill values)
+        if not np.all(times[1:] >= times[:-1]):
+            return slab, selectors
+
+        start, stop = 0, len(times)
+        for operator, value in time_selectors:
+            if operator in ('>', '>=', '=='):
+                start = max(start, np.searchsorted(times, value, 'right' if operator == '>' else 'left'))
+            if operator in ('<', '<=', '=='):
+                stop = min(stop, np.searchsorted(times, value, 'left' if operator == '<' else 'right'))
+        return slice(int(start), int(max(start, stop))), remaining
+
+    def get_bitmask(self, cov, fields, slices, selectors, slab=None):
+        '''
+        returns a bitmask appropriate to the values, relative to the index range slab
+        '''
+        slab = slab or slice(0, cov.num_timesteps)
+        bitmask = np.ones(slab.stop - slab.start, dtype=np.bool)
+        selectors = [self.parse_selectors(selector) for selector in selectors]
+        selectors = [selector for selector in selectors if selector[1] is not None]
+        if not selectors:
+            return bitmask
+        for chunk in self.iter_chunks(slab):
+            mask = bitmask[chunk.start - slab.start:chunk.stop - slab.start]
+            for field, operator, value in selectors:
+                if not mask.any():
+                    break
+                values = np.asanyarray(cov._range_value[field][chunk])
+                expression = ' '.join(['values', operator, value])
+                mask &= ne.evaluate(expression)
 
         return bitmask
 
-    def get_dataset(self, cov, fields, slices, selectors, dataset, response):
+    def get_dataset(self, cov, fields, slices, selectors, dataset, response, dataset_id=None):
         seq = SequenceType('data')
-        bitmask = self.get_bitmask(cov, fields, slices, selectors)
+        metadata = self.get_metadata(cov, dataset_id)
+        slab, selectors = self.get_time_slab(cov, selectors, dataset_id)
+        bitmask = self.get_bitmask(cov, fields, slices, selectors, slab)
         if self.is_too_large(bitmask, len(fields)):
             log.error('Client request too large. \nFields: %s\nSelectors: %s', fields, selectors)
             return
@@ -235,8 +422,8 @@ class Handler(BaseHandler):
             if re.match(r'.*_[a-z0-9]{32}', name):
                 continue # Let's not do this
             try:
-                data = self.get_data(cov, name, bitmask)
-                attrs  = self.get_attrs(cov, name)
+                data = self.get_data(cov, name, bitmask, slab)
+                attrs  = dict(metadata[name][2])
                 if isinstance(pc.param_type, QuantityType):
                     data, dtype = self.filter_data(data)
                     seq[name] = self.make_series(response, name, data, attrs, dtype)
@@ -244,18 +431,7 @@ class Handler(BaseHandler):
                     data, dtype = self.filter_data(data)
                     seq[name] = self.make_series(response, name, data, attrs, dtype)
                 elif isinstance(pc.param_type, ConstantRangeType):
-                    #start = time.time()
-                    #convert to string
-                    try:
-                        #scalar case
-                        if data.shape == (2,):
-                            data = np.atleast_1d('_'.join([str(data[0]), str(data[1])]))
-                        else:
-                            for i,d in enumerate(data):
-                                f = [str(d[0]),str(d[1])]
-                                data[i] = '_'.join(f)
-                    except Exception, e:
-                        data = np.asanyarray(['None' for d in data])
+                    data = self.range_stringify(data)
                     seq[name] = self.make_series(response, name, data, attrs, 'S')
                 elif isinstance(pc.param_type,BooleanType):
                     data, dtype = self.filter_data(data)
@@ -305,9 +481,10 @@ class Handler(BaseHandler):
             return 'S'
         return self.value_encoding_to_dap_type(context.param_type.value_encoding)
 
-    def handle_dds(self, coverage, dataset, fields):
+    def handle_dds(self, coverage, dataset, fields, dataset_id=None):
         cov = coverage
         seq = SequenceType('data')
+        metadata = self.get_metadata(cov, dataset_id)
 
         for name in fields:
             # Strip the data. from the field
@@ -318,11 +495,10 @@ class Handler(BaseHandler):
             if re.match(r'.*_[a-z0-9]{32}', name):
                 continue # Let's not do this
             try:
-                context = coverage.get_parameter_context(name)
-                attrs = self.get_attrs(cov, name)
+                context, dap_type, attrs = metadata[name]
 
                 #grid[name] = BaseType(name=name, type=self.dap_type(context), attributes=attrs, dimensions=(time_name,), shape=(coverage.num_timesteps,))
-                seq[name] = BaseType(name=name, type=self.dap_type(context), attributes=attrs, shape=(coverage.num_timesteps,))
+                seq[name] = BaseType(name=name, type=dap_type, attributes=dict(attrs), shape=(coverage.num_timesteps,))
                 #grid[cov.temporal_parameter_name] = time_base
             except Exception:
                 log.exception('Problem reading cov %s', str(cov))
@@ -413,10 +589,10 @@ class Handler(BaseHandler):
         if not fields:
             fields = all_vars
         if response == "dods":
-            dataset = self.get_dataset(coverage, fields, slices, selectors, dataset, response)
+            dataset = self.get_dataset(coverage, fields, slices, selectors, dataset, response, base[1])
 
         elif response in ('dds', 'das'):
-            self.handle_dds(coverage, dataset, fields)
+            self.handle_dds(coverage, dataset, fields, base[1])
         return dataset
     
     def none_to_str(self, data):
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+'''
+@file ion/util/pydap/handlers/coverage/test/test_coverage_handler.py
+@brief Tests and benchmarks for the coverage DAP handler
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from pyon.util.containers import DotDict
+from pyon.util.log import log
+from ion.util.pydap.handlers.coverage.coverage_handler import Handler
+from ion.util.test.benchmark_helper import best_of
+from ion.services.dm.utility.time_index import TimeIndex
+from coverage_model.parameter_types import QuantityType
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+
+import numpy as np
+
+
+def ranges(size):
+    data = np.empty(size, dtype='object')
+    for i in xrange(size):
+        data[i] = (i * 0.5, i + 1)
+    return data
+
+
+class RangeValue(object):
+    '''
+    Records the index ranges read from a parameter
+    '''
+    def __init__(self, values):
+        self.values = values
+        self.reads = []
+
+    def __getitem__(self, slice_):
+        self.reads.append(slice_)
+        return self.values[slice_]
+
+
+@attr('UNIT', group='dm')
+class CoverageHandlerTest(PyonTestCase):
+    def setUp(self):
+        self.handler = Handler('/tmp/coverage')
+        self.handler.CHUNK_SIZE = 10
+        self.cov = Mock()
+        self.cov.num_timesteps = 100
+        self.cov.temporal_parameter_name = 'time'
+        self.cov._range_value = {'time' : RangeValue(np.arange(100, dtype='float64')),
+                                 'temp' : RangeValue(np.arange(100, dtype='float32') * 2)}
+        self.cov._range_dictionary = {'time' : DotDict(param_type=QuantityType(value_encoding='float64')),
+                                      'temp' : DotDict(param_type=QuantityType(value_encoding='float32'))}
+
+    def test_time_slab(self):
+        slab, selectors = self.handler.get_time_slab(self.cov, ['data.time>=20', 'data.time<35', 'data.temp>50'])
+        self.assertEquals(slab, slice(20, 35))
+        self.assertEquals(selectors, ['data.temp>50'])
+
+        slab, selectors = self.handler.get_time_slab(self.cov, ['time>20', 'time<=35'])
+        self.assertEquals(slab, slice(21, 36))
+        slab, selectors = self.handler.get_time_slab(self.cov, ['time=42'])
+        self.assertEquals(slab, slice(42, 43))
+        slab, selectors = self.handler.get_time_slab(self.cov, ['time>200'])
+        self.assertEquals(slab, slice(100, 100))
+
+        # Unsorted time axis, the selector is evaluated as a bitmask instead
+        self.cov._range_value['time'].values[-1] = -9999
+        slab, selectors = self.handler.get_time_slab(self.cov, ['time>=20'])
+        self.assertEquals(slab, slice(0, 100))
+        self.assertEquals(selectors, ['time>=20'])
+
+    def test_time_slab_index(self):
+        time_index = TimeIndex.new('time', '')
+        for i in xrange(0, 100, 10):
+            time_index.append(i, self.cov._range_value['time'].values[i:i+10])
+        with patch('ion.util.pydap.handlers.coverage.coverage_handler.DataRetrieverService') as drs:
+            drs._get_time_index.return_value = time_index
+            slab, selectors = self.handler.get_time_slab(self.cov, ['time>=20', 'time<35', 'temp>50'], 'dataset_id')
+            self.assertEquals(slab, slice(20, 40))
+            self.assertEquals(selectors, ['time>=20', 'time<35', 'temp>50'])
+            slab, selectors = self.handler.get_time_slab(self.cov, ['time>200'], 'dataset_id')
+            self.assertEquals(slab, slice(0, 0))
+            # The time axis is not read
+            self.assertEquals(self.cov._range_value['time'].reads, [])
+
+            # Out of date index, the time axis is read instead
+            self.cov.num_timesteps = 110
+            slab, selectors = self.handler.get_time_slab(self.cov, ['time>=20'], 'dataset_id')
+            self.assertEquals(drs._get_time_index.call_args[1], {'refresh' : True})
+            self.assertEquals(selectors, [])
+            self.assertEquals(len(self.cov._range_value['time'].reads), 1)
+
+    def test_slab_reads(self):
+        slab, selectors = self.handler.get_time_slab(self.cov, ['time>=20', 'time<45', 'temp>60'])
+        bitmask = self.handler.get_bitmask(self.cov, ['temp'], [], selectors, slab)
+        self.assertEquals(len(bitmask), 25)
+        self.assertEquals(self.cov._range_value['temp'].reads, [slice(20, 30), slice(30, 40), slice(40, 45)])
+
+        self.cov._range_value['temp'].reads = []
+        data = self.handler.get_data(self.cov, 'temp', bitmask, slab)
+        np.testing.assert_array_equal(data, np.arange(31, 45, dtype='float32') * 2)
+        # The chunk without selected timesteps is not read
+        self.assertEquals(self.cov._range_value['temp'].reads, [slice(30, 40), slice(40, 45)])
+
+        data = self.handler.get_data(self.cov, 'temp', np.zeros(0, dtype=bool), slice(100, 100))
+        self.assertEquals(data.shape, (0,))
+        self.assertEquals(data.dtype, np.dtype('float32'))
+
+    def test_short_chunk(self):
+        # A parameter holding fewer values than the coverage has timesteps
+        self.cov._range_value['temp'] = RangeValue(np.arange(35, dtype='float32'))
+        self.cov._range_dictionary['temp'].fill_value = -9999
+        bitmask = np.zeros(50, dtype=bool)
+        bitmask[[5, 25, 34, 35, 45]] = True
+        data = self.handler.get_data(self.cov, 'temp', bitmask)
+        np.testing.assert_array_equal(data, [5, 25, 34, -9999, -9999])
+        self.assertEquals(len(data), len(self.handler.get_data(self.cov, 'time', bitmask)))
+
+    def assertStrings(self, strings, expected):
+        self.assertEquals(list(strings), list(expected))
+
+    def test_stringify(self):
+        floats = np.array([[0.1, 1.0, -0.0], [1/3., 1e20, np.nan], [123456789012345., np.inf, -2.5e-7]])
+        self.assertStrings(self.handler.ndim_stringify(floats), ['0.1,1.0,-0.0', '0.333333333333,1e+20,nan', '1.23456789012e+14,inf,-2.5e-07'])
+        self.assertStrings(self.handler.ndim_stringify(floats[:1].astype('float32')), ['0.10000000149,1.0,-0.0'])
+        self.assertStrings(self.handler.ndim_stringify(np.arange(-3, 3, dtype='int16').reshape(2, 3)), ['-3,-2,-1', '0,1,2'])
+        self.assertStrings(self.handler.ndim_stringify(np.array([[True, False]])), ['True,False'])
+        self.assertStrings(self.handler.ndim_stringify(np.arange(8).reshape(2, 2, 2)), ['[0, 1],[2, 3]', '[4, 5],[6, 7]'])
+
+        self.assertStrings(self.handler.stringify(np.array([1+2j, 3])), ['(1+2j)', '(3+0j)'])
+        objects = np.array([None, 'a', [1, 2], 1.5], dtype='object')
+        self.assertStrings(self.handler.stringify_inplace(objects), ['None', 'a', '[1, 2]', '1.5'])
+
+        self.assertStrings(self.handler.range_stringify(ranges(3)), ['0.0_1', '0.5_2', '1.0_3'])
+        self.assertStrings(self.handler.range_stringify(np.array([[0, 1.5], [2, 3]])), np.array(['0.0_1.5', '2.0_3.0']))
+        self.assertStrings(self.handler.range_stringify(np.array([1, 2])), np.array(['1_2']))
+
+    def test_metadata_cache(self):
+        Handler.clear_metadata()
+        self.addCleanup(Handler.clear_metadata)
+        context = DotDict(param_type=QuantityType(value_encoding='float32'), uom='deg_C', display_name='Temperature')
+        self.cov.list_parameters.return_value = ['temp']
+        self.cov.get_parameter_context.return_value = context
+
+        metadata = self.handler.get_metadata(self.cov, 'dataset_1')
+        self.assertEquals(metadata['temp'][1:], ('f', {'units':'deg_C', 'long_name':'Temperature'}))
+        self.assertTrue(Handler('/tmp/coverage').get_metadata(self.cov, 'dataset_1') is metadata)
+        self.assertEquals(self.cov.get_parameter_context.call_count, 2)
+
+        # New parameters invalidate the entry
+        self.cov.list_parameters.return_value = ['temp', 'time']
+        self.assertEquals(set(self.handler.get_metadata(self.cov, 'dataset_1')), set(['temp', 'time']))
+
+
+@attr('UTIL', group='dm')
+class CoverageHandlerBenchmark(PyonTestCase):
+    records = 100000
+
+    def rate(self, label, stringify, baseline, data):
+        '''
+        Logs the rows/s of stringify against a plain per-element str() baseline
+        '''
+        elapsed = best_of(lambda : stringify(data.copy()))
+        baseline_elapsed = best_of(lambda : baseline(data.copy()))
+        log.info('%s (%s records): %.4fs (%.0f rows/s), per-element str() %.4fs (%.0f rows/s), %.1fx',
+                 label, self.records, elapsed, self.records / elapsed,
+                 baseline_elapsed, self.records / baseline_elapsed, baseline_elapsed / elapsed)
+
+    def test_stringify(self):
+        handler = Handler('/tmp/coverage')
+        per_element = lambda data : [str(x) for x in data]
+        per_row = lambda sep : lambda data : [sep.join([str(x) for x in row]) for row in data.tolist()]
+        for width in (2, 10):
+            self.rate('ArrayType float64 x %s' % width, handler.ndim_stringify, per_row(','), np.random.random((self.records, width)))
+            self.rate('ArrayType int32 x %s' % width, handler.ndim_stringify, per_row(','), np.random.randint(0, 1000, (self.records, width)).astype('int32'))
+        self.rate('QuantityType complex', handler.stringify, per_element, np.random.random(self.records) * 1j)
+        self.rate('RecordType objects', handler.stringify_inplace, per_element, np.array([{'a' : i} for i in xrange(self.records)], dtype='object'))
+        self.rate('ConstantRangeType tuples', handler.range_stringify, lambda data : ['%s_%s' % (d[0], d[1]) for d in data], ranges(self.records))
+        self.rate('ConstantRangeType float64 x 2', handler.range_stringify, per_row('_'), np.random.random((self.records, 2)))
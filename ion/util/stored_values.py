@@ -6,6 +6,7 @@
 '''
 
 from pyon.core.exception import NotFound
+from pyon.util.log import log
 import gevent
 
 
@@ -45,3 +46,66 @@ class StoredValueManager(object):
         self.store.delete_doc(doc_key)
 
 
+
+class StoredValueCache(object):
+    '''
+    Read-through cache of lookup documents kept by a StoredValueManager.
+
+    Documents are fetched in bulk with read_value_mult the first time they are
+    needed and served from memory afterwards. Keys reported by an
+    ExternalReferencesUpdatedEvent are handed to add_keys, which (re)fetches only
+    those documents on the next lookup. Missing documents are remembered as misses
+    until they are invalidated the same way.
+    '''
+    def __init__(self, stored_value_manager, doc_keys=None):
+        self.stored_value_manager = stored_value_manager
+        self.doc_keys = []
+        self._documents = {}
+        self._stale = set()
+        self._warned = set()
+        self.add_keys(doc_keys or [])
+
+    def add_keys(self, doc_keys):
+        '''
+        Adds lookup document keys ahead of the existing ones and marks them stale
+        '''
+        doc_keys = [k for i,k in enumerate(doc_keys) if k not in doc_keys[:i]]
+        self.doc_keys = doc_keys + [k for k in self.doc_keys if k not in doc_keys]
+        self._stale.update(doc_keys)
+
+    def invalidate(self, doc_keys=None):
+        '''
+        Marks the documents (all of them by default) to be fetched again on their next use
+        '''
+        if doc_keys is None:
+            doc_keys = self._documents.keys()
+        self._stale.update(doc_keys)
+
+    def prefetch(self):
+        '''
+        Fetches every stale or unseen lookup document in one read
+        '''
+        missing = [k for k in self.doc_keys if k in self._stale or k not in self._documents]
+        if not missing:
+            return
+        doc_list = self.stored_value_manager.read_value_mult(missing)
+        for key, doc in zip(missing, doc_list):
+            if doc is None:
+                if key not in self._warned:
+                    log.warning('Specified lookup document %s does not exist', key)
+                    self._warned.add(key)
+            else:
+                self._warned.discard(key)
+            self._documents[key] = doc
+            self._stale.discard(key)
+
+    def lookup(self, lookup_value):
+        '''
+        Returns the value of lookup_value in the first lookup document containing it
+        '''
+        self.prefetch()
+        for key in self.doc_keys:
+            document = self._documents.get(key)
+            if document is not None and lookup_value in document:
+                return document[lookup_value]
+        return None
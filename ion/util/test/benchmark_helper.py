@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+'''
+@file ion/util/test/benchmark_helper.py
+@brief Timing helpers shared by the UTIL benchmarks
+'''
+
+import time
+
+
+def best_of(func, repeat=3, number=5):
+    '''
+    Returns the best average time of func over repeat runs of number calls
+    '''
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(number):
+            func()
+        timings.append((time.time() - start) / number)
+    return min(timings)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+'''
+@file ion/util/test/test_stored_values.py
+@brief Tests for the cached lookup document reads
+'''
+
+from pyon.util.unit_test import PyonTestCase
+from ion.util.stored_values import StoredValueCache
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+
+
+@attr('UNIT', group='dm')
+class StoredValueCacheTest(PyonTestCase):
+    def setUp(self):
+        self.documents = {'cal_a' : {'offset_a' : 1.0},
+                          'cal_b' : {'offset_a' : 2.0, 'offset_b' : 3.0}}
+        self.svm = Mock()
+        self.svm.read_value_mult.side_effect = lambda keys, strict=False : [self.documents.get(k) for k in keys]
+
+    def test_lookup(self):
+        cache = StoredValueCache(self.svm, ['cal_a', 'cal_b', 'cal_c'])
+        self.assertEquals(cache.lookup('offset_a'), 1.0)
+        self.assertEquals(cache.lookup('offset_b'), 3.0)
+        self.assertEquals(cache.lookup('offset_c'), None)
+        # Every document was fetched in one read, the missing one is remembered as a miss
+        self.assertEquals(self.svm.read_value_mult.call_count, 1)
+        self.assertEquals(sorted(self.svm.read_value_mult.call_args[0][0]), ['cal_a', 'cal_b', 'cal_c'])
+
+    @patch('ion.util.stored_values.log')
+    def test_missing_document(self, log_mock):
+        cache = StoredValueCache(self.svm, ['cal_c', 'cal_a'])
+        self.assertEquals(cache.lookup('offset_a'), 1.0)
+        cache.invalidate()
+        self.assertEquals(cache.lookup('offset_a'), 1.0)
+        self.assertEquals(log_mock.warning.call_count, 1)
+
+        # The miss is cleared like any other document once the key is reported
+        self.documents['cal_c'] = {'offset_a' : 5.0}
+        cache.add_keys(['cal_c'])
+        self.assertEquals(cache.lookup('offset_a'), 5.0)
+        self.assertEquals(self.svm.read_value_mult.call_args[0][0], ['cal_c'])
+
+    def test_add_keys(self):
+        cache = StoredValueCache(self.svm, ['cal_a', 'cal_b'])
+        self.assertEquals(cache.lookup('offset_a'), 1.0)
+
+        # An updated document is only read again once reported
+        self.documents['cal_b'] = {'offset_a' : 4.0}
+        self.assertEquals(cache.lookup('offset_a'), 1.0)
+        self.assertEquals(self.svm.read_value_mult.call_count, 1)
+
+        cache.add_keys(['cal_b'])
+        self.assertEquals(cache.doc_keys, ['cal_b', 'cal_a'])
+        self.assertEquals(cache.lookup('offset_a'), 4.0)
+        self.assertEquals(self.svm.read_value_mult.call_args[0][0], ['cal_b'])
+
+        cache.invalidate()
+        cache.lookup('offset_a')
+        self.assertEquals(sorted(self.svm.read_value_mult.call_args[0][0]), ['cal_a', 'cal_b'])
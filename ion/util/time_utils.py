@@ -41,6 +41,38 @@ class TimeUtils(object):
             return val
 
 
+    @classmethod
+    def ts_to_units_mult(cls, units, vals):
+        '''
+        Converts an array of unix timestamps into the given units.
+        Units of the form "<unit> since <epoch>" are linear in the timestamp,
+        so the conversion is done with one scale and offset for the whole array.
+        '''
+        vals = np.asanyarray(vals, dtype='float64')
+        linear = cls.linear_units(units)
+        if linear is None:
+            return np.array([cls.ts_to_units(units, val) for val in vals])
+        scale, offset = linear
+        return offset + vals * scale
+
+    @classmethod
+    def linear_units(cls, units):
+        '''
+        Returns (scale, offset) such that units = offset + scale * timestamp,
+        or None if the units aren't linear in the timestamp (ISO strings).
+        '''
+        if 'iso' in units:
+            return None
+        elif 'seconds since 1900-01-01' == units:
+            return 1., 2208988800.
+        elif 'since' in units:
+            span = 86400. * 365
+            offset = cls.ts_to_units(units, 0)
+            scale = (cls.ts_to_units(units, span) - offset) / span
+            return scale, offset
+        else:
+            return 1., 0.
+
     @classmethod
     def units_to_ts(cls, units, val):
         '''
@@ -67,3 +99,24 @@ class TimeUtils(object):
         '''
         idx = np.abs(arr-val).argmin()
         return idx
+
+    @classmethod
+    def find_nearest_mult(cls, arr, vals):
+        '''
+        Vectorized find_nearest: returns the index of the best matching value in arr
+        for each value in vals, using a binary search over the sorted array.
+        '''
+        arr = np.asanyarray(arr)
+        vals = np.atleast_1d(vals)
+        if arr.size < 2:
+            return np.zeros(vals.shape, dtype='int64')
+        order = None
+        if not (arr[1:] >= arr[:-1]).all(): # Time is almost always monotonic, only sort if it isn't
+            order = np.argsort(arr, kind='mergesort')
+            arr = arr[order]
+        right = np.clip(np.searchsorted(arr, vals), 1, arr.size - 1)
+        left = right - 1
+        idx = np.where(np.abs(vals - arr[left]) <= np.abs(arr[right] - vals), left, right)
+        if order is not None:
+            idx = order[idx]
+        return idx